@@ -0,0 +1,107 @@
+"""
+Latency, throughput and peak memory of copy and paste, per backend and payload size.
+
+Requires ``pytest-benchmark`` (``pip install pyclip[benchmark]``). Run from the repository root with::
+
+    python -m pytest benchmarks
+    python -m pytest benchmarks --benchmark-save=baseline          # keep the results ...
+    python -m pytest benchmarks --benchmark-compare=0001_baseline  # ... and compare a later run against them
+
+``xclip`` runs against the current X display, or a fresh ``Xvfb`` when there is none. ``wl-clipboard`` and
+``pbcopy``/``pbpaste`` run against the stand-in helpers in ``stubs/``. Payloads range from 1 B to 1 GB; those
+over 64 MB only run when ``PYCLIP_BENCH_MAX_SIZE`` allows them (e.g. ``PYCLIP_BENCH_MAX_SIZE=1G``).
+
+Each result's ``extra_info`` holds the throughput (``MB/s``, from the mean), the peak Python heap allocated
+by one call (``peak_python_bytes``, via tracemalloc) and the largest resident set of any helper process
+so far (``peak_helper_rss_bytes``, POSIX only).
+"""
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+from conftest import GB, KB, MAX_SIZE, MB
+
+pytest.importorskip('pytest_benchmark')
+
+SIZES = [1, KB, 64 * KB, MB, 16 * MB, 64 * MB, 256 * MB, GB]
+#: payloads from this size on are timed once instead of calibrated over many rounds
+_LARGE = 16 * MB
+
+
+def _size_id(size: int) -> str:
+    for unit, name in ((GB, 'GB'), (MB, 'MB'), (KB, 'KB')):
+        if size >= unit:
+            return f'{size // unit}{name}'
+    return f'{size}B'
+
+
+def _payload(size: int, kind: str):
+    """
+    ``binary``: random bytes; ``text``: ASCII bytes; ``str``: the same text as str
+    """
+    if kind == 'binary':
+        return os.urandom(size)
+    text = (b'pyclip benchmark payload\n' * (size // 25 + 1))[:size]
+    return text.decode() if kind == 'str' else text
+
+
+def _helper_maxrss() -> int:
+    try:
+        import resource
+    except ImportError:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # kilobytes on Linux
+
+
+def _run(benchmark, size, func, *args, **kwargs):
+    if size >= _LARGE:
+        benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=3 if size < GB else 1, iterations=1)
+    else:
+        benchmark(func, *args, **kwargs)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['payload_bytes'] = size
+    if benchmark.stats is not None:  # None under --benchmark-disable, where the function only runs once
+        benchmark.extra_info['MB/s'] = size / MB / benchmark.stats.stats.mean
+    benchmark.extra_info['peak_python_bytes'] = peak
+    benchmark.extra_info['peak_helper_rss_bytes'] = _helper_maxrss()
+
+
+@pytest.fixture(params=SIZES, ids=_size_id)
+def size(request):
+    if request.param > MAX_SIZE:
+        pytest.skip(f'payloads over {_size_id(MAX_SIZE)} are disabled (see PYCLIP_BENCH_MAX_SIZE)')
+    return request.param
+
+
+@pytest.mark.parametrize('kind', ['binary', 'text', 'str'])
+def bench_copy(benchmark, clipboard, size, kind):
+    benchmark.group = f'copy-{kind}'
+    _run(benchmark, size, clipboard.copy, _payload(size, kind))
+
+
+@pytest.mark.parametrize('kind', ['binary', 'text'])
+def bench_paste(benchmark, clipboard, size, kind):
+    benchmark.group = f'paste-{kind}'
+    clipboard.copy(_payload(size, kind))
+    _run(benchmark, size, clipboard.paste)
+
+
+def bench_paste_text(benchmark, clipboard, size):
+    benchmark.group = 'paste-str'
+    clipboard.copy(_payload(size, 'text'))
+    _run(benchmark, size, clipboard.paste, text=True)
+
+
+def bench_paste_into(benchmark, clipboard, size):
+    benchmark.group = 'paste-into'
+    clipboard.copy(_payload(size, 'binary'))
+    buffer = bytearray(size)
+    _run(benchmark, size, clipboard.paste_into, buffer)
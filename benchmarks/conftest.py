@@ -0,0 +1,105 @@
+"""
+Fixtures for the clipboard benchmarks. See ``bench_clipboard.py``.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+
+def _parse_size(value: str) -> int:
+    units = {'K': KB, 'M': MB, 'G': GB}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+#: payloads larger than this are skipped. Set PYCLIP_BENCH_MAX_SIZE (e.g. ``1G``) to include them.
+MAX_SIZE = _parse_size(os.environ.get('PYCLIP_BENCH_MAX_SIZE', '64M'))
+
+
+@pytest.fixture(scope='session')
+def xvfb_display():
+    """
+    A headless X display: the current one if ``DISPLAY`` is set, otherwise a fresh ``Xvfb``
+    """
+    if os.environ.get('DISPLAY'):
+        yield os.environ['DISPLAY']
+        return
+    if not shutil.which('Xvfb'):
+        pytest.skip('needs DISPLAY or Xvfb')
+    display = f':{100 + os.getpid() % 1000}'
+    proc = subprocess.Popen(
+        ['Xvfb', display, '-screen', '0', '640x480x8', '-nolisten', 'tcp'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    socket_path = f'/tmp/.X11-unix/X{display[1:]}'
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            pytest.skip('Xvfb did not start')
+        time.sleep(0.05)
+    os.environ['DISPLAY'] = display
+    try:
+        yield display
+    finally:
+        del os.environ['DISPLAY']
+        proc.terminate()
+        proc.wait()
+
+
+@pytest.fixture
+def stub_helpers(tmp_path, monkeypatch):
+    """
+    Put the stand-in ``wl-copy``/``wl-paste``/``pbcopy``/``pbpaste`` first on PATH. They keep the clipboard in a file,
+    so these benchmarks measure pyclip's own overhead plus process startup.
+    """
+    monkeypatch.setenv('PATH', STUBS + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.setenv('PYCLIP_STUB_CLIPBOARD', str(tmp_path / 'clipboard'))
+    (tmp_path / 'clipboard').write_bytes(b'')
+
+
+def _xclip(request):
+    if sys.platform != 'linux' or not shutil.which('xclip'):
+        pytest.skip('needs xclip')
+    request.getfixturevalue('xvfb_display')
+    from pyclip.xclip_clip import XclipClipboard
+
+    return XclipClipboard()
+
+
+def _wl_clipboard(request):
+    request.getfixturevalue('stub_helpers')
+    from pyclip.wayland_clip import WaylandClipboard
+
+    return WaylandClipboard()
+
+
+def _pbcopy(request):
+    request.getfixturevalue('stub_helpers')
+    from pyclip.macos_clip import _PBCopyPBPasteBackend
+
+    return _PBCopyPBPasteBackend()
+
+
+BACKENDS = {'xclip': _xclip, 'wl-clipboard': _wl_clipboard, 'pbcopy': _pbcopy}
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def clipboard(request):
+    """
+    Each benchmarked clipboard implementation, set up in its headless environment
+    """
+    return BACKENDS[request.param](request)
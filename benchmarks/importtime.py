@@ -0,0 +1,58 @@
+"""
+Measure the startup cost of ``import pyclip`` and of the ``pyclip`` CLI module with ``python -X importtime``.
+
+Usage::
+
+    python benchmarks/importtime.py [--runs N] [--top N]
+
+Each module is imported in a fresh interpreter ``--runs`` times. The median cumulative import time is reported,
+together with the slowest imports of the last run. Importing pyclip must not import any clipboard backend;
+those are only loaded when the clipboard is first used.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ('pyclip', 'pyclip.cli')
+
+
+def importtime(module: str):
+    """
+    Import ``module`` in a new interpreter and return ``{imported module: cumulative microseconds}``
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:') :].split('|')
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per module (default: 10)')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to show (default: 10)')
+    args = parser.parse_args()
+    for module in MODULES:
+        runs = [importtime(module) for _ in range(args.runs)]
+        median = statistics.median(run[module] for run in runs)
+        print(f'{module}: {median / 1000:.1f} ms (median of {args.runs})')
+        slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)
+        for name, cumulative in slowest[1 : args.top + 1]:
+            print(f'    {cumulative / 1000:8.1f} ms  {name}')
+        backends = sorted(name for name in runs[-1] if name.startswith('pyclip.') and name.endswith('_clip'))
+        if backends:
+            print(f'    warning: backends imported eagerly: {", ".join(backends)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -11,39 +11,95 @@
 #     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
+"""
+Cross-platform clipboard utilities supporting both binary and text data.
+
+The clipboard implementation is detected on first use (see :py:func:`pyclip.util.detect_clipboard`),
+so importing pyclip does not import any backend or look for helper programs.
+"""
 import sys
-from .util import detect_clipboard
-from .base import ClipboardSetupException
+import threading
+from .base import ClipboardBase, ClipboardSetupException
 from functools import wraps
-try:
-    DEFAULT_CLIPBOARD = detect_clipboard()
-except ClipboardSetupException as e:
-    DEFAULT_CLIPBOARD = None
-    _CLIPBOARD_EXCEPTION_TB = sys.exc_info()[2]
+
+_DEFAULT_CLIPBOARD = None
+_CLIPBOARD_EXCEPTION_TB = None
+_DETECTED = False
+_DETECT_LOCK = threading.Lock()
+
+
+def _default_clipboard():
+    global _DEFAULT_CLIPBOARD, _CLIPBOARD_EXCEPTION_TB, _DETECTED
+    if not _DETECTED:
+        with _DETECT_LOCK:
+            if not _DETECTED:
+                from .util import detect_clipboard
+                try:
+                    _DEFAULT_CLIPBOARD = detect_clipboard()
+                except ClipboardSetupException:
+                    _CLIPBOARD_EXCEPTION_TB = sys.exc_info()[2]
+                _DETECTED = True
+    return _DEFAULT_CLIPBOARD
+
+
+def _get_clipboard():
+    clipboard = _default_clipboard()
+    if clipboard is None:
+        raise ClipboardSetupException("Could not setup clipboard").with_traceback(_CLIPBOARD_EXCEPTION_TB)
+    return clipboard
+
+
+def __getattr__(name):
+    # DEFAULT_CLIPBOARD is detected when first accessed
+    if name == 'DEFAULT_CLIPBOARD':
+        return _default_clipboard()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def wrapif(f):
-    if DEFAULT_CLIPBOARD is not None:
-        wrapped = getattr(DEFAULT_CLIPBOARD, f.__name__)
-        wrapper = wraps(wrapped)
-        return wrapper(f)
-    return f
+    return wraps(getattr(ClipboardBase, f.__name__))(f)
+
 
 @wrapif
 def copy(*args, **kwargs):
-    if DEFAULT_CLIPBOARD is None:
-        raise ClipboardSetupException("Could not setup clipboard").with_traceback(_CLIPBOARD_EXCEPTION_TB)
-    return DEFAULT_CLIPBOARD.copy(*args, **kwargs)
+    return _get_clipboard().copy(*args, **kwargs)
 
 
 @wrapif
 def paste(*args, **kwargs):
-    if DEFAULT_CLIPBOARD is None:
-        raise ClipboardSetupException("Could not setup clipboard").with_traceback(_CLIPBOARD_EXCEPTION_TB)
-    return DEFAULT_CLIPBOARD.paste(*args, **kwargs)
+    return _get_clipboard().paste(*args, **kwargs)
 
 
 @wrapif
 def clear(*args, **kwargs):
-    if DEFAULT_CLIPBOARD is None:
-        raise ClipboardSetupException("Could not setup clipboard").with_traceback(_CLIPBOARD_EXCEPTION_TB)
-    return DEFAULT_CLIPBOARD.clear(*args, **kwargs)
+    return _get_clipboard().clear(*args, **kwargs)
+
+
+@wrapif
+def copy_stream(*args, **kwargs):
+    return _get_clipboard().copy_stream(*args, **kwargs)
+
+
+@wrapif
+def iter_paste(*args, **kwargs):
+    return _get_clipboard().iter_paste(*args, **kwargs)
+
+
+@wrapif
+def paste_into(*args, **kwargs):
+    return _get_clipboard().paste_into(*args, **kwargs)
+
+
+@wrapif
+def paste_to_file(*args, **kwargs):
+    return _get_clipboard().paste_to_file(*args, **kwargs)
+
+
+@wrapif
+def watch(*args, **kwargs):
+    return _get_clipboard().watch(*args, **kwargs)
+
+
+@wrapif
+def session(*args, **kwargs):
+    return _get_clipboard().session(*args, **kwargs)
@@ -0,0 +1,204 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Provides an asyncio API for the clipboard.
+
+Helper-based implementations (``xclip``, ``wl-clipboard``, ``pbcopy``/``pbpaste``) run their helpers with
+``asyncio.create_subprocess_exec``, so no thread is tied up while they run. When the spawn server
+(:py:mod:`pyclip.spawn`) is running, the helpers are started by it instead, and waited for in the event loop's
+default executor. Other implementations (Windows, ``pasteboard``, and the native X11/Wayland clients) are called
+in the default executor.
+
+.. code-block:: python
+
+    import pyclip.aio
+
+    await pyclip.aio.copy('hello clipboard')
+    assert await pyclip.aio.paste() == b'hello clipboard'
+"""
+import asyncio
+import functools
+import locale
+import warnings
+from typing import Dict, List, Optional, Tuple, Union
+
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException, SubprocessClipboardBase, _byte_view
+
+
+class AsyncClipboard:
+    """
+    Asynchronous interface to a clipboard implementation.
+
+    :param clipboard: the clipboard implementation to use. Defaults to ``pyclip.DEFAULT_CLIPBOARD``.
+    """
+
+    def __init__(self, clipboard: ClipboardBase = None):
+        if clipboard is None:
+            import pyclip
+
+            clipboard = pyclip.DEFAULT_CLIPBOARD
+            if clipboard is None:
+                raise ClipboardSetupException("Could not setup clipboard")
+        backend = getattr(clipboard, 'backend', None)  # MacOSClip defers to a backend
+        if isinstance(backend, ClipboardBase):
+            clipboard = backend
+        self.clipboard = clipboard
+
+    async def _run_in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def _run_spawned(args: List[str], input: bytes = None) -> Tuple[int, bytes, bytes]:
+        import subprocess
+        from . import spawn
+
+        if input is None:
+            proc = spawn.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            proc = spawn.Popen(args, stdin=subprocess.PIPE)
+        stdout, stderr = proc.communicate(input)
+        return proc.returncode, stdout, stderr
+
+    async def _run(self, args: List[str], input: bytes = None) -> Tuple[int, bytes, bytes]:
+        from . import spawn
+
+        if spawn.is_running():
+            return await self._run_in_executor(self._run_spawned, args, input)
+        if input is None:
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        else:
+            # The copy helpers may leave a child behind that holds the selection; it must not
+            # inherit pipes we wait on, so only stdin is captured (as in the synchronous backends).
+            proc = await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.PIPE)
+        stdout, stderr = await proc.communicate(input)
+        return proc.returncode, stdout, stderr
+
+    async def _negotiate_mime(self) -> Optional[str]:
+        clipboard = self.clipboard
+        targets_args = clipboard._targets_args()
+        if targets_args is None:
+            return None
+        targets = clipboard._cached_targets()
+        if targets is None:
+            returncode, stdout, _ = await self._run(targets_args)
+            targets = clipboard._remember_targets(stdout.decode() if returncode == 0 else '')
+        return clipboard._select_target(targets)
+
+    async def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str = None) -> None:
+        """
+        Copy data into the clipboard
+
+        :param data: the data to be copied to the clipboard. Can be str or bytes, or a dict mapping MIME types
+            to data (see :py:meth:`pyclip.base.ClipboardBase.copy`).
+        :param encoding: the encoding used for ``str`` data. Defaults to the locale's preferred encoding.
+        :return: None
+        """
+        clipboard = self.clipboard
+        if not isinstance(clipboard, SubprocessClipboardBase):
+            return await self._run_in_executor(clipboard.copy, data, encoding=encoding)
+        mime = None
+        if isinstance(data, dict):
+            mime, data = clipboard._single_format(data, encoding)
+        elif isinstance(data, str):
+            data = data.encode(encoding or locale.getpreferredencoding(False))
+        else:
+            if not isinstance(data, bytes):
+                data = _byte_view(data)
+            if encoding is not None:
+                warnings.warn(
+                    "encoding specified with a bytes argument. "
+                    "Encoding option will be ignored. "
+                    "To remove this warning, omit the encoding parameter or specify it as None",
+                    stacklevel=2,
+                )
+        returncode, _, _ = await self._run(clipboard._copy_args(mime), input=data)
+        if returncode != 0:
+            raise ClipboardException(f"Copy failed. {clipboard._copy_helper_name} returned code: {returncode!r}")
+
+    async def paste(
+        self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None
+    ) -> Union[str, bytes]:
+        """
+        Retrieve data from the clipboard
+
+        :param encoding: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param text: if True, the contents are decoded and returned as str
+        :param errors: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param mime: the MIME type to retrieve, if the implementation supports choosing one
+        :return: the clipboard contents. return type is binary by default.
+            If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
+        """
+        clipboard = self.clipboard
+        if not isinstance(clipboard, SubprocessClipboardBase):
+            kwargs = {'mime': mime} if mime is not None else {}
+            return await self._run_in_executor(clipboard.paste, encoding=encoding, text=text, errors=errors, **kwargs)
+        if mime is None and not (encoding or text or errors):
+            mime = await self._negotiate_mime()
+        returncode, stdout, stderr = await self._run(clipboard._paste_args(mime))
+        if returncode != 0:
+            raise ClipboardException(
+                f"Paste failed. {clipboard._paste_helper_name} returned code: {returncode!r} "
+                f"Stderr: {stderr!r} "
+                f"Stdout: {stdout!r}"
+            )
+        if encoding or text or errors:
+            return stdout.decode(encoding or locale.getpreferredencoding(False), errors or 'strict')
+        return stdout
+
+    async def clear(self) -> None:
+        """
+        Clear the clipboard contents
+
+        :return:
+        """
+        if not isinstance(self.clipboard, SubprocessClipboardBase):
+            return await self._run_in_executor(self.clipboard.clear)
+        await self.copy(b'')
+
+
+_DEFAULT: Optional[AsyncClipboard] = None
+
+
+def _default() -> AsyncClipboard:
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = AsyncClipboard()
+    return _DEFAULT
+
+
+async def copy(data: Union[str, bytes], encoding: str = None) -> None:
+    """
+    Copy data into the default clipboard. See :py:meth:`AsyncClipboard.copy`
+    """
+    return await _default().copy(data, encoding=encoding)
+
+
+async def paste(encoding: str = None, text: bool = None, errors: str = None, mime: str = None) -> Union[str, bytes]:
+    """
+    Retrieve data from the default clipboard. See :py:meth:`AsyncClipboard.paste`
+    """
+    return await _default().paste(encoding=encoding, text=text, errors=errors, mime=mime)
+
+
+async def clear() -> None:
+    """
+    Clear the default clipboard. See :py:meth:`AsyncClipboard.clear`
+    """
+    return await _default().clear()
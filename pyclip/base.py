@@ -14,8 +14,174 @@
 """
 Provides the abstract base class from which all clipboard implementations are derived.
 """
+import contextlib
+import errno
+import functools
+import io
+import os
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Union
+from typing import BinaryIO, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+
+from . import instrumentation as _instrumentation
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_POLL_INTERVAL = 0.5
+_SPLICE_CHUNK_SIZE = 1024 * 1024
+
+
+def _readinto_buffer(stream: BinaryIO, buffer, grow: bool = False) -> int:
+    """
+    Fill ``buffer`` from ``stream`` with ``readinto``. Returns the total number of bytes the stream produced,
+    which is larger than ``len(buffer)`` if the contents did not fit.
+    """
+    total = 0
+    view = memoryview(buffer).cast('B')
+    try:
+        while True:
+            if total == len(view):
+                if not (grow and isinstance(buffer, bytearray)):
+                    break
+                view.release()
+                buffer.extend(bytes(max(len(buffer), DEFAULT_CHUNK_SIZE)))
+                view = memoryview(buffer).cast('B')
+            n = stream.readinto(view[total:])
+            if not n:
+                return total
+            total += n
+    finally:
+        view.release()
+    # the buffer is full: count the rest of the contents without keeping it
+    scratch = bytearray(DEFAULT_CHUNK_SIZE)
+    while True:
+        n = stream.readinto(scratch)
+        if not n:
+            return total
+        total += n
+
+
+def _splice_to_file(stream: BinaryIO, f: BinaryIO) -> Union[int, None]:
+    """
+    Move the contents of ``stream`` to ``f`` inside the kernel with ``os.splice`` (Linux, Python 3.10+).
+    Returns None, having transferred nothing, if splicing is not possible for these files.
+    """
+    splice = getattr(os, 'splice', None)
+    if splice is None:
+        return None
+    try:
+        in_fd = stream.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+    out_fd = f.fileno()
+    total = 0
+    while True:
+        try:
+            n = splice(in_fd, out_fd, _SPLICE_CHUNK_SIZE)
+        except OSError as e:
+            if total == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EBADF):
+                return None  # e.g. neither end is a pipe, or the filesystem does not support splice
+            raise
+        if n == 0:
+            return total
+        total += n
+
+
+def _copy_to_file(stream: BinaryIO, f: BinaryIO) -> int:
+    """
+    Copy the contents of ``stream`` to ``f``, without the data passing through Python when possible
+    """
+    total = _splice_to_file(stream, f)
+    if total is not None:
+        return total
+    total = 0
+    buffer = bytearray(DEFAULT_CHUNK_SIZE)
+    with memoryview(buffer) as view:
+        while True:
+            n = stream.readinto(view)
+            if not n:
+                return total
+            f.write(view[:n])
+            total += n
+
+
+def _byte_view(data) -> memoryview:
+    """
+    A flat view of the bytes of a bytes-like object (``bytearray``, ``memoryview``, ``mmap``, ``array``...),
+    through which its contents can be written to a pipe or a clipboard handle without copying them first
+    """
+    try:
+        view = memoryview(data)
+    except TypeError:
+        raise TypeError(f"data argument must be of type str or a bytes-like object, not {type(data)}") from None
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+def _encode_formats(
+    formats: Mapping[str, Union[str, bytes]], encoding: str = None, views: bool = False
+) -> Dict[str, Union[bytes, memoryview]]:
+    """
+    Validate the ``{mime: data}`` mapping given to ``copy`` and encode its ``str`` values (utf-8 by default)
+
+    :param views: return other bytes-like values as memoryviews of them, for implementations that write the data
+        out before ``copy`` returns. By default, they are copied to ``bytes``, so that later changes by the caller
+        do not change what the clipboard offers.
+    """
+    if not formats:
+        raise TypeError("data must hold at least one format")
+    encoded = {}
+    for mime, data in formats.items():
+        if not isinstance(mime, str):
+            raise TypeError(f"formats must be keyed by MIME type (str), not {type(mime)}")
+        if isinstance(data, str):
+            data = data.encode(encoding or 'utf-8')
+        elif not isinstance(data, bytes):
+            try:
+                data = _byte_view(data)
+            except TypeError:
+                raise TypeError(f"data for {mime!r} must be of type str or a bytes-like object, not {type(data)}") from None
+            if not views:
+                data = data.tobytes()
+        encoded[mime] = data
+    return encoded
+
+
+def _copy_digest(data, encoding: str = None) -> Optional[bytes]:
+    """
+    A fast hash of the arguments of ``copy``, or None if they are not valid copy data
+    """
+    import hashlib  # deferred; only needed when skipping redundant copies
+
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(data, str):
+        digest.update(b's' + (encoding or '').encode() + b'\0')
+        digest.update(data.encode('utf-8', 'surrogatepass'))
+    elif isinstance(data, Mapping):
+        digest.update(b'd' + (encoding or '').encode() + b'\0')
+        for mime, value in data.items():
+            value_digest = _copy_digest(value)
+            if not isinstance(mime, str) or value_digest is None:
+                return None
+            digest.update(mime.encode('utf-8', 'surrogatepass') + b'\0' + value_digest)
+    else:
+        try:
+            view = data if isinstance(data, bytes) else _byte_view(data)
+        except TypeError:
+            return None
+        digest.update(b'b')
+        digest.update(view)
+    return digest.digest()
+
+
+def _decode(data: bytes, encoding: str = None, errors: str = None) -> str:
+    """
+    Decode pasted data (utf-8 by default), as the ``decode`` phase of the current operation
+    """
+    with _instrumentation.current().phase('decode'):
+        return data.decode(encoding or 'utf-8', errors or 'strict')
 
 
 class ClipboardException(Exception):
@@ -27,15 +193,443 @@ class ClipboardSetupException(ClipboardException):
 class ClipboardBase(ABC):
     """
     Abstract base class for Clipboard implementations.
+
+    The public operations of subclasses are instrumented (see :py:mod:`pyclip.instrumentation`).
     """
+    #: When True, ``copy`` does nothing if it is given the same data as the last ``copy`` through this instance
+    #: and the clipboard has not changed since (see :py:meth:`_change_token`), which saves re-taking ownership
+    #: and, for helper based implementations, a process. Defaults to the ``PYCLIP_SKIP_REDUNDANT_COPIES``
+    #: environment variable.
+    skip_redundant_copies = os.environ.get('PYCLIP_SKIP_REDUNDANT_COPIES', '') not in ('', '0')
+    _last_copy: Optional[Tuple[bytes, object]] = None
+    #: True for implementations whose ``copy`` forwards to another implementation, which skips redundant copies
+    #: itself. Their ``copy`` is not wrapped, so that payloads are not hashed twice.
+    _forwards_copies = False
+
+    #: methods reported to :py:mod:`pyclip.instrumentation` hooks
+    _instrumented_operations = (
+        'copy',
+        'paste',
+        'clear',
+        'copy_stream',
+        'iter_paste',
+        'paste_into',
+        'paste_to_file',
+        'list_targets',
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        copy = cls.__dict__.get('copy')
+        if callable(copy) and not getattr(copy, '__isabstractmethod__', False) and not cls._forwards_copies:
+            cls.copy = _skip_redundant_copies(copy)
+        _instrument_methods(cls)
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator['ClipboardBase']:
+        """
+        Context manager that keeps the implementation's resources open for a batch of operations, and yields
+        the clipboard. Sessions of other threads on the same clipboard wait until the block is left. Where the
+        platform has a clipboard lock (Windows), it is held for the whole block, so the operations in it are
+        atomic for other processes as well; it is released when the block is left.
+
+        .. code-block:: python
+
+            with clipboard.session() as cb:
+                previous = cb.paste()
+                cb.copy(transform(previous))
+
+        Sessions can be nested.
+        """
+        lock = self.__dict__.get('_session_lock') or self.__dict__.setdefault('_session_lock', threading.RLock())
+        with lock:
+            depth = self.__dict__.get('_session_depth', 0)
+            self._session_depth = depth + 1
+            try:
+                if depth:
+                    yield self
+                else:
+                    with self._session():
+                        yield self
+            finally:
+                self._session_depth = depth
+
+    def _session(self):
+        """
+        Context manager acquiring what :py:meth:`session` keeps open. Implementations override this.
+        """
+        return contextlib.nullcontext()
+
+    def release(self) -> None:
+        """
+        Release what this instance holds open (connections to the display server, event threads, helper
+        processes), and give up persisting its selection at exit. The instance must not be used afterwards.
+        Implementations holding such resources override this.
+        """
+
+    def _paste_mime(self) -> Optional[str]:
+        """
+        The MIME type (or target) that :py:meth:`paste` without a ``mime`` currently returns, None if unknown
+        """
+        return None
+
+    def _change_token(self) -> object:
+        """
+        A cheap snapshot of the clipboard state: a value that stays equal for as long as the contents this
+        instance copied are still on the clipboard (e.g. this process still owns the selection, or the
+        system's change counter has not moved). None if that cannot be told without reading the clipboard,
+        in which case redundant copies are never skipped.
+        """
+        return None
+
     @abstractmethod
-    def copy(self, data: Union[str, bytes], encoding: str = None):
+    def copy(self, data: Union[str, bytes, Mapping[str, Union[str, bytes]]], encoding: str = None):
+        """
+        Copy data into the clipboard
+
+        :param data: the data to be copied to the clipboard. Can be str or bytes, or a dict mapping
+            MIME types to str or bytes, to offer several formats at once (e.g. ``text/html`` with a ``text/plain``
+            fallback), where the implementation supports it. Instead of bytes, any bytes-like object
+            (``bytearray``, ``memoryview``, ``mmap``...) can be given; it is read without being copied first.
+        :param encoding: the encoding used for ``str`` data
+        :return: None
+        """
         return NotImplemented  # pragma: no cover
 
     @abstractmethod
     def paste(self, encoding=None, text=None, errors=None) -> Union[str, bytes]:
+        """
+        Retrieve data from the clipboard
+
+        :param encoding: same meaning as in ``bytes.decode``
+        :param text: if True, the contents are returned as str
+        :param errors: same meaning as in ``bytes.decode``
+        :return: the clipboard contents. return type is binary by default.
+            If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
+        """
         return NotImplemented  # pragma: no cover
 
     @abstractmethod
     def clear(self):
+        """
+        Clear the clipboard contents
+
+        :return:
+        """
+        return NotImplemented  # pragma: no cover
+
+    def copy_stream(self, fileobj: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """
+        Copy the contents of a binary file object into the clipboard.
+
+        Implementations that can stream do so in chunks of ``chunk_size`` bytes. This default
+        implementation reads the whole file object and defers to :py:meth:`copy`.
+
+        :param fileobj: a binary file object (like ``sys.stdin.buffer``) to read from
+        :param chunk_size: the number of bytes to read at a time
+        :return: None
+        """
+        self.copy(fileobj.read())
+
+    @contextlib.contextmanager
+    def _open_paste_stream(self, mime: str = None) -> Iterator[BinaryIO]:
+        """
+        Context manager providing a binary file object from which the clipboard contents can be read.
+
+        Implementations that can stream override this. This default wraps the result of :py:meth:`paste`.
+        """
+        data = self.paste() if mime is None else self.paste(mime=mime)
+        yield io.BytesIO(data)
+
+    def iter_paste(self, chunk_size: int = DEFAULT_CHUNK_SIZE, mime: str = None) -> Iterator[bytes]:
+        """
+        Retrieve the clipboard contents as an iterator of ``bytes`` chunks of at most ``chunk_size`` bytes.
+
+        Implementations that can stream yield chunks as they arrive from the clipboard; otherwise,
+        the whole contents are retrieved with :py:meth:`paste` and sliced.
+
+        :param chunk_size: the maximum size of each chunk
+        :param mime: the MIME type to retrieve, if the implementation supports choosing one
+        :return: an iterator of bytes
+        """
+        with self._open_paste_stream(mime) as stream:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def paste_into(self, buffer, mime: str = None, grow: bool = False) -> int:
+        """
+        Read the clipboard contents into a caller-supplied writable buffer
+        (such as a ``bytearray``, writable ``memoryview`` or ``mmap``) without allocating a new bytes object.
+
+        Like ``snprintf``, the return value is the full size of the clipboard contents. If it is larger than
+        ``len(buffer)``, the contents were truncated to fit. With ``grow=True``, a ``bytearray`` buffer is
+        extended as needed instead; it may end up larger than the contents, so use the return value to
+        know how many bytes are valid.
+
+        :param buffer: a writable object supporting the buffer protocol
+        :param mime: the MIME type to retrieve, if the implementation supports choosing one
+        :param grow: extend ``bytearray`` buffers instead of truncating
+        :return: the size of the clipboard contents, in bytes
+        """
+        with self._open_paste_stream(mime) as stream:
+            return _readinto_buffer(stream, buffer, grow=grow)
+
+    def paste_to_file(self, path: Union[str, os.PathLike], mime: str = None) -> int:
+        """
+        Write the clipboard contents to the file at ``path``.
+
+        Where possible (Linux), the contents are moved from the helper's pipe to the file with ``os.splice``
+        so they never enter Python memory. Otherwise, they are copied in chunks.
+
+        :param path: the file to write. It is created or truncated.
+        :param mime: the MIME type to retrieve, if the implementation supports choosing one
+        :return: the number of bytes written
+        """
+        with self._open_paste_stream(mime) as stream, open(path, 'wb') as f:
+            return _copy_to_file(stream, f)
+
+    def _changes(self, stop: threading.Event, poll_interval: float) -> Iterator[Optional[bytes]]:
+        """
+        Return an iterator that yields once for every change of the clipboard contents, until ``stop`` is set.
+        The new contents are yielded if they are already known, otherwise None. Changes are counted from
+        the time this method is called, not from the first ``next()``.
+
+        Implementations that can be notified of changes override this. This default polls :py:meth:`paste`
+        every ``poll_interval`` seconds.
+        """
+        last = self.paste()
+
+        def changes():
+            nonlocal last
+            while not stop.wait(poll_interval):
+                contents = self.paste()
+                if contents != last:
+                    last = contents
+                    yield contents
+
+        return changes()
+
+    def watch(self, debounce: float = 0.0, poll_interval: float = DEFAULT_POLL_INTERVAL) -> Iterator[bytes]:
+        """
+        Yield the new clipboard contents each time they change (for example, when another program copies).
+
+        Where the platform can report selection ownership changes (XFixes on X11, data-control or
+        ``wl-paste --watch`` on Wayland, the sequence number on Windows), the clipboard is only read after
+        a change. Otherwise, it is polled every ``poll_interval`` seconds.
+
+        :param debounce: if given, wait until no further change happened for this many seconds
+            and only yield the contents once
+        :param poll_interval: seconds between checks, for implementations that must poll
+        :return: an iterator of bytes, which never ends on its own. Close it to stop watching.
+        """
+        stop = threading.Event()
+        return self._watch(self._changes(stop, poll_interval), stop, debounce)
+
+    def _watch(self, changes: Iterator[Optional[bytes]], stop: threading.Event, debounce: float) -> Iterator[bytes]:
+        results = queue.Queue()
+
+        def pump():
+            try:
+                for contents in changes:
+                    results.put((contents, None))
+            except Exception as e:
+                results.put((None, e))
+
+        def next_change(timeout=None):
+            contents, error = results.get(timeout=timeout)
+            if error is not None:
+                raise error
+            return contents
+
+        threading.Thread(target=pump, name='pyclip-watch', daemon=True).start()
+        try:
+            while True:
+                contents = next_change()
+                if debounce:
+                    deadline = time.monotonic() + debounce
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        try:
+                            contents = next_change(timeout=remaining)
+                        except queue.Empty:
+                            break
+                        deadline = time.monotonic() + debounce
+                yield contents if contents is not None else self.paste()
+        finally:
+            stop.set()
+
+
+_SKIPPING_WRAPPERS = set()
+
+
+def _skip_redundant_copies(copy):
+    if copy in _SKIPPING_WRAPPERS:
+        return copy
+
+    @functools.wraps(copy)
+    def wrapper(self, data, *args, **kwargs):
+        if not self.skip_redundant_copies:
+            return copy(self, data, *args, **kwargs)
+        digest = _copy_digest(data, args[0] if args else kwargs.get('encoding'))
+        last = self._last_copy
+        if digest is not None and last is not None and last[0] == digest:
+            token = self._change_token()
+            if token is not None and token == last[1]:
+                return None
+        self._last_copy = None
+        result = copy(self, data, *args, **kwargs)
+        if digest is not None:
+            token = self._change_token()
+            if token is not None:
+                self._last_copy = (digest, token)
+        return result
+
+    _SKIPPING_WRAPPERS.add(wrapper)
+    return wrapper
+
+
+def _instrument_methods(cls) -> None:
+    for name in ClipboardBase._instrumented_operations:
+        method = cls.__dict__.get(name)
+        if callable(method) and not getattr(method, '__isabstractmethod__', False):
+            setattr(cls, name, _instrumentation.instrument(method, name))
+
+
+_instrument_methods(ClipboardBase)
+
+
+class SubprocessClipboardBase(ClipboardBase):
+    """
+    Base class for implementations that delegate to helper programs (like ``xclip`` or ``pbcopy``).
+
+    Subclasses provide the helper command lines; streaming operations built on those are implemented here.
+    """
+    #: names of the helpers used for copying and pasting, for error messages
+    _copy_helper_name = 'helper'
+    _paste_helper_name = 'helper'
+
+    @abstractmethod
+    def _copy_args(self, mime: str = None) -> List[str]:
+        """
+        Command line that reads the new clipboard contents (of type ``mime``, when given) from stdin
+        """
+        return NotImplemented  # pragma: no cover
+
+    def _single_format(
+        self, formats: Mapping[str, Union[str, bytes]], encoding: str = None
+    ) -> Tuple[str, Union[bytes, memoryview]]:
+        """
+        Helpers offer a single format per copy. Return it, or raise if ``formats`` holds more than one.
+        """
+        formats = _encode_formats(formats, encoding, views=True)  # piped to the helper before copy returns
+        if len(formats) > 1:
+            raise ClipboardException(
+                f"{self._copy_helper_name} can only offer one format at a time. Got: {', '.join(formats)}"
+            )
+        return next(iter(formats.items()))
+
+    @abstractmethod
+    def _paste_args(self, mime: str = None) -> List[str]:
+        """
+        Command line that writes the clipboard contents (as ``mime``, when given) to stdout
+        """
         return NotImplemented  # pragma: no cover
+
+    # Target negotiation. Helpers that must be told which target to paste (like xclip) override these.
+
+    def _targets_args(self) -> Optional[List[str]]:
+        """
+        Command line that lists the available targets, one per line, or None if no negotiation is needed
+        """
+        return None
+
+    def _cached_targets(self) -> Optional[List[str]]:
+        return None
+
+    def _remember_targets(self, output: str) -> List[str]:
+        return output.splitlines()
+
+    def _select_target(self, targets: List[str]) -> Optional[str]:
+        return None
+
+    def _negotiate_mime(self) -> Optional[str]:
+        """
+        The MIME type to paste when the caller did not ask for one
+        """
+        return None
+
+    def _paste_mime(self) -> Optional[str]:
+        return self._negotiate_mime()
+
+    def copy_stream(self, fileobj: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """
+        Copy the contents of a binary file object into the clipboard, piping it to the helper
+        ``chunk_size`` bytes at a time so the whole payload is never held in memory.
+
+        :param fileobj: a binary file object (like ``sys.stdin.buffer``) to read from
+        :param chunk_size: the number of bytes to read at a time
+        :return: None
+        """
+        import subprocess  # deferred, so that importing pyclip stays cheap
+        from . import spawn
+
+        recorder = _instrumentation.current()
+        with recorder.phase('spawn'):
+            proc = spawn.Popen(self._copy_args(), stdin=subprocess.PIPE)
+        recorder.spawned()
+        try:
+            with recorder.phase('transfer'):
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    proc.stdin.write(chunk)
+                    recorder.transferred(len(chunk))
+                proc.stdin.close()
+        except BrokenPipeError:
+            pass  # the helper exited early; its return code tells us why
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        returncode = proc.wait()
+        if returncode != 0:
+            raise ClipboardException(f"Copy failed. {self._copy_helper_name} returned code: {returncode!r}")
+
+    @contextlib.contextmanager
+    def _open_paste_stream(self, mime: str = None) -> Iterator[BinaryIO]:
+        """
+        Spawn the paste helper and provide its (unbuffered) stdout, so the clipboard contents are read straight
+        from the pipe. The helper is killed if the caller stops reading early.
+        """
+        recorder = _instrumentation.current()
+        if mime is None:
+            with recorder.phase('negotiate'):
+                mime = self._negotiate_mime()
+        import subprocess
+        from . import spawn
+
+        with recorder.phase('spawn'):
+            proc = spawn.Popen(
+                self._paste_args(mime), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+            )
+        recorder.spawned()
+        try:
+            yield proc.stdout
+            stderr = proc.stderr.read()
+            returncode = proc.wait()
+        finally:
+            if proc.poll() is None:  # the caller stopped reading early
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+        if returncode != 0:
+            raise ClipboardException(
+                f"Paste failed. {self._paste_helper_name} returned code: {returncode!r} Stderr: {stderr!r}"
+            )
@@ -13,28 +13,148 @@
 #     limitations under the License.
 import argparse
 import sys
+from typing import List, Optional, Tuple
 
 
 def _main(args) -> int:
-    from pyclip import copy, clear, paste
+    from pyclip import copy_stream, clear, iter_paste, paste_to_file
     if args.command == "copy":
-        copy(sys.stdin.buffer.read())
+        copy_stream(sys.stdin.buffer)
+    elif args.command == 'paste' and args.output:
+        paste_to_file(args.output)
     elif args.command == 'paste':
-        sys.stdout.buffer.write(paste())
+        for chunk in iter_paste():
+            sys.stdout.buffer.write(chunk)
     elif args.command == 'clear':
         clear()
+    elif args.command == 'daemon':
+        from .daemon import main as daemon_main
+        return daemon_main(args.socket)
+    elif args.command == 'history':
+        return _history(args)
+    elif args.command == 'watch':
+        return _watch(args)
     else:
         print('Unrecognized command', file=sys.stderr)
         return 1
     return 0
 
 
+def _history(args) -> int:
+    import time
+    from .history import History
+    with History(args.db) as history:
+        if args.history_command == 'record':
+            try:
+                history.record(debounce=args.debounce)
+            except KeyboardInterrupt:
+                pass
+            return 0
+        if args.history_command == 'restore':
+            try:
+                history.restore(args.id)
+            except KeyError as e:
+                print(e.args[0], file=sys.stderr)
+                return 1
+            return 0
+        if args.history_command == 'search':
+            entries = history.search(args.query, limit=args.limit)
+        else:
+            entries = history.entries(limit=args.limit)
+        for entry in entries:
+            used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.last_used))
+            print(f'{entry.id[:12]}  {used}  {entry.size:>10}  {entry.preview()}')
+    return 0
+
+
+def _snapshot(clipboard) -> Tuple[Optional[List[str]], bytes]:
+    """
+    The targets and the contents of the clipboard, read in one session so that they describe the same contents
+    where the platform can lock the clipboard (and with as little time in between as possible elsewhere)
+    """
+    with clipboard.session() as cb:
+        list_targets = getattr(cb, 'list_targets', None)
+        targets = list_targets() if list_targets is not None else None
+        return targets, cb.paste()
+
+
+def _change_record(targets: Optional[List[str]], contents: bytes, max_content: int) -> dict:
+    import base64
+    import codecs
+    import time
+    from .history import content_hash
+    record = {
+        'time': time.time(),
+        'mime_types': targets,
+        'size': len(contents),
+        'hash': content_hash(contents),
+    }
+    if max_content:
+        head = contents[:max_content]
+        truncated = len(contents) > max_content
+        try:
+            # a character split by the cut is left out rather than making the whole head binary
+            record['content'] = codecs.getincrementaldecoder('utf-8')().decode(head, final=not truncated)
+        except UnicodeDecodeError:
+            record['content_base64'] = base64.b64encode(head).decode('ascii')
+        record['truncated'] = truncated
+    return record
+
+
+def _watch(args) -> int:
+    import json
+    from pyclip import _get_clipboard
+    clipboard = _get_clipboard()
+    terminator = b'\0' if args.null else b'\n'
+    out = sys.stdout.buffer
+    try:
+        for _ in clipboard.watch(debounce=args.debounce):
+            # read again, together with the targets: the contents watch read may already be outdated by then
+            targets, contents = _snapshot(clipboard)
+            record = _change_record(targets, contents, args.content)
+            out.write(json.dumps(record, ensure_ascii=False).encode() + terminator)
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:  # the consumer went away; keep the interpreter from failing to flush at exit
+        import os
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+
 def main():
     parser = argparse.ArgumentParser('pyclip')
     subparsers = parser.add_subparsers(title='commands', dest='command', required=True, description='Valid commands')
     copy_parser = subparsers.add_parser('copy', help='Copy contents from stdin to the clipboard')
     paste_parser = subparsers.add_parser('paste', help='Output clipboard contents to stdout')
+    paste_parser.add_argument('-o', '--output', metavar='FILE', help='Write clipboard contents to FILE instead of stdout')
     clear_parser = subparsers.add_parser('clear', help='Clear the clipboard contents')
+    daemon_parser = subparsers.add_parser(
+        'daemon', help='Hold the clipboard in a long-running process that other pyclip calls talk to'
+    )
+    daemon_parser.add_argument('--socket', metavar='PATH', help='Unix socket to listen on')
+    history_parser = subparsers.add_parser('history', help='Record, list, search and restore clipboard history')
+    history_parser.add_argument('--db', metavar='PATH', help='History database (defaults to the per-user one)')
+    history_commands = history_parser.add_subparsers(dest='history_command', required=True)
+    record_parser = history_commands.add_parser('record', help='Store every clipboard change until interrupted')
+    record_parser.add_argument('--debounce', type=float, default=0.0, metavar='SECONDS',
+                               help='Only store the last of changes made within SECONDS of each other')
+    list_parser = history_commands.add_parser('list', help='List entries, most recently used first')
+    list_parser.add_argument('-n', '--limit', type=int, metavar='N', help='Show at most N entries')
+    search_parser = history_commands.add_parser('search', help='List the text entries containing QUERY')
+    search_parser.add_argument('query', metavar='QUERY')
+    search_parser.add_argument('-n', '--limit', type=int, metavar='N', help='Show at most N entries')
+    restore_parser = history_commands.add_parser('restore', help='Copy an entry back to the clipboard')
+    restore_parser.add_argument('id', metavar='ID', help='Entry id, or a unique prefix of it, as shown by list')
+    watch_parser = subparsers.add_parser(
+        'watch', help='Print one JSON record (time, mime_types, size, hash) per clipboard change until interrupted'
+    )
+    watch_parser.add_argument('-0', '--null', action='store_true',
+                              help='End records with NUL instead of newline')
+    watch_parser.add_argument('--content', type=int, default=0, metavar='N',
+                              help='Include up to N bytes of the contents (as text, or base64 if not UTF-8)')
+    watch_parser.add_argument('--debounce', type=float, default=0.0, metavar='SECONDS',
+                              help='Only report the last of changes made within SECONDS of each other')
     args = parser.parse_args()
     ret = _main(args)
     sys.exit(ret)
@@ -0,0 +1,437 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+A long-running process that holds a clipboard implementation (and, with the native X11 and Wayland backends,
+the selection itself), serving copy/paste requests over a Unix domain socket.
+
+Start it with ``pyclip daemon``. While it runs, :py:func:`pyclip.util.detect_clipboard` returns a
+:py:class:`DaemonClipboard`, so ``pyclip.copy``/``pyclip.paste`` and the CLI skip backend setup and helper
+processes. When the daemon goes away, :py:class:`DaemonClipboard` falls back to a backend of its own.
+
+The socket is ``$XDG_RUNTIME_DIR/pyclip/daemon-<display>.sock`` (one daemon per display). The daemon refuses to
+serve, and clients refuse to connect, unless the socket's directory is owned by the current user and not accessible
+to anyone else, the socket is owned by the current user and (where the platform reports it) the process listening
+on it runs as the current user.
+
+Every message, in both directions, is a 4 byte big-endian length, a JSON header of that length, and a payload
+whose length is given in the header. Requests have an ``op`` (``copy``, ``paste``, ``clear`` or ``ping``);
+``copy`` lists ``formats`` as ``[mime, length]`` pairs (``mime`` is null for plain data) whose data is
+concatenated in the payload. Responses have ``ok``, and ``error`` when it is false.
+
+A connection can also send ``begin``: until it sends ``end`` (or disconnects), the requests of other connections
+wait, so that the requests in between are atomic (see :py:meth:`~pyclip.base.ClipboardBase.session`).
+"""
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException, _byte_view, _decode, _encode_formats
+
+_HEADER_LENGTH = struct.Struct('!I')
+_MAX_HEADER = 1024 * 1024
+#: the largest payload accepted from a peer
+_MAX_PAYLOAD = 4 * 1024 ** 3
+_TIMEOUT = 30.0
+#: bounds of the back-off between attempts to reach a daemon that was not running
+_MIN_RETRY = 1.0
+_MAX_RETRY = 60.0
+
+
+def socket_path() -> str:
+    """
+    The socket the daemon for the current display listens on
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f'pyclip-{os.getuid()}')
+    display = os.environ.get('WAYLAND_DISPLAY') or os.environ.get('DISPLAY') or 'default'
+    name = display.replace(os.sep, '_').replace(':', '_')
+    return os.path.join(runtime_dir, 'pyclip', f'daemon-{name}.sock')
+
+
+def _check_private(path: str) -> None:
+    """
+    Raise :py:class:`ClipboardSetupException` unless the directory of the socket ``path`` is a real directory owned
+    by the current user with mode 0700, and ``path`` (if it exists) is owned by the current user.
+    Otherwise another local user could put a socket there first and receive everything copied or pasted.
+    """
+    directory = os.path.dirname(path) or '.'
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise ClipboardSetupException(
+            f"Refusing to use {directory} for the pyclip daemon: it must be a directory owned by the current user "
+            f"with mode 0700"
+        )
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise ClipboardSetupException(f"Refusing to use {path}: it is not a socket owned by the current user")
+
+
+def _check_peer(sock: socket.socket) -> None:
+    """
+    Raise :py:class:`ClipboardSetupException` if the process at the other end of ``sock`` runs as another user.
+    Does nothing on platforms that report neither ``SO_PEERCRED`` nor ``getpeereid``.
+    """
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+    elif hasattr(os, 'getpeereid'):
+        uid, _ = os.getpeereid(sock.fileno())
+    else:
+        return
+    if uid != os.getuid():
+        raise ClipboardSetupException(f"Refusing to talk to a pyclip daemon running as uid {uid}")
+
+
+def _open_socket(path: str, timeout: float) -> socket.socket:
+    """
+    Connect to the daemon socket ``path`` after checking that it, and the process listening on it, belong to the
+    current user
+    """
+    _check_private(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        _check_peer(sock)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    # received straight into the BytesIO's buffer, which getvalue then hands over without copying it
+    data = io.BytesIO(bytes(n))
+    with data.getbuffer() as view:
+        received = 0
+        while received < n:
+            count = sock.recv_into(view[received:])
+            if not count:
+                raise ConnectionError("connection closed mid-message")
+            received += count
+    return data.getvalue()
+
+
+def _send_message(sock: socket.socket, header: dict, payload: bytes = b'') -> None:
+    header = dict(header, length=len(payload))
+    encoded = json.dumps(header).encode()
+    sock.sendall(_HEADER_LENGTH.pack(len(encoded)) + encoded)
+    if payload:
+        sock.sendall(payload)  # any bytes-like object, sent without copying it
+
+
+def _recv_message(sock: socket.socket) -> Optional[Tuple[dict, bytes]]:
+    """
+    Read a message. Returns None if the peer closed the connection before sending one.
+    """
+    prefix = sock.recv(_HEADER_LENGTH.size, socket.MSG_WAITALL)
+    if not prefix:
+        return None
+    if len(prefix) < _HEADER_LENGTH.size:
+        prefix += _recv_exactly(sock, _HEADER_LENGTH.size - len(prefix))
+    (size,) = _HEADER_LENGTH.unpack(prefix)
+    if size > _MAX_HEADER:
+        raise ConnectionError(f"message header too large ({size} bytes)")
+    header = json.loads(_recv_exactly(sock, size))
+    length = header.get('length', 0)
+    if not isinstance(length, int) or not 0 <= length <= _MAX_PAYLOAD:
+        raise ConnectionError(f"invalid payload length {length!r}")
+    return header, _recv_exactly(sock, length)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # holds the server lock and the clipboard session between 'begin' and 'end'
+        with contextlib.ExitStack() as session:
+            in_session = False
+            while True:
+                try:
+                    message = _recv_message(self.request)
+                except (OSError, ValueError):
+                    return
+                if message is None:
+                    return
+                header, payload = message
+                try:
+                    op = header.get('op')
+                    if op == 'begin' and not in_session:
+                        session.enter_context(self.server.lock)
+                        session.enter_context(self.server.clipboard.session())
+                        in_session = True
+                        response = b''
+                    elif op == 'end' and in_session:
+                        session.close()
+                        in_session = False
+                        response = b''
+                    elif op in ('begin', 'end'):
+                        response = b''
+                    else:
+                        response = self.server.dispatch(header, payload)
+                except Exception as e:
+                    _send_message(self.request, {'ok': False, 'error': f'{type(e).__name__}: {e}'})
+                else:
+                    _send_message(self.request, {'ok': True}, response)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, clipboard: ClipboardBase):
+        self.clipboard = clipboard
+        self.lock = threading.RLock()  # reentrant: a connection in a session holds it across its requests
+        super().__init__(path, _RequestHandler)
+
+    def dispatch(self, header: dict, payload: bytes) -> bytes:
+        op = header.get('op')
+        if op == 'ping':
+            return b''
+        with self.lock:
+            if op == 'copy':
+                formats, offset = {}, 0
+                for mime, length in header['formats']:
+                    # usually a single format: the payload itself, without copying it
+                    formats[mime] = payload if length == len(payload) else payload[offset : offset + length]
+                    offset += length
+                if None in formats:
+                    self.clipboard.copy(formats[None])
+                else:
+                    self.clipboard.copy(formats)
+                return b''
+            if op == 'paste':
+                mime = header.get('mime')
+                return self.clipboard.paste(mime=mime) if mime is not None else self.clipboard.paste()
+            if op == 'clear':
+                self.clipboard.clear()
+                return b''
+        raise ValueError(f"unknown operation {op!r}")
+
+
+def serve(path: str = None, clipboard: ClipboardBase = None) -> None:
+    """
+    Run the daemon until it is interrupted or terminated.
+
+    :param path: the socket to listen on. Defaults to :py:func:`socket_path`.
+    :param clipboard: the implementation to serve. Defaults to the fastest one for this environment
+        (see :py:func:`pyclip.registry.select_backend`).
+    """
+    path = path or socket_path()
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    _check_private(path)
+    if os.path.exists(path):
+        if _ping(path):
+            raise ClipboardSetupException(f"A pyclip daemon is already listening on {path}")
+        os.unlink(path)  # left behind by a daemon that did not exit cleanly
+    if clipboard is None:
+        from .registry import select_backend
+
+        clipboard = select_backend()
+    server = _Server(path, clipboard)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt  # unwind normally, so the backend can keep its selection alive at exit
+
+    in_main_thread = threading.current_thread() is threading.main_thread()
+    if in_main_thread:
+        previous = signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if in_main_thread:
+            signal.signal(signal.SIGTERM, previous)
+        server.server_close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _ping(path: str) -> bool:
+    try:
+        with _open_socket(path, 1.0) as sock:
+            _send_message(sock, {'op': 'ping'})
+            return _recv_message(sock) is not None
+    except (OSError, ValueError, ClipboardException):
+        return False
+
+
+def is_running(path: str = None) -> bool:
+    """
+    Whether a daemon is listening on ``path`` (defaults to :py:func:`socket_path`)
+    """
+    path = path or socket_path()
+    return os.path.exists(path) and _ping(path)
+
+
+class DaemonClipboard(ClipboardBase):
+    """
+    Client for a running ``pyclip daemon``. If the daemon cannot be reached, requests are handled directly by the
+    implementation :py:func:`pyclip.registry.select_backend` picks, as they would be without a daemon. The daemon
+    is tried again after a back-off (doubling from one second to a minute), so a restarted daemon is picked up.
+
+    :param path: the daemon socket. Defaults to :py:func:`socket_path`.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or socket_path()
+        self._fallback: Optional[ClipboardBase] = None
+        self._session_socket: Optional[Tuple[int, socket.socket]] = None
+        self._retry_at = 0.0
+        self._retry_delay = _MIN_RETRY
+
+    def _fallback_clipboard(self) -> ClipboardBase:
+        if self._fallback is None:
+            from .registry import select_backend
+
+            self._fallback = select_backend()
+        return self._fallback
+
+    def _connect(self) -> Optional[socket.socket]:
+        """
+        Connect to the daemon, or set up the fallback and return None if it is not running (or was not running
+        when last tried, less than the back-off ago)
+        """
+        if self._fallback is not None and time.monotonic() < self._retry_at:
+            return None
+        try:
+            sock = _open_socket(self.path, _TIMEOUT)
+        except (FileNotFoundError, ConnectionRefusedError):
+            self._fallback_clipboard()
+            self._retry_at = time.monotonic() + self._retry_delay
+            self._retry_delay = min(self._retry_delay * 2, _MAX_RETRY)
+            return None
+        except OSError as e:
+            raise ClipboardException(f"Could not connect to the pyclip daemon: {e}") from e
+        self._retry_delay = _MIN_RETRY
+        return sock
+
+    @staticmethod
+    def _exchange(sock: socket.socket, header: dict, payload: bytes = b'') -> bytes:
+        try:
+            _send_message(sock, header, payload)
+            message = _recv_message(sock)
+        except (OSError, ValueError) as e:
+            raise ClipboardException(f"Lost connection to the pyclip daemon: {e}") from e
+        if message is None:
+            raise ClipboardException("The pyclip daemon closed the connection")
+        response, data = message
+        if not response.get('ok'):
+            raise ClipboardException(response.get('error', 'The pyclip daemon reported an error'))
+        return data
+
+    def _request(self, header: dict, payload: bytes = b'') -> Optional[bytes]:
+        """
+        Send a request and return the response payload, or None if the daemon is not running
+        """
+        session = self._session_socket
+        if session is not None and session[0] == threading.get_ident():
+            return self._exchange(session[1], header, payload)
+        sock = self._connect()
+        if sock is None:
+            return None
+        with sock:
+            return self._exchange(sock, header, payload)
+
+    @contextlib.contextmanager
+    def _session(self):
+        # one connection for the whole session, during which the daemon serves no one else
+        sock = self._connect()
+        if sock is None:
+            with self._fallback.session():
+                yield
+            return
+        with sock:
+            self._exchange(sock, {'op': 'begin'})
+            self._session_socket = (threading.get_ident(), sock)
+            try:
+                yield
+            finally:
+                self._session_socket = None
+            self._exchange(sock, {'op': 'end'})
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str = None) -> None:
+        """
+        Copy data into the clipboard
+
+        :param data: the data to be copied to the clipboard. Can be str, bytes or another bytes-like object,
+            or a dict mapping MIME types to str or bytes.
+        :param encoding: encoding used to encode ``str`` data. Defaults to utf-8.
+        :return: None
+        """
+        if isinstance(data, dict):
+            formats: List[Tuple[Optional[str], bytes]] = list(_encode_formats(data, encoding, views=True).items())
+        elif isinstance(data, bytes):
+            formats = [(None, data)]
+        elif isinstance(data, str):
+            formats = [(None, data.encode(encoding or 'utf-8'))]
+        else:
+            formats = [(None, _byte_view(data))]
+        header = {'op': 'copy', 'formats': [[mime, len(value)] for mime, value in formats]}
+        payload = formats[0][1] if len(formats) == 1 else b''.join(value for _, value in formats)
+        if self._request(header, payload) is None:
+            self._fallback.copy(data, encoding=encoding)
+
+    def paste(self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None) -> Union[str, bytes]:
+        """
+        Retrieve data from the clipboard
+
+        :param encoding: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param text: if True, the contents are decoded and returned as str
+        :param errors: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param mime: the MIME type to retrieve, if the daemon's implementation supports choosing one
+        :return: the clipboard contents. return type is binary by default.
+            If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
+        """
+        data = self._request({'op': 'paste', 'mime': mime})
+        if data is None:
+            kwargs = {'mime': mime} if mime is not None else {}
+            return self._fallback.paste(encoding=encoding, text=text, errors=errors, **kwargs)
+        if encoding or text or errors:
+            return _decode(data, encoding, errors)
+        return data
+
+    def clear(self) -> None:
+        """
+        Clear the clipboard contents
+
+        :return:
+        """
+        if self._request({'op': 'clear'}) is None:
+            self._fallback.clear()
+
+
+def main(path: str = None) -> int:
+    """
+    Entry point of ``pyclip daemon``
+    """
+    try:
+        serve(path)
+    except ClipboardSetupException as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,346 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Clipboard history, kept in an SQLite database.
+
+Entries are content-addressed: they are keyed by the BLAKE2b hash of their data, so copying the same contents again
+only refreshes the existing entry. When the history grows past ``max_bytes`` or ``max_entries``, or entries get
+older than ``max_age``, the least recently used entries are evicted. Entries that decode as UTF-8 text are added to
+a full-text index (SQLite FTS5 with the trigram tokenizer, when available) as they are stored, so substring
+searches stay fast across thousands of entries.
+
+.. code-block:: python
+
+    from pyclip.history import History
+
+    with History() as history:
+        history.record()                     # store every change of the clipboard, until interrupted
+    with History() as history:
+        entry = history.search('invoice')[0]
+        history.restore(entry.id)            # put it back on the clipboard
+
+The same is available from the command line as ``pyclip history record|list|search|restore``.
+The database is ``$XDG_DATA_HOME/pyclip/history.sqlite3`` (``%LOCALAPPDATA%`` on Windows) unless a path is given.
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from typing import TYPE_CHECKING, Iterable, List, Optional, Union
+
+from .base import ClipboardException
+
+if TYPE_CHECKING:
+    from .base import ClipboardBase
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+_DIGEST_SIZE = 16
+#: shortest query the trigram index can answer; shorter ones scan the stored text
+_MIN_INDEXED_QUERY = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    mime TEXT,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    text TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def default_path() -> str:
+    """
+    The default location of the history database
+    """
+    if sys.platform == 'win32':
+        data_home = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data_home, 'pyclip', 'history.sqlite3')
+
+
+def content_hash(data: bytes) -> str:
+    """
+    The key under which ``data`` is stored
+    """
+    return hashlib.blake2b(data, digest_size=_DIGEST_SIZE).hexdigest()
+
+
+class Entry:
+    """
+    One stored clipboard contents. The data itself is loaded with :py:meth:`History.data`.
+
+    :ivar id: the content hash (hex). Any unique prefix of it identifies the entry.
+    :ivar mime: the MIME type the contents were recorded as, if known
+    :ivar size: size of the data in bytes
+    :ivar text: the contents as text, or None for binary data
+    :ivar created: ``time.time()`` when the contents were first stored
+    :ivar last_used: ``time.time()`` when the contents were last copied or restored
+    :ivar uses: how many times the contents were copied or restored
+    """
+
+    __slots__ = ('id', 'mime', 'size', 'text', 'created', 'last_used', 'uses')
+
+    def __init__(self, id, mime, size, text, created, last_used, uses):
+        self.id = id
+        self.mime = mime
+        self.size = size
+        self.text = text
+        self.created = created
+        self.last_used = last_used
+        self.uses = uses
+
+    def __repr__(self):
+        return f'{type(self).__name__}(id={self.id!r}, mime={self.mime!r}, size={self.size!r})'
+
+    def preview(self, width: int = 60) -> str:
+        """
+        A single-line summary of the contents
+        """
+        if self.text is None:
+            return f'<{self.mime or "binary"}, {self.size} bytes>'
+        line = ' '.join(self.text.split())
+        return line if len(line) <= width else line[: width - 1] + '…'
+
+
+_ENTRY_COLUMNS = 'hash, mime, size, text, created, last_used, uses'
+
+
+class History:
+    """
+    A clipboard history database
+
+    :param path: the SQLite database file. Defaults to :py:func:`default_path`.
+    :param max_bytes: evict least recently used entries while the data stored exceeds this many bytes
+    :param max_entries: evict least recently used entries while there are more than this
+    :param max_age: evict entries not used for this many seconds. None keeps them regardless of age.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age: Optional[float] = DEFAULT_MAX_AGE,
+    ):
+        self.path = path or default_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._db = sqlite3.connect(self.path)
+        self._db.execute('PRAGMA journal_mode=WAL')  # lets `pyclip history search` read while `record` writes
+        self._db.executescript(_SCHEMA)
+        self._trigram = self._create_index()
+
+    def _create_index(self) -> bool:
+        """
+        Create the full-text index. Returns False if this SQLite lacks FTS5 or its trigram tokenizer (3.34+),
+        in which case searches scan the stored text instead.
+        """
+        exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'entries_fts'").fetchone()
+        if exists:
+            return True
+        try:
+            with self._db:
+                self._db.execute("CREATE VIRTUAL TABLE entries_fts USING fts5(text, tokenize='trigram')")
+                # index entries stored while the index was unavailable
+                self._db.execute('INSERT INTO entries_fts (rowid, text) SELECT id, text FROM entries WHERE text IS NOT NULL')
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def add(self, data: Union[str, bytes], mime: str = None) -> Entry:
+        """
+        Store clipboard contents. Contents already in the history are not stored again; they only become
+        the most recently used entry.
+
+        :param data: the contents. ``str`` is stored as UTF-8.
+        :param mime: the MIME type of the contents, if known
+        :return: the entry
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        elif not isinstance(data, bytes):
+            raise TypeError(f"data argument must be of type str or bytes, not {type(data)}")
+        key = content_hash(data)
+        now = time.time()
+        with self._db:
+            updated = self._db.execute(
+                'UPDATE entries SET last_used = ?, uses = uses + 1, mime = COALESCE(?, mime) WHERE hash = ?',
+                (now, mime, key),
+            )
+            if not updated.rowcount:
+                try:
+                    text = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    text = None
+                cursor = self._db.execute(
+                    'INSERT INTO entries (hash, mime, size, data, text, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, mime, len(data), data, text, now, now),
+                )
+                if text is not None and self._trigram:
+                    self._db.execute('INSERT INTO entries_fts (rowid, text) VALUES (?, ?)', (cursor.lastrowid, text))
+            self._evict(now)
+        return self.get(key)
+
+    def _delete(self, rowids: Iterable[int]) -> None:
+        rows = [(rowid,) for rowid in rowids]
+        self._db.executemany('DELETE FROM entries WHERE id = ?', rows)
+        if self._trigram:
+            self._db.executemany('DELETE FROM entries_fts WHERE rowid = ?', rows)
+
+    def _evict(self, now: float) -> None:
+        if self.max_age is not None:
+            expired = self._db.execute('SELECT id FROM entries WHERE last_used < ?', (now - self.max_age,))
+            self._delete([row[0] for row in expired.fetchall()])
+        count, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        evicted = []
+        for rowid, size in self._db.execute('SELECT id, size FROM entries ORDER BY last_used, id'):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            if count == 1:
+                break  # keep the newest entry even if it alone exceeds max_bytes
+            evicted.append(rowid)
+            count -= 1
+            total -= size
+        self._delete(evicted)
+
+    def _resolve(self, id: str) -> str:
+        id = id.lower()
+        rows = self._db.execute(
+            'SELECT hash FROM entries WHERE hash >= ? AND hash < ? LIMIT 2', (id, id + '\x7f')
+        ).fetchall()
+        if not rows:
+            raise KeyError(f"No history entry {id!r}")
+        if len(rows) > 1:
+            raise KeyError(f"History entry {id!r} is ambiguous; give more characters")
+        return rows[0][0]
+
+    def get(self, id: str) -> Entry:
+        """
+        Look up an entry by its id or a unique prefix of it
+
+        :raises KeyError: if there is no such entry, or the prefix matches several
+        """
+        row = self._db.execute(f'SELECT {_ENTRY_COLUMNS} FROM entries WHERE hash = ?', (self._resolve(id),)).fetchone()
+        return Entry(*row)
+
+    def data(self, id: str) -> bytes:
+        """
+        The contents of an entry (by id or unique prefix)
+        """
+        return self._db.execute('SELECT data FROM entries WHERE hash = ?', (self._resolve(id),)).fetchone()[0]
+
+    def entries(self, limit: int = None) -> List[Entry]:
+        """
+        The stored entries, most recently used first
+        """
+        rows = self._db.execute(
+            f'SELECT {_ENTRY_COLUMNS} FROM entries ORDER BY last_used DESC, id DESC LIMIT ?',
+            (-1 if limit is None else limit,),
+        )
+        return [Entry(*row) for row in rows]
+
+    def search(self, query: str, limit: int = None) -> List[Entry]:
+        """
+        The text entries containing ``query`` (case-insensitive), most recently used first
+        """
+        limit = -1 if limit is None else limit
+        if self._trigram and len(query) >= _MIN_INDEXED_QUERY:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = self._db.execute(
+                f'SELECT {_ENTRY_COLUMNS} FROM entries WHERE id IN '
+                '(SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?) '
+                'ORDER BY last_used DESC, id DESC LIMIT ?',
+                (phrase, limit),
+            )
+        else:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = self._db.execute(
+                f"SELECT {_ENTRY_COLUMNS} FROM entries WHERE text LIKE ? ESCAPE '\\' "
+                'ORDER BY last_used DESC, id DESC LIMIT ?',
+                (pattern, limit),
+            )
+        return [Entry(*row) for row in rows]
+
+    def restore(self, id: str, clipboard: 'ClipboardBase' = None) -> Entry:
+        """
+        Copy an entry back to the clipboard. It becomes the most recently used entry.
+
+        :param id: the entry id or a unique prefix of it
+        :param clipboard: the clipboard implementation to use. Defaults to the detected one.
+        :return: the entry
+        """
+        if clipboard is None:
+            from . import _get_clipboard
+
+            clipboard = _get_clipboard()
+        entry = self.get(id)
+        data = self.data(entry.id)
+        clipboard.copy({entry.mime: data} if entry.mime else data)
+        return self.add(data, entry.mime)
+
+    def record(self, clipboard: 'ClipboardBase' = None, debounce: float = 0.0) -> None:
+        """
+        Store the clipboard contents every time they change, until interrupted (or until the clipboard
+        implementation fails)
+
+        :param clipboard: the clipboard implementation to watch. Defaults to the detected one.
+        :param debounce: see :py:meth:`~pyclip.base.ClipboardBase.watch`
+        """
+        if clipboard is None:
+            from . import _get_clipboard
+
+            clipboard = _get_clipboard()
+        try:
+            current = clipboard.paste()
+        except ClipboardException:
+            current = b''
+        if current:
+            self.add(current, self._pasted_mime(clipboard))
+        for contents in clipboard.watch(debounce=debounce):
+            if contents:
+                self.add(contents, self._pasted_mime(clipboard))
+
+    @staticmethod
+    def _pasted_mime(clipboard: 'ClipboardBase') -> Optional[str]:
+        try:
+            return clipboard._paste_mime()
+        except ClipboardException:
+            return None  # the contents are worth keeping even when their type cannot be told
@@ -0,0 +1,378 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Instrumentation of clipboard operations.
+
+Every public operation of a :py:class:`~pyclip.base.ClipboardBase` implementation (``copy``, ``paste``, ``clear``,
+``copy_stream``, ``iter_paste``, ``paste_into``, ``paste_to_file`` and ``list_targets``) produces a
+:py:class:`ClipboardEvent` for the registered hooks. Implementations break the time down into phases:
+
+``negotiate``
+    finding out which target to paste (e.g. ``xclip -t TARGETS``)
+``spawn``
+    starting helper processes
+``transfer``
+    moving the data to or from the clipboard (for ``subprocess.run`` based calls, this includes the spawn)
+``decode``
+    decoding text
+
+.. code-block:: python
+
+    from pyclip import instrumentation
+
+    instrumentation.add_hook(print)                   # any callable taking a ClipboardEvent
+    instrumentation.add_hook(instrumentation.LoggingHook())
+    instrumentation.enable_stats()
+    ...
+    instrumentation.stats()  # {'XclipClipboard': {'paste': {'count': 3, 'total_time': ..., ...}}}
+
+When no hook is registered, an operation only costs a check of the (empty) hook list.
+"""
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+_HOOKS: List[Callable[['ClipboardEvent'], Any]] = []
+_local = threading.local()
+_CO_GENERATOR = 0x20  # inspect.CO_GENERATOR, without importing inspect
+#: the wrappers made by instrument(). An attribute would not do: functools.wraps copies it to delegating methods.
+_WRAPPERS = set()
+
+
+class ClipboardEvent:
+    """
+    What happened during one clipboard operation
+
+    :ivar backend: name of the implementation class
+    :ivar operation: name of the method, e.g. ``'paste'``
+    :ivar start: ``time.time()`` when the operation started
+    :ivar duration: seconds the operation took
+    :ivar phases: seconds spent in each phase (see the module documentation)
+    :ivar bytes: size of the data copied or pasted (characters, for ``str``)
+    :ivar subprocesses: number of helper processes started
+    :ivar retries: number of times a busy resource was retried (e.g. opening the Windows clipboard)
+    :ivar error: the exception raised by the operation, if any
+    """
+
+    __slots__ = ('backend', 'operation', 'start', 'duration', 'phases', 'bytes', 'subprocesses', 'retries', 'error')
+
+    def __init__(self, backend: str, operation: str):
+        self.backend = backend
+        self.operation = operation
+        self.start = time.time()
+        self.duration = 0.0
+        self.phases: Dict[str, float] = {}
+        self.bytes: Optional[int] = None
+        self.subprocesses = 0
+        self.retries = 0
+        self.error: Optional[BaseException] = None
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class _Phase:
+    __slots__ = ('_event', '_name', '_start')
+
+    def __init__(self, event: ClipboardEvent, name: str):
+        self._event = event
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        phases = self._event.phases
+        phases[self._name] = phases.get(self._name, 0.0) + time.perf_counter() - self._start
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class _Recorder:
+    """
+    Collects the details of the operation in progress on this thread
+    """
+
+    __slots__ = ('event',)
+
+    def __init__(self, event: ClipboardEvent):
+        self.event = event
+
+    def phase(self, name: str):
+        return _Phase(self.event, name)
+
+    def spawned(self, count: int = 1) -> None:
+        self.event.subprocesses += count
+
+    def retried(self, count: int = 1) -> None:
+        self.event.retries += count
+
+    def transferred(self, count: int) -> None:
+        self.event.bytes = (self.event.bytes or 0) + count
+
+
+class _NullRecorder:
+    __slots__ = ()
+    _phase = _NullPhase()
+
+    def phase(self, name: str):
+        return self._phase
+
+    def spawned(self, count: int = 1) -> None:
+        pass
+
+    def retried(self, count: int = 1) -> None:
+        pass
+
+    def transferred(self, count: int) -> None:
+        pass
+
+
+_NULL_RECORDER = _NullRecorder()
+
+
+def current():
+    """
+    The recorder of the operation running on this thread. Implementations report phases, subprocesses, retries
+    and byte counts to it; when instrumentation is disabled, it ignores them.
+    """
+    if not _HOOKS:
+        return _NULL_RECORDER
+    return getattr(_local, 'recorder', None) or _NULL_RECORDER
+
+
+def add_hook(hook: Callable[[ClipboardEvent], Any]) -> None:
+    """
+    Call ``hook`` with a :py:class:`ClipboardEvent` after every clipboard operation (from the thread that ran it)
+    """
+    _HOOKS.append(hook)
+
+
+def remove_hook(hook: Callable[[ClipboardEvent], Any]) -> None:
+    """
+    Stop calling a hook added with :py:func:`add_hook`
+    """
+    _HOOKS.remove(hook)
+
+
+def _size(value) -> Optional[int]:
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(v) or 0 for v in value.values())
+    try:
+        with memoryview(value) as view:  # other bytes-like objects, e.g. mmap
+            return view.nbytes
+    except TypeError:
+        return None
+
+
+def _emit(event: ClipboardEvent) -> None:
+    for hook in list(_HOOKS):
+        try:
+            hook(event)
+        except Exception:  # a broken hook must not break the clipboard
+            import logging
+
+            logging.getLogger(__name__).exception("Clipboard instrumentation hook %r failed", hook)
+
+
+def instrument(func: Callable, operation: str) -> Callable:
+    """
+    Wrap a clipboard method so that it produces a :py:class:`ClipboardEvent`. Operations called from within an
+    instrumented operation (like ``clear`` calling ``copy``) are part of the outer event.
+    """
+    if func in _WRAPPERS:
+        return func
+    if func.__code__.co_flags & _CO_GENERATOR:
+
+        @functools.wraps(func)
+        def generator_wrapper(self, *args, **kwargs):
+            if not _HOOKS or getattr(_local, 'recorder', None) is not None:
+                yield from func(self, *args, **kwargs)
+                return
+            event = ClipboardEvent(type(self).__name__, operation)
+            recorder = _Recorder(event)
+            start = time.perf_counter()
+            size = 0
+            generator = func(self, *args, **kwargs)
+            try:
+                while True:
+                    _local.recorder = recorder
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        _local.recorder = None
+                    size += _size(item) or 0
+                    yield item
+            except GeneratorExit:
+                raise  # the caller stopped early
+            except BaseException as e:
+                event.error = e
+                raise
+            finally:
+                generator.close()
+                event.duration = time.perf_counter() - start
+                if event.bytes is None:
+                    event.bytes = size
+                _emit(event)
+
+        _WRAPPERS.add(generator_wrapper)
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not _HOOKS or getattr(_local, 'recorder', None) is not None:
+            return func(self, *args, **kwargs)
+        event = ClipboardEvent(type(self).__name__, operation)
+        _local.recorder = _Recorder(event)
+        start = time.perf_counter()
+        try:
+            result = func(self, *args, **kwargs)
+        except BaseException as e:
+            event.error = e
+            raise
+        else:
+            if event.bytes is None:
+                if operation in ('paste_into', 'paste_to_file'):
+                    event.bytes = result
+                elif operation == 'copy':
+                    event.bytes = _size(args[0] if args else kwargs.get('data'))
+                else:
+                    event.bytes = _size(result)
+            return result
+        finally:
+            _local.recorder = None
+            event.duration = time.perf_counter() - start
+            _emit(event)
+
+    _WRAPPERS.add(wrapper)
+    return wrapper
+
+
+class LoggingHook:
+    """
+    A hook that logs every event, with the event in the ``clipboard_event`` attribute of the log record
+
+    :param logger: the logger to use. Defaults to the ``pyclip`` logger.
+    :param level: the level to log at
+    """
+
+    def __init__(self, logger=None, level: int = None):
+        import logging
+
+        self.logger = logger or logging.getLogger('pyclip')
+        self.level = logging.DEBUG if level is None else level
+
+    def __call__(self, event: ClipboardEvent) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+        phases = ' '.join(f'{name}={seconds * 1000:.2f}ms' for name, seconds in event.phases.items())
+        self.logger.log(
+            self.level,
+            '%s.%s %s in %.2fms: %s bytes, %d subprocesses, %d retries%s',
+            event.backend,
+            event.operation,
+            'failed' if event.error is not None else 'done',
+            event.duration * 1000,
+            event.bytes,
+            event.subprocesses,
+            event.retries,
+            f' ({phases})' if phases else '',
+            extra={'clipboard_event': event},
+        )
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def __call__(self, event: ClipboardEvent) -> None:
+        with self.lock:
+            operations = self.totals.setdefault(event.backend, {})
+            totals = operations.get(event.operation)
+            if totals is None:
+                totals = operations[event.operation] = {
+                    'count': 0,
+                    'errors': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'bytes': 0,
+                    'subprocesses': 0,
+                    'retries': 0,
+                    'phases': {},
+                }
+            totals['count'] += 1
+            totals['errors'] += event.error is not None
+            totals['total_time'] += event.duration
+            totals['max_time'] = max(totals['max_time'], event.duration)
+            totals['bytes'] += event.bytes or 0
+            totals['subprocesses'] += event.subprocesses
+            totals['retries'] += event.retries
+            for name, seconds in event.phases.items():
+                totals['phases'][name] = totals['phases'].get(name, 0.0) + seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        with self.lock:
+            return {
+                backend: {op: dict(totals, phases=dict(totals['phases'])) for op, totals in operations.items()}
+                for backend, operations in self.totals.items()
+            }
+
+
+_STATS: Optional[_Stats] = None
+
+
+def enable_stats() -> None:
+    """
+    Start aggregating events for :py:func:`stats`
+    """
+    global _STATS
+    if _STATS is None:
+        _STATS = _Stats()
+        add_hook(_STATS)
+
+
+def disable_stats() -> None:
+    """
+    Stop aggregating events and discard the totals
+    """
+    global _STATS
+    if _STATS is not None:
+        remove_hook(_STATS)
+        _STATS = None
+
+
+def stats() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Totals per backend and operation since :py:func:`enable_stats`: ``count``, ``errors``, ``total_time``,
+    ``max_time``, ``bytes``, ``subprocesses``, ``retries`` and the total time per phase (``phases``).
+    Empty when stats are not enabled.
+    """
+    if _STATS is None:
+        return {}
+    return _STATS.snapshot()
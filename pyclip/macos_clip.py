@@ -14,21 +14,27 @@
 """
 Provides clipboard for MacOS
 """
-from .base import ClipboardBase, ClipboardException, ClipboardSetupException
+from . import instrumentation, spawn
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException, SubprocessClipboardBase, _byte_view, _decode, _encode_formats
+import ctypes
+import ctypes.util
 import subprocess
 import shutil
-from typing import Union
+from typing import Dict, List, Optional, Union
 import logging
 import warnings
 from functools import wraps
 logger = logging.getLogger(__name__)
 
 
-class _PBCopyPBPasteBackend(ClipboardBase):
+class _PBCopyPBPasteBackend(SubprocessClipboardBase):
     """
     MacOS Clipboard backend using pbcopy/pbpaste
 
     """
+    _copy_helper_name = 'pbcopy'
+    _paste_helper_name = 'pbpaste'
+
     def __init__(self):
         self.pbcopy = shutil.which('pbcopy')
         self.pbpaste = shutil.which('pbpaste')
@@ -36,58 +42,93 @@ class _PBCopyPBPasteBackend(ClipboardBase):
             raise ClipboardSetupException("pbcopy not found. pbcopy must be installed and available on PATH")
         if not self.pbpaste:
             raise ClipboardSetupException("pbpaste not found. pbpaste must be installed and available on PATH")
+        self._paste_cache = _PasteCache()
+
+    def _copy_args(self, mime: str = None) -> List[str]:
+        if mime not in (None, 'text/plain'):
+            raise ClipboardException(f"pbcopy can only copy plain text, not {mime!r}")
+        return [self.pbcopy]
+
+    def _paste_args(self, mime: str = None) -> List[str]:
+        if mime not in (None, 'text/plain'):
+            raise ClipboardException(f"pbpaste can only paste plain text, not {mime!r}")
+        return [self.pbpaste]
+
+    def _change_token(self) -> Optional[int]:
+        return _change_count()
 
     def copy(self, data: Union[str, bytes], encoding: str = None) -> None:
         """
         Copy data into the clipboard
 
-        :param data: the data to be copied to the clipboard. Can be str or bytes.
+        :param data: the data to be copied to the clipboard. Can be str, bytes or another bytes-like object,
+            or ``{'text/plain': data}``. pbcopy only supports plain text.
         :param encoding: same meaning as in ``subprocess.Popen``.
         :return: None
         """
-        args = [self.pbcopy]
-        if isinstance(data, bytes):
+        if isinstance(data, dict):
+            mime, data = self._single_format(data, encoding)
+            encoding = None
+            args = self._copy_args(mime)
+        else:
+            args = self._copy_args()
+        if not isinstance(data, (str, bytes)):
+            data = _byte_view(data)  # piped to pbcopy as is
+        if not isinstance(data, str):
             if encoding is not None:
                 warnings.warn("encoding specified with a bytes argument. "
                               "Encoding option will be ignored. "
                               "To remove this warning, omit the encoding parameter or specify it as None", stacklevel=2)
-            proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding=encoding)
-        elif isinstance(data, str):
-            proc = subprocess.Popen(args, stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    text=True, encoding=encoding)
+            proc = spawn.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding=encoding)
         else:
-            raise TypeError(f"data argument must be of type str or bytes, not {type(data)}")
-        stdout, stderr = proc.communicate(data)
+            proc = spawn.Popen(args, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               text=True, encoding=encoding)
+        recorder = instrumentation.current()
+        recorder.spawned()
+        with recorder.phase('transfer'):
+            stdout, stderr = proc.communicate(data)
         if proc.returncode != 0:
             raise ClipboardException(f"Copy failed. pbcopy returned code: {proc.returncode!r} "
                                      f"Stderr: {stderr!r} "
                                      f"Stdout: {stdout!r}")
         return
 
-    def paste(self, encoding=None, text=None, errors=None) -> Union[str, bytes]:
+    def paste(self, encoding=None, text=None, errors=None, mime: str = None) -> Union[str, bytes]:
         """
         Retrieve data from the clipboard
 
+        Results are cached until the pasteboard's ``changeCount`` changes, so pasting unchanged contents
+        does not start pbpaste again.
+
         :param encoding: same meaning as in ``subprocess.run``
         :param text: same meaning as in ``subprocess.run``
         :param errors: same meaning as in ``subprocess.run``
+        :param mime: only ``'text/plain'`` is supported
         :return: the clipboard contents. return type is binary by default.
         If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
         """
-
-        args = [self.pbpaste]
-        if encoding or text or errors:
-            completed_proc = subprocess.run(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                            text=text, encoding=encoding)
-        else:
-            completed_proc = subprocess.run(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        key = (mime, encoding, text, errors)
+        cached = self._paste_cache.get(key)
+        if cached is not None:
+            return cached
+        args = self._paste_args(mime)
+        recorder = instrumentation.current()
+        recorder.spawned()
+        with recorder.phase('transfer'):
+            if encoding or text or errors:
+                completed_proc = spawn.run(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE, text=text, encoding=encoding)
+            else:
+                completed_proc = spawn.run(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
 
         if completed_proc.returncode != 0:
             raise ClipboardException(f"Copy failed. pbcopy returned code: {completed_proc.returncode!r} "
                                      f"Stderr: {completed_proc.stderr!r} "
                                      f"Stdout: {completed_proc.stdout!r}")
+        self._paste_cache.put(key, completed_proc.stdout)
         return completed_proc.stdout
 
     def clear(self):
@@ -98,56 +139,249 @@ class _PBCopyPBPasteBackend(ClipboardBase):
         """
         self.copy(b'')
 
+#: Uniform Type Identifiers for the MIME types accepted by ``copy``. Other names are used as UTIs.
+_UTI_BY_MIME = {
+    'text/plain': 'public.utf8-plain-text',
+    'text/html': 'public.html',
+    'text/rtf': 'public.rtf',
+    'image/png': 'public.png',
+    'image/tiff': 'public.tiff',
+    'application/pdf': 'com.adobe.pdf',
+}
+
+
+class _AppKitPasteboard:
+    """
+    Minimal access to ``NSPasteboard.generalPasteboard`` through the Objective-C runtime (via ctypes),
+    for what the ``pasteboard`` package does not provide.
+    """
+
+    def __init__(self):
+        objc_name = ctypes.util.find_library('objc')
+        appkit_name = ctypes.util.find_library('AppKit')
+        if not objc_name or not appkit_name:
+            raise OSError("The Objective-C runtime and AppKit are required")
+        self._objc = objc = ctypes.CDLL(objc_name)
+        ctypes.CDLL(appkit_name)  # loads the NSPasteboard class
+        objc.objc_getClass.restype = ctypes.c_void_p
+        objc.objc_getClass.argtypes = [ctypes.c_char_p]
+        objc.sel_registerName.restype = ctypes.c_void_p
+        objc.sel_registerName.argtypes = [ctypes.c_char_p]
+        objc.objc_autoreleasePoolPush.restype = ctypes.c_void_p
+        objc.objc_autoreleasePoolPop.argtypes = [ctypes.c_void_p]
+        self._msg_send_address = ctypes.cast(objc.objc_msgSend, ctypes.c_void_p).value
+        self._prototypes = {}
+        self._pasteboard = self._send(self._class('NSPasteboard'), 'generalPasteboard')
+
+    def _class(self, name: str) -> int:
+        return self._objc.objc_getClass(name.encode())
+
+    def _send(self, receiver, selector: str, *args, restype=ctypes.c_void_p, argtypes=()):
+        # objc_msgSend must be called through a prototype matching the method's signature
+        key = (restype, tuple(argtypes))
+        if key not in self._prototypes:
+            prototype = ctypes.CFUNCTYPE(restype, ctypes.c_void_p, ctypes.c_void_p, *argtypes)
+            self._prototypes[key] = prototype(self._msg_send_address)
+        return self._prototypes[key](receiver, self._objc.sel_registerName(selector.encode()), *args)
+
+    def change_count(self) -> int:
+        """
+        The pasteboard's change counter, which is incremented every time its contents are replaced
+        """
+        return self._send(self._pasteboard, 'changeCount', restype=ctypes.c_long)
+
+    def write(self, formats: Dict[str, bytes]) -> None:
+        """
+        Replace the pasteboard contents with ``formats`` (``{UTI: data}``), as a single pasteboard item
+        """
+        pool = self._objc.objc_autoreleasePoolPush()
+        try:
+            self._send(self._pasteboard, 'clearContents', restype=ctypes.c_long)
+            for uti, data in formats.items():
+                nsdata = self._send(
+                    self._class('NSData'),
+                    'dataWithBytes:length:',
+                    data,
+                    len(data),
+                    argtypes=(ctypes.c_char_p, ctypes.c_ulong),
+                )
+                nstype = self._send(
+                    self._class('NSString'), 'stringWithUTF8String:', uti.encode(), argtypes=(ctypes.c_char_p,)
+                )
+                written = self._send(
+                    self._pasteboard,
+                    'setData:forType:',
+                    nsdata,
+                    nstype,
+                    restype=ctypes.c_bool,
+                    argtypes=(ctypes.c_void_p, ctypes.c_void_p),
+                )
+                if not written:
+                    raise ClipboardException(f"Copy failed. The pasteboard did not accept {uti!r}")
+        finally:
+            self._objc.objc_autoreleasePoolPop(pool)
+
+
+#: ``pasteboard`` package types for the MIME types accepted by ``copy`` and ``paste``
+_PASTEBOARD_TYPE_BY_MIME = {
+    'text/plain': 'String',
+    'text/html': 'HTML',
+    'text/rtf': 'RTF',
+    'image/png': 'PNG',
+    'image/tiff': 'TIFF',
+    'application/pdf': 'PDF',
+}
+
+_SHARED_APPKIT = None
+
+
+def _change_count() -> Optional[int]:
+    """
+    ``changeCount`` of the general pasteboard, or None if AppKit cannot be loaded
+    """
+    global _SHARED_APPKIT
+    if _SHARED_APPKIT is None:
+        try:
+            _SHARED_APPKIT = _AppKitPasteboard()
+        except OSError:
+            _SHARED_APPKIT = False
+    return _SHARED_APPKIT.change_count() if _SHARED_APPKIT else None
+
+
+class _PasteCache:
+    """
+    Paste results for the current ``changeCount`` of the general pasteboard. Any change to the pasteboard
+    (including a copy by this process) increments the count and so empties the cache. Without AppKit,
+    nothing is cached.
+    """
+
+    def __init__(self):
+        self._change_count = None
+        self._results = {}
+
+    def get(self, key) -> Union[str, bytes, None]:
+        change_count = _change_count()
+        if change_count is None or change_count != self._change_count:
+            return None
+        return self._results.get(key)
+
+    def put(self, key, result: Union[str, bytes]) -> None:
+        change_count = _change_count()
+        if change_count is None:
+            return
+        if change_count != self._change_count:
+            self._change_count = change_count
+            self._results = {}
+        self._results[key] = result
+
+
 class _PasteboardBackend(ClipboardBase):
     """
     MacOS Clipboard backend using the ``pasteboard`` package.
     """
     def __init__(self):
         import pasteboard
+        self._pasteboard = pasteboard
         self.pb = pasteboard.Pasteboard()
         self._bytes_type = pasteboard.PDF
+        self._appkit = None
+        self._paste_cache = _PasteCache()
+
+    def _pasteboard_type(self, mime: str):
+        """
+        The ``pasteboard`` package type for a MIME type, or None if the package has none for it
+        """
+        name = _PASTEBOARD_TYPE_BY_MIME.get(mime.split(';')[0])
+        return getattr(self._pasteboard, name, None) if name else None
 
-    def copy(self, data: Union[str, bytes], encoding: str =None):
+    def _change_token(self) -> Optional[int]:
+        return _change_count()
+
+    def _copy_formats(self, formats: Dict[str, Union[str, bytes]], encoding: str = None) -> None:
+        formats = {_UTI_BY_MIME.get(mime, mime): data for mime, data in _encode_formats(formats, encoding).items()}
+        if self._appkit is None:
+            try:
+                self._appkit = _AppKitPasteboard()
+            except OSError as e:
+                raise ClipboardException(f"Copy failed. Cannot write several formats: {e}") from e
+        self._appkit.write(formats)
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str =None):
         """
 
-        :param data: data to copy to the clipboard
-        :param encoding: this parameter is ignored on this backend
+        Untyped ``bytes`` are stored as text if they decode as UTF-8, and as PDF data otherwise. To skip that
+        check (a full decode of the data), state the type: ``copy({'application/pdf': data})``.
+
+        :param data: data to copy to the clipboard. May also be a dict mapping MIME types (or UTIs)
+            to str or bytes, which are written to the pasteboard at once
+        :param encoding: this parameter is ignored on this backend, except for ``str`` values in a dict
         :return:
         """
-        if isinstance(data, bytes):
-            try:
-                data = data.decode()
-                self.pb.set_contents(data)
-            except UnicodeDecodeError:
-                self.pb.set_contents(data, self._bytes_type)
-        elif isinstance(data, str):
+        if isinstance(data, dict):
+            if len(data) == 1:
+                (mime, value), = data.items()
+                is_text = mime.split(';')[0] == 'text/plain'
+                pasteboard_type = self._pasteboard_type(mime)
+                if pasteboard_type is not None and (isinstance(value, str) or not is_text):
+                    # a single type the package knows: no need for the ctypes path
+                    if isinstance(value, str) and not is_text:
+                        value = value.encode(encoding or 'utf-8')
+                    elif not isinstance(value, (str, bytes)):
+                        value = _byte_view(value).tobytes()  # the package only takes bytes
+                    self.pb.set_contents(value, pasteboard_type)
+                    return
+            return self._copy_formats(data, encoding)
+        if isinstance(data, str):
             self.pb.set_contents(data)
+            return
+        if not isinstance(data, bytes):
+            data = _byte_view(data)
+        try:
+            text = str(data, 'utf-8')
+        except UnicodeDecodeError:
+            # NSData copies the data anyway; the package only takes bytes
+            self.pb.set_contents(data if isinstance(data, bytes) else data.tobytes(), self._bytes_type)
         else:
-            raise TypeError(f"data argument must be of type str or bytes, not {type(data)}")
+            self.pb.set_contents(text)
 
-    def paste(self, encoding: str = None, text: bool = None, errors: str = None):
+    def paste(self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None):
         """
         Retrieve contents of the clipboard
 
+        Without ``mime``, PDF data is looked for first, then text. Results are cached until the pasteboard's
+        ``changeCount`` changes, so pasting unchanged contents does not read the pasteboard again.
+
         :param encoding: same meaning as in ``bytes.encode``. Implies ``text=True``
         :param text: if True, bytes object will be en
         :param errors: same meaning as in ``bytes.encode``. Implies ``text=True``.
+        :param mime: read only this type (e.g. ``'text/plain'`` or ``'image/png'``), without probing others
         :return: clipboard contents. Return value is bytes by default
         or str if any of ``encoding``, ``text``, or ``errors`` is provided.
         """
-        contents = self.pb.get_contents(self._bytes_type)
-        if contents is None:  # Data was not set as binary
-            contents = self.pb.get_contents()
-            if contents is None:  # no string contents either
-                return b'' if not (encoding or text or errors) else ''
-            if not (encoding or text or errors):
-                contents = contents.encode()
-            return contents
-        else:  # found some binary contents
-            if not (encoding or text or errors):
-                return contents
-            else:
-                return contents.encode(encoding=encoding, errors=errors)
+        text_mode = bool(encoding or text or errors)
+        key = (mime, encoding, text_mode, errors)
+        cached = self._paste_cache.get(key)
+        if cached is not None:
+            return cached
+        if mime is None:
+            contents = self.pb.get_contents(self._bytes_type)
+            if contents is None:  # Data was not set as binary
+                contents = self.pb.get_contents()
+        else:
+            pasteboard_type = self._pasteboard_type(mime)
+            if pasteboard_type is None:
+                raise ClipboardException(f"Cannot paste {mime!r}: the pasteboard package does not support it")
+            contents = self.pb.get_contents(pasteboard_type)
+        if contents is None:  # nothing of the requested types
+            result = '' if text_mode else b''
+        elif isinstance(contents, str):
+            result = contents if text_mode else contents.encode()
+        elif text_mode:
+            result = _decode(contents, encoding, errors)
+        else:
+            result = contents
+        self._paste_cache.put(key, result)
+        return result
 
     def clear(self):
         """
@@ -164,6 +398,8 @@ class MacOSClip(ClipboardBase):
 
     Defers to one of two backends: :py:class:`_PasteboardBackend` (the default) or :py:class:`_PBCopyPBPasteBackend`.
     """
+    _forwards_copies = True  # the backend skips redundant copies
+
     def __init__(self, _backend=None):
         if _backend:
             self.backend = _backend
@@ -173,6 +409,20 @@ class MacOSClip(ClipboardBase):
                 self.backend = _PasteboardBackend()
             except ImportError:
                 self.backend = _PBCopyPBPasteBackend()
+    @property
+    def skip_redundant_copies(self) -> bool:
+        return self.backend.skip_redundant_copies
+
+    @skip_redundant_copies.setter
+    def skip_redundant_copies(self, value: bool) -> None:
+        self.backend.skip_redundant_copies = value
+
+    def _change_token(self):
+        return self.backend._change_token()
+
+    def _session(self):
+        return self.backend.session()
+
     @wraps(_PasteboardBackend.copy)
     def copy(self, *args, **kwargs):
         return self.backend.copy(*args, **kwargs)
@@ -184,3 +434,23 @@ class MacOSClip(ClipboardBase):
     @wraps(_PasteboardBackend.clear)
     def clear(self):
         return self.backend.clear()
+
+    @wraps(ClipboardBase.copy_stream)
+    def copy_stream(self, *args, **kwargs):
+        return self.backend.copy_stream(*args, **kwargs)
+
+    @wraps(ClipboardBase.iter_paste)
+    def iter_paste(self, *args, **kwargs):
+        return self.backend.iter_paste(*args, **kwargs)
+
+    @wraps(ClipboardBase.paste_into)
+    def paste_into(self, *args, **kwargs):
+        return self.backend.paste_into(*args, **kwargs)
+
+    @wraps(ClipboardBase.paste_to_file)
+    def paste_to_file(self, *args, **kwargs):
+        return self.backend.paste_to_file(*args, **kwargs)
+
+    @wraps(ClipboardBase.watch)
+    def watch(self, *args, **kwargs):
+        return self.backend.watch(*args, **kwargs)
@@ -0,0 +1,323 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Registry of clipboard implementations, used by :py:func:`pyclip.util.detect_clipboard`.
+
+Every backend declares the platforms it runs on, the environment variables it needs and its capabilities.
+When more than one backend could work (for example xclip and wl-clipboard on an XWayland session), each one is
+probed: it is set up and its paste round trip is timed, and the fastest one is chosen. The choice is cached in
+``$XDG_RUNTIME_DIR/pyclip/backend.json``, which lives as long as the login session, so probing happens once.
+
+Set ``PYCLIP_BACKEND`` to a backend name to skip detection entirely.
+
+Third-party packages can add backends with an entry point in the ``pyclip.backends`` group, pointing to either a
+:py:class:`Backend` or a :py:class:`~pyclip.base.ClipboardBase` subclass (which may define a ``capabilities``
+attribute)::
+
+    entry_points={'pyclip.backends': ['mybackend = mypackage.clip:MyClipboard']}
+
+Capabilities used by the built-in backends:
+
+``binary``
+    arbitrary bytes can be copied and pasted
+``mime``
+    ``paste(mime=...)`` retrieves a specific format
+``targets``
+    ``list_targets()`` lists the available formats
+``events``
+    ``watch()`` is notified of changes instead of polling
+"""
+import importlib
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException
+
+ENTRY_POINT_GROUP = 'pyclip.backends'
+_PROBE_ROUNDS = 3
+_CACHE_VERSION = 1
+
+
+class Backend:
+    """
+    Describes a clipboard implementation without importing it.
+
+    :param name: unique name of the backend, as used by ``PYCLIP_BACKEND``
+    :param factory: a callable returning the clipboard instance, or a ``'module:attribute'`` string naming one
+    :param platforms: values of ``sys.platform`` the backend supports. Empty means any platform.
+    :param requires_env: environment variables that must be set for the backend to be considered
+    :param capabilities: features of the backend (see the module documentation)
+    :param priority: used to order the candidates when they are not (or cannot be) probed. Lower comes first.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Union[str, Callable[[], ClipboardBase]],
+        platforms: Iterable[str] = (),
+        requires_env: Iterable[str] = (),
+        capabilities: Iterable[str] = (),
+        priority: int = 100,
+    ):
+        self.name = name
+        self.factory = factory
+        self.platforms: FrozenSet[str] = frozenset(platforms)
+        self.requires_env: Tuple[str, ...] = tuple(requires_env)
+        self.capabilities: FrozenSet[str] = frozenset(capabilities)
+        self.priority = priority
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.name!r})'
+
+    def is_candidate(self) -> bool:
+        """
+        Whether the backend may work here, judging only by the platform and the environment
+        """
+        if self.platforms and sys.platform not in self.platforms:
+            return False
+        return all(os.environ.get(name) for name in self.requires_env)
+
+    def create(self) -> ClipboardBase:
+        """
+        Instantiate the backend
+
+        :raises ClipboardSetupException: if it cannot be set up
+        """
+        factory = self.factory
+        if isinstance(factory, str):
+            module_name, _, attribute = factory.partition(':')
+            factory = getattr(importlib.import_module(module_name), attribute)
+        return factory()
+
+
+_BACKENDS: Dict[str, Backend] = {}
+_ENTRY_POINTS_LOADED = False
+
+
+def register_backend(backend: Backend) -> Backend:
+    """
+    Add a backend to the registry, replacing any backend with the same name
+
+    :return: the backend
+    """
+    _BACKENDS[backend.name] = backend
+    return backend
+
+
+for _backend in (
+    Backend('macos', 'pyclip.macos_clip:MacOSClip', platforms=['darwin'], capabilities=['binary']),
+    Backend('windows', 'pyclip.win_clip:WindowsClipboard', platforms=['win32'], capabilities=['binary', 'events']),
+    Backend(
+        'wayland-datacontrol',
+        'pyclip.wayland_datacontrol_clip:WaylandDataControlClipboard',
+        platforms=['linux'],
+        requires_env=['WAYLAND_DISPLAY'],
+        capabilities=['binary', 'mime', 'targets', 'events'],
+        priority=10,
+    ),
+    Backend(
+        'wl-clipboard',
+        'pyclip.wayland_clip:WaylandClipboard',
+        platforms=['linux'],
+        requires_env=['WAYLAND_DISPLAY'],
+        capabilities=['binary', 'mime', 'events'],
+        priority=20,
+    ),
+    Backend(
+        'xlib',
+        'pyclip.xlib_clip:XlibClipboard',
+        platforms=['linux'],
+        requires_env=['DISPLAY'],
+        capabilities=['binary', 'mime', 'targets', 'events'],
+        priority=30,
+    ),
+    Backend(
+        'xclip',
+        'pyclip.xclip_clip:XclipClipboard',
+        platforms=['linux'],
+        capabilities=['binary', 'mime', 'targets', 'events'],
+        priority=40,
+    ),
+):
+    register_backend(_backend)
+
+
+def _load_entry_points() -> None:
+    global _ENTRY_POINTS_LOADED
+    if _ENTRY_POINTS_LOADED:
+        return
+    _ENTRY_POINTS_LOADED = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python 3.7
+        return
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    for ep in eps:
+        try:
+            loaded = ep.load()
+        except Exception as e:
+            import warnings
+
+            warnings.warn(f"Could not load clipboard backend {ep.name!r}: {e!r}")
+            continue
+        if not isinstance(loaded, Backend):
+            loaded = Backend(ep.name, loaded, capabilities=getattr(loaded, 'capabilities', ()))
+        register_backend(loaded)
+
+
+def backends() -> List[Backend]:
+    """
+    All registered backends, including those from entry points, in priority order
+    """
+    _load_entry_points()
+    return sorted(_BACKENDS.values(), key=lambda backend: backend.priority)
+
+
+def candidates(capabilities: Iterable[str] = ()) -> List[Backend]:
+    """
+    The registered backends that may work in this environment and have all of ``capabilities``, in priority order
+    """
+    required = frozenset(capabilities)
+    return [b for b in backends() if b.is_candidate() and required <= b.capabilities]
+
+
+def probe(clipboard: ClipboardBase, rounds: int = _PROBE_ROUNDS) -> Optional[float]:
+    """
+    Measure the paste round trip of a clipboard implementation. The clipboard contents are not modified.
+
+    :return: the fastest of ``rounds`` pastes, in seconds, or None if pasting failed (e.g. the clipboard is empty)
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        try:
+            clipboard.paste()
+        except ClipboardSetupException:
+            raise
+        except ClipboardException:
+            return None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _cache_path() -> Optional[str]:
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        return None
+    return os.path.join(runtime_dir, 'pyclip', 'backend.json')
+
+
+def _cache_key(names: List[str]) -> Dict[str, object]:
+    return {
+        'version': _CACHE_VERSION,
+        'platform': sys.platform,
+        'executable': sys.executable,
+        'display': os.environ.get('DISPLAY'),
+        'wayland_display': os.environ.get('WAYLAND_DISPLAY'),
+        'path': os.environ.get('PATH'),
+        'candidates': names,
+    }
+
+
+def _read_cache(key: Dict[str, object]) -> Optional[str]:
+    path = _cache_path()
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    return cached.get('backend')
+
+
+def _write_cache(key: Dict[str, object], name: str, latencies: Dict[str, Optional[float]]) -> None:
+    path = _cache_path()
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'backend': name, 'latencies': latencies}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # caching is an optimization only
+
+
+def select_backend(capabilities: Iterable[str] = (), use_cache: bool = True) -> ClipboardBase:
+    """
+    Create the fastest working clipboard implementation for this environment.
+
+    :param capabilities: only consider backends that have all of these capabilities
+    :param use_cache: reuse (and store) the result of a previous probe in this session
+    :return: the clipboard implementation
+    :raises ClipboardSetupException: if no backend works here
+    """
+    forced = os.environ.get('PYCLIP_BACKEND')
+    if forced:
+        _load_entry_points()
+        if forced not in _BACKENDS:
+            raise ClipboardSetupException(f"Unknown clipboard backend {forced!r} in PYCLIP_BACKEND")
+        return _BACKENDS[forced].create()
+
+    found = candidates(capabilities)
+    if not found:
+        raise ClipboardSetupException("No suitable clipboard found.")
+    by_name = {backend.name: backend for backend in found}
+    key = _cache_key(list(by_name))
+    if use_cache and len(found) > 1:
+        cached = _read_cache(key)
+        if cached in by_name:
+            try:
+                return by_name[cached].create()
+            except ClipboardSetupException:
+                pass  # the environment changed; probe again
+
+    errors = []
+    working: List[Tuple[Backend, ClipboardBase]] = []
+    for backend in found:
+        try:
+            working.append((backend, backend.create()))
+        except ClipboardSetupException as e:
+            errors.append(f'{backend.name}: {e}')
+    if not working:
+        raise ClipboardSetupException(f"No suitable clipboard found. {'; '.join(errors)}")
+    if len(working) == 1:
+        return working[0][1]
+
+    latencies: Dict[str, Optional[float]] = {}
+    for backend, clipboard in working:
+        try:
+            latencies[backend.name] = probe(clipboard)
+        except ClipboardSetupException:
+            latencies[backend.name] = None
+    measured = [(latencies[b.name], index) for index, (b, _) in enumerate(working) if latencies[b.name] is not None]
+    chosen = working[min(measured)[1]] if measured else working[0]
+    for _, clipboard in working:
+        if clipboard is not chosen[1]:
+            clipboard.release()
+    if use_cache and measured:  # a choice made by priority alone is not worth keeping
+        _write_cache(key, chosen[0].name, latencies)
+    return chosen[1]
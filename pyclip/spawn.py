@@ -0,0 +1,429 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Launching of helper programs (``xclip``, ``wl-copy``, ``pbcopy``...) through a spawn server.
+
+Starting a process costs more the more memory the parent has mapped, and under strict overcommit, forking a large
+process can fail outright. Applications with a large memory footprint can start a small spawn server early, while
+they are still small:
+
+.. code-block:: python
+
+    import pyclip.spawn
+    pyclip.spawn.start()
+
+or set ``PYCLIP_SPAWN_SERVER=1`` to have it started before the first helper is needed. The server is a separate,
+minimal Python process. From then on, every helper started by the subprocess based implementations (and by
+:py:mod:`pyclip.aio` for them) is created by the server, with the caller's pipes, environment and working
+directory, so their cost no longer depends on the caller's size. The server exits with the process that started it.
+
+:py:func:`Popen`, :py:func:`run` and :py:func:`check_output` take the same arguments as their ``subprocess``
+counterparts (except ``preexec_fn``, ``pass_fds``, ``shell`` and ``executable``, which fall back to starting the
+process directly) and behave the same. When no server is running, they are the ``subprocess`` functions.
+
+Only available on POSIX platforms, which can pass file descriptors over Unix sockets, and with ``subprocess``
+implementations whose process creation it knows how to redirect (CPython 3.2 and later).
+"""
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+from typing import List, Optional
+
+_HEADER_LENGTH = struct.Struct('!I')
+_STATUS = struct.Struct('!i')
+_MAX_FDS = 4
+#: ``subprocess.Popen`` options the server cannot honour; when given, the process is started directly
+_LOCAL_ONLY_OPTIONS = ('preexec_fn', 'pass_fds', 'shell', 'executable')
+#: leading parameters of CPython's private ``Popen._execute_child``, which :py:class:`_ServerPopen` overrides.
+#: They have been the same since Python 3.2; on an interpreter where they differ, processes are started directly.
+_EXECUTE_CHILD_PARAMETERS = (
+    'self', 'args', 'executable', 'preexec_fn', 'close_fds', 'pass_fds', 'cwd', 'env', 'startupinfo',
+    'creationflags', 'shell', 'p2cread', 'p2cwrite', 'c2pread', 'c2pwrite', 'errread', 'errwrite',
+)
+
+
+def _proxy_supported() -> bool:
+    """
+    Whether this interpreter's ``subprocess.Popen`` has the private methods :py:class:`_ServerPopen` overrides,
+    with the signatures it expects
+    """
+    try:
+        code = subprocess.Popen._execute_child.__code__
+        wait_code = subprocess.Popen._try_wait.__code__
+        subprocess.Popen._internal_poll, subprocess.Popen._handle_exitstatus
+    except AttributeError:
+        return False
+    return (
+        code.co_varnames[: len(_EXECUTE_CHILD_PARAMETERS)] == _EXECUTE_CHILD_PARAMETERS
+        and wait_code.co_varnames[: wait_code.co_argcount] == ('self', 'wait_flags')
+    )
+
+
+def _send(sock: socket.socket, message: dict, fds: List[int] = ()) -> None:
+    data = json.dumps(message).encode()
+    data = _HEADER_LENGTH.pack(len(data)) + data
+    if fds:
+        sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack(f'{len(fds)}i', *fds))])
+        data = data[sent:]
+    sock.sendall(data)
+
+
+def _recv_exactly(sock: socket.socket, size: int, data: bytes = b'') -> bytes:
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The spawn server connection was closed")
+        data += chunk
+    return data
+
+
+def _recv(sock: socket.socket):
+    """
+    Receive a message and the file descriptors sent along with it. Returns ``(None, [])`` at end of stream.
+    """
+    int_size = struct.calcsize('i')
+    data, ancillary, _, _ = sock.recvmsg(_HEADER_LENGTH.size, socket.CMSG_SPACE(_MAX_FDS * int_size))
+    fds = []
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            count = len(payload) // int_size
+            fds.extend(struct.unpack(f'{count}i', payload[: count * int_size]))
+    if not data:
+        for fd in fds:
+            os.close(fd)
+        return None, []
+    header = _recv_exactly(sock, _HEADER_LENGTH.size, data)
+    (length,) = _HEADER_LENGTH.unpack(header)
+    return json.loads(_recv_exactly(sock, length)), fds
+
+
+# The server. It runs as a script in a fresh interpreter, so it only uses the standard library.
+
+
+def _supervise(proc: subprocess.Popen, channel: socket.socket) -> None:
+    """
+    Relay signals from the client to ``proc``, and its return code back when it exits
+    """
+
+    def relay_signals():
+        try:
+            while True:
+                data = channel.recv(_STATUS.size)
+                if len(data) < _STATUS.size:
+                    return
+                proc.send_signal(_STATUS.unpack(data)[0])
+        except OSError:
+            return
+
+    threading.Thread(target=relay_signals, daemon=True).start()
+    returncode = proc.wait()
+    try:
+        channel.sendall(_STATUS.pack(returncode))
+        channel.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # the client is gone
+    channel.close()
+
+
+def _serve(fd: int) -> None:
+    control = socket.socket(fileno=fd)
+    while True:
+        request, fds = _recv(control)
+        if request is None:
+            return  # the client exited
+        stdin, stdout, stderr, channel_fd = fds
+        try:
+            proc = subprocess.Popen(
+                request['args'], stdin=stdin, stdout=stdout, stderr=stderr, cwd=request['cwd'], env=request['env']
+            )
+        except OSError as e:
+            os.close(channel_fd)
+            _send(control, {'errno': e.errno, 'error': e.strerror})
+            continue
+        finally:
+            for fd in (stdin, stdout, stderr):
+                os.close(fd)
+        _send(control, {'pid': proc.pid})
+        threading.Thread(target=_supervise, args=(proc, socket.socket(fileno=channel_fd)), daemon=True).start()
+
+
+# The client
+
+
+class _SpawnServer:
+    def __init__(self):
+        ours, theirs = socket.socketpair()
+        try:
+            self._process = subprocess.Popen(
+                [sys.executable, '-I', os.path.abspath(__file__), str(theirs.fileno())],
+                pass_fds=[theirs.fileno()],
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,  # not interrupted along with the caller's process group
+            )
+        except BaseException:
+            ours.close()
+            raise
+        finally:
+            theirs.close()
+        self._socket = ours
+        self._lock = threading.Lock()
+        self.owner_pid = os.getpid()
+
+    def spawn(self, args: List[str], cwd: str, env: dict, fds: List[int]) -> int:
+        """
+        Have the server start ``args`` with ``fds`` (stdin, stdout, stderr and the process channel) and return
+        its pid
+
+        :raises ConnectionError: if the server is gone
+        """
+        with self._lock:
+            _send(self._socket, {'args': args, 'cwd': cwd, 'env': env}, fds)
+            reply, _ = _recv(self._socket)
+        if reply is None:
+            raise ConnectionError("The spawn server exited")
+        if 'errno' in reply:
+            raise OSError(reply['errno'], reply['error'], args[0])
+        return reply['pid']
+
+    def close(self) -> None:
+        self._socket.close()  # the server exits at end of stream
+        self._process.wait()
+
+
+class _ServerPopen(subprocess.Popen):
+    """
+    A ``subprocess.Popen`` whose process is created by the spawn server. Only the creation of the process,
+    waiting for it and signalling it differ; pipes, ``communicate`` and the rest are inherited.
+    """
+
+    def __init__(self, server: _SpawnServer, *args, **kwargs):
+        self._server = server
+        self._channel: Optional[socket.socket] = None
+        super().__init__(*args, **kwargs)
+
+    def _execute_child(self, args, executable, preexec_fn, close_fds, pass_fds, cwd, env, startupinfo,
+                       creationflags, shell, p2cread, p2cwrite, c2pread, c2pwrite, errread, errwrite, *rest):
+        if isinstance(args, (str, bytes, os.PathLike)):
+            args = [args]
+        args = [os.fsdecode(arg) for arg in args]
+        if env is None:
+            env = os.environ
+        env = {os.fsdecode(key): os.fsdecode(value) for key, value in env.items()}
+        if cwd is None:
+            cwd = os.getcwd()
+        ours, theirs = socket.socketpair()
+        fds = [
+            p2cread if p2cread != -1 else 0,
+            c2pwrite if c2pwrite != -1 else 1,
+            errwrite if errwrite != -1 else 2,
+            theirs.fileno(),
+        ]
+        try:
+            self.pid = self._server.spawn(args, os.fsdecode(cwd), env, fds)
+        except ConnectionError:
+            spawned = False
+        except BaseException:
+            ours.close()
+            self._close_child_fds(p2cread, p2cwrite, c2pread, c2pwrite, errread, errwrite)
+            raise
+        else:
+            spawned = True
+        finally:
+            theirs.close()
+        if not spawned:  # start it ourselves; that closes the child's fds as well
+            ours.close()
+            _server_gone(self._server)
+            return super()._execute_child(args, executable, preexec_fn, close_fds, pass_fds, cwd, env, startupinfo,
+                                          creationflags, shell, p2cread, p2cwrite, c2pread, c2pwrite, errread,
+                                          errwrite, *rest)
+        self._close_child_fds(p2cread, p2cwrite, c2pread, c2pwrite, errread, errwrite)
+        self._channel = ours
+        self._child_created = True
+
+    def _close_child_fds(self, p2cread, p2cwrite, c2pread, c2pwrite, errread, errwrite):
+        # as subprocess does: the child's ends of the pipes it created are now the child's alone
+        devnull = getattr(self, '_devnull', None)
+        if p2cread != -1 and p2cwrite != -1 and p2cread != devnull:
+            os.close(p2cread)
+        if c2pwrite != -1 and c2pread != -1 and c2pwrite != devnull:
+            os.close(c2pwrite)
+        if errwrite != -1 and errread != -1 and errwrite != devnull:
+            os.close(errwrite)
+        if devnull is not None:
+            os.close(devnull)
+        self._closed_child_pipe_fds = True
+
+    def _try_wait(self, wait_flags):
+        if self._channel is None:
+            return super()._try_wait(wait_flags)
+        if wait_flags & os.WNOHANG:
+            import select
+
+            readable, _, _ = select.select([self._channel], [], [], 0)
+            if not readable:
+                return 0, 0
+        try:
+            data = self._channel.recv(_STATUS.size, socket.MSG_WAITALL)
+        except OSError:
+            data = b''
+        self._channel.close()
+        if len(data) < _STATUS.size:
+            returncode = 255  # the server died; the outcome is unknown
+        else:
+            (returncode,) = _STATUS.unpack(data)
+        # back to a wait status, which Popen turns into the return code
+        return self.pid, (-returncode if returncode < 0 else returncode << 8)
+
+    def _internal_poll(self, _deadstate=None, **kwargs):
+        if self._channel is None:
+            return super()._internal_poll(_deadstate, **kwargs)
+        if self.returncode is None and self._waitpid_lock.acquire(False):
+            try:
+                if self.returncode is None:
+                    pid, sts = self._try_wait(os.WNOHANG)
+                    if pid == self.pid:
+                        self._handle_exitstatus(sts)
+            finally:
+                self._waitpid_lock.release()
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self._channel is None:
+            return super().send_signal(sig)
+        self.poll()
+        if self.returncode is not None:
+            return  # the process was reaped; its pid may belong to another process by now
+        try:
+            self._channel.sendall(_STATUS.pack(sig))
+        except OSError:
+            pass
+
+
+_SERVER: Optional[_SpawnServer] = None
+_SERVER_LOCK = threading.Lock()
+_AUTOSTART = os.environ.get('PYCLIP_SPAWN_SERVER', '') not in ('', '0')
+
+
+def start() -> None:
+    """
+    Start the spawn server, if it is not running yet. Call this early, while the process is still small.
+
+    :raises ClipboardSetupException: on platforms that cannot pass file descriptors between processes
+    """
+    global _SERVER
+    if not hasattr(socket, 'SCM_RIGHTS'):
+        from .base import ClipboardSetupException
+
+        raise ClipboardSetupException("The spawn server requires a POSIX platform")
+    if not _proxy_supported():
+        from .base import ClipboardSetupException
+
+        raise ClipboardSetupException(f"The spawn server does not support Python {sys.version.split()[0]} yet")
+    with _SERVER_LOCK:
+        if _SERVER is None or _SERVER.owner_pid != os.getpid():
+            import atexit
+
+            _SERVER = _SpawnServer()
+            atexit.register(stop)
+
+
+def stop() -> None:
+    """
+    Stop the spawn server. Helpers are started directly again.
+    """
+    global _SERVER
+    with _SERVER_LOCK:
+        server, _SERVER = _SERVER, None
+    if server is not None and server.owner_pid == os.getpid():
+        server.close()
+
+
+def is_running() -> bool:
+    """
+    Whether helpers are started by the spawn server
+    """
+    return _active_server() is not None
+
+
+def _server_gone(server: _SpawnServer) -> None:
+    global _SERVER, _AUTOSTART
+    with _SERVER_LOCK:
+        if _SERVER is server:
+            _SERVER = None
+            _AUTOSTART = False  # start helpers directly from now on
+
+
+def _active_server() -> Optional[_SpawnServer]:
+    server = _SERVER
+    if server is None and _AUTOSTART and hasattr(socket, 'SCM_RIGHTS') and _proxy_supported():
+        start()
+        server = _SERVER
+    if server is not None and server.owner_pid != os.getpid():
+        return None  # a forked child must not share its parent's connection
+    return server
+
+
+def Popen(*args, **kwargs) -> subprocess.Popen:
+    """
+    ``subprocess.Popen``, started by the spawn server when it is running
+    """
+    server = _active_server()
+    if server is None or any(kwargs.get(option) for option in _LOCAL_ONLY_OPTIONS):
+        return subprocess.Popen(*args, **kwargs)
+    return _ServerPopen(server, *args, **kwargs)
+
+
+def run(*popenargs, input=None, check: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    """
+    ``subprocess.run``, started by the spawn server when it is running
+    """
+    if _active_server() is None:
+        return subprocess.run(*popenargs, input=input, check=check, **kwargs)
+    timeout = kwargs.pop('timeout', None)
+    if input is not None:
+        if kwargs.get('stdin') is not None:
+            raise ValueError('stdin and input arguments may not both be used.')
+        kwargs['stdin'] = subprocess.PIPE
+    with Popen(*popenargs, **kwargs) as process:
+        try:
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            # as subprocess.run does: kill the process, and report what it wrote before it was killed
+            process.kill()
+            e.stdout, e.stderr = process.communicate()
+            raise
+        except BaseException:
+            process.kill()
+            raise
+        returncode = process.poll()
+    if check and returncode:
+        raise subprocess.CalledProcessError(returncode, process.args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(process.args, returncode, stdout, stderr)
+
+
+def check_output(*popenargs, **kwargs):
+    """
+    ``subprocess.check_output``, started by the spawn server when it is running
+    """
+    if _active_server() is None:
+        return subprocess.check_output(*popenargs, **kwargs)
+    return run(*popenargs, stdout=subprocess.PIPE, check=True, **kwargs).stdout
+
+
+if __name__ == '__main__':
+    _serve(int(sys.argv[1]))
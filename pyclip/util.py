@@ -11,26 +11,21 @@
 #     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
-import sys
 import os
-from .base import ClipboardSetupException, ClipboardBase
+import sys
+from .base import ClipboardBase
 
 
 def detect_clipboard() -> ClipboardBase:
     """
-    Determine what implementation to use based on ``sys.platform``
+    Determine what implementation to use based on ``sys.platform``, the environment and, where several
+    implementations work, which one is fastest. See :py:mod:`pyclip.registry`.
+
+    When a ``pyclip daemon`` is running for this display, a client for it is returned instead.
     """
-    if sys.platform == 'darwin':
-        from .macos_clip import MacOSClip
-        return MacOSClip()
-    elif sys.platform == 'win32':
-        from .win_clip import WindowsClipboard
-        return WindowsClipboard()
-    elif sys.platform == 'linux' and os.environ.get("WAYLAND_DISPLAY"):
-        from .wayland_clip import WaylandClipboard
-        return WaylandClipboard()
-    elif sys.platform == 'linux':
-        from .xclip_clip import XclipClipboard
-        return XclipClipboard()
-    else:
-        raise ClipboardSetupException("No suitable clipboard found.")
\ No newline at end of file
+    if sys.platform != 'win32' and not os.environ.get('PYCLIP_BACKEND'):
+        from .daemon import DaemonClipboard, is_running
+        if is_running():
+            return DaemonClipboard()
+    from .registry import select_backend
+    return select_backend()
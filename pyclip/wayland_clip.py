@@ -15,15 +15,22 @@
 """
 Provides the clipboard functionality for Linux via ``wl-copy``/``wl-paste``
 """
+import os
+import select
+import threading
 import warnings
 
-from .base import ClipboardBase, ClipboardSetupException, ClipboardException
-from typing import Union
+from . import instrumentation, spawn
+from .base import SubprocessClipboardBase, ClipboardSetupException, ClipboardException, _byte_view
+from typing import Dict, Iterator, List, Optional, Union
 import shutil
 import subprocess
 
 
-class WaylandClipboard(ClipboardBase):
+class WaylandClipboard(SubprocessClipboardBase):
+    _copy_helper_name = 'wl-copy'
+    _paste_helper_name = 'wl-paste'
+
     def __init__(self):
         self.wl_copy = shutil.which('wl-copy')
         self.wl_paste = shutil.which('wl-paste')
@@ -32,16 +39,39 @@ class WaylandClipboard(ClipboardBase):
                 "wl-clipboard must be installed. " "Please install wl-clipboard using your system package manager"
             )
 
-    def copy(self, data: Union[str, bytes], encoding: str = None) -> None:
+    def _copy_args(self, mime: str = None) -> List[str]:
+        args = [self.wl_copy]
+        if mime is not None:
+            args.extend(['--type', mime])
+        return args
+
+    def _paste_args(self, mime: str = None) -> List[str]:
+        args = [self.wl_paste, '--no-newline']
+        if mime is not None:
+            args.extend(['--type', mime])
+        return args
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str = None) -> None:
         """
         Copy data into the clipboard
 
-        :param data: the data to be copied to the clipboard. Can be str or bytes.
+        :param data: the data to be copied to the clipboard. Can be str, bytes or another bytes-like object
+            (e.g. ``bytearray`` or ``mmap``), or a dict with a single ``{mime: data}`` item to set the MIME type.
+            wl-copy cannot offer several types at once.
         :param encoding: same meaning as in ``subprocess.Popen``.
         :return: None
         """
-        args = [ self.wl_copy ]
-        if isinstance(data, bytes):
+        if isinstance(data, dict):
+            mime, data = self._single_format(data, encoding)
+            encoding = None
+            args = self._copy_args(mime)
+        else:
+            args = self._copy_args()
+        if isinstance(data, str):
+            text = True
+        else:
+            if not isinstance(data, bytes):
+                data = _byte_view(data)  # piped to the helper as is
             if encoding is not None:
                 warnings.warn(
                     "encoding specified with a bytes argument. "
@@ -49,21 +79,18 @@ class WaylandClipboard(ClipboardBase):
                     "To remove this warning, omit the encoding parameter or specify it as None",
                     stacklevel=2,
                 )
-            proc = subprocess.Popen(
+            text = None
+        recorder = instrumentation.current()
+        with recorder.phase('spawn'):
+            proc = spawn.Popen(
                 args,
                 stdin=subprocess.PIPE,
+                text=text,
                 encoding=encoding,
             )
-        elif isinstance(data, str):
-            proc = subprocess.Popen(
-                args,
-                stdin=subprocess.PIPE,
-                text=True,
-                encoding=encoding,
-            )
-        else:
-            raise TypeError(f"data argument must be of type str or bytes, not {type(data)}")
-        stdout, stderr = proc.communicate(data)
+        recorder.spawned()
+        with recorder.phase('transfer'):
+            stdout, stderr = proc.communicate(data)
         if proc.returncode != 0:
             raise ClipboardException(
                 f"Copy failed. wl-copy returned code: {proc.returncode!r} "
@@ -71,29 +98,24 @@ class WaylandClipboard(ClipboardBase):
                 f"Stdout: {stdout!r}"
             )
 
-    def paste(self, encoding: str = None, text: bool = None, errors: str = None):
+    def paste(self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None):
         """
         Retrieve data from the clipboard
 
         :param encoding: same meaning as in ``subprocess.run``
         :param text: same meaning as in ``subprocess.run``
         :param errors: same meaning as in ``subprocess.run``
+        :param mime: the MIME type to retrieve. Defaults to the type wl-paste picks.
         :return: the clipboard contents. return type is binary by default.
             If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
         """
-        args = [ self.wl_paste, '--no-newline' ]
-        if encoding or text or errors:
-            completed_proc = subprocess.run(
-                args,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=text,
-                encoding=encoding,
-            )
-        else:
-            completed_proc = subprocess.run(
-                args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        args = self._paste_args(mime)
+        kwargs = dict(text=text, encoding=encoding) if encoding or text or errors else {}
+        recorder = instrumentation.current()
+        recorder.spawned()
+        with recorder.phase('transfer'):
+            completed_proc = spawn.run(
+                args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
             )
 
         if completed_proc.returncode != 0:
@@ -111,3 +133,33 @@ class WaylandClipboard(ClipboardBase):
         :return:
         """
         self.copy('')
+
+    def _changes(self, stop: threading.Event, poll_interval: float) -> Iterator[Optional[bytes]]:
+        # wl-paste runs the command once for the current selection, then once per change
+        proc = spawn.Popen(
+            [self.wl_paste, '--watch', 'echo'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        def changes():
+            try:
+                notifications = 0
+                while not stop.is_set():
+                    ready, _, _ = select.select([proc.stdout], [], [], poll_interval)
+                    if not ready:
+                        continue
+                    output = os.read(proc.stdout.fileno(), 4096)
+                    if not output:
+                        raise ClipboardException(
+                            f"Watch failed. wl-paste returned code: {proc.wait()!r} Stderr: {proc.stderr.read()!r}"
+                        )
+                    for _ in range(output.count(b'\n')):
+                        notifications += 1
+                        if notifications > 1:
+                            yield None
+            finally:
+                proc.kill()
+                proc.wait()
+                proc.stdout.close()
+                proc.stderr.close()
+
+        return changes()
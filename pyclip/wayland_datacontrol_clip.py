@@ -0,0 +1,489 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Provides the clipboard functionality for Linux on Wayland by speaking the Wayland wire protocol directly
+(``ext-data-control-v1`` or ``wlr-data-control-unstable-v1``) over one persistent compositor connection
+"""
+import array
+import atexit
+import contextlib
+import io
+import os
+import socket
+import struct
+import threading
+import time
+import warnings
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Union
+
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException, _byte_view, _decode, _encode_formats
+
+_TIMEOUT = 5.0
+
+_DISPLAY_ID = 1
+_MAX_FDS = 28
+
+# data-control managers we can speak, in order of preference, with the highest version we implement
+_MANAGERS = (
+    ('ext_data_control_manager_v1', 1),
+    ('zwlr_data_control_manager_v1', 2),
+)
+
+_TEXT_MIME_TYPES = (
+    'text/plain;charset=utf-8',
+    'text/plain',
+    'UTF8_STRING',
+    'TEXT',
+    'STRING',
+)
+
+
+def _uint(value: int) -> bytes:
+    return struct.pack('=I', value)
+
+
+def _string(value: str) -> bytes:
+    encoded = value.encode() + b'\x00'
+    padding = -len(encoded) % 4
+    return struct.pack('=I', len(encoded)) + encoded + b'\x00' * padding
+
+
+class _ArgReader:
+    """
+    Decodes the arguments of a single incoming message
+    """
+
+    def __init__(self, payload: bytes, fds):
+        self._payload = payload
+        self._offset = 0
+        self._fds = fds
+
+    def uint(self) -> int:
+        (value,) = struct.unpack_from('=I', self._payload, self._offset)
+        self._offset += 4
+        return value
+
+    def string(self) -> Optional[str]:
+        length = self.uint()
+        if length == 0:
+            return None
+        value = self._payload[self._offset : self._offset + length - 1].decode()
+        self._offset += length + (-length % 4)
+        return value
+
+    def fd(self) -> int:
+        return self._fds.pop(0)
+
+
+def _socket_path() -> str:
+    name = os.environ.get('WAYLAND_DISPLAY', 'wayland-0')
+    if os.path.isabs(name):
+        return name
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        raise ClipboardSetupException("XDG_RUNTIME_DIR must be set to locate the Wayland socket")
+    return os.path.join(runtime_dir, name)
+
+
+class _Offer:
+    def __init__(self):
+        self.mime_types: List[str] = []
+
+
+class WaylandDataControlClipboard(ClipboardBase):
+    """
+    Wayland clipboard backend built on the data-control protocols rather than ``wl-copy``/``wl-paste``.
+
+    A single connection to the compositor is opened when the clipboard is created, and a daemon thread
+    dispatches events on it. Offers are read through pipes passed directly to the compositor.
+    When the interpreter exits while still owning the selection, a small child process is forked to keep
+    serving it (as ``wl-copy`` does), unless ``persist`` is ``False``.
+    """
+
+    def __init__(self, persist: bool = True):
+        self._persist = persist
+        self._connect()
+        atexit.register(self._persist_at_exit)
+
+    def release(self) -> None:
+        """
+        Close the connection to the compositor, which ends the event thread. The selection is not kept alive
+        at exit.
+        """
+        atexit.unregister(self._persist_at_exit)
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)  # wakes up the event thread
+        except OSError:
+            pass
+        self._sock.close()
+
+    def _connect(self):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(_socket_path())
+        except OSError as e:
+            self._sock.close()
+            raise ClipboardSetupException(f"Could not connect to the Wayland compositor: {e}") from e
+        self._send_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._next_id = 2
+        self._free_ids: List[int] = []
+        self._objects: Dict[int, str] = {_DISPLAY_ID: 'wl_display'}
+        self._globals: Dict[str, tuple] = {}
+        self._callbacks: Set[int] = set()
+        self._offers: Dict[int, _Offer] = {}
+        self._selection: Optional[int] = None
+        self._selection_serial = 0
+        self._source: Optional[int] = None
+        self._contents: Dict[str, bytes] = {}
+        self._error: Optional[str] = None
+        self._closed = False
+
+        self._registry = self._new_id('wl_registry')
+        self._request(_DISPLAY_ID, 1, _uint(self._registry))
+        self._thread = threading.Thread(target=self._event_loop, name='pyclip-wayland-events', daemon=True)
+        self._thread.start()
+        try:
+            self._roundtrip()
+            for interface, version in _MANAGERS:
+                if interface in self._globals:
+                    self._prefix = interface[: -len('manager_v1')]
+                    self._manager = self._bind(interface, version)
+                    break
+            else:
+                raise ClipboardSetupException("The Wayland compositor does not support the data-control protocol")
+            if 'wl_seat' not in self._globals:
+                raise ClipboardSetupException("The Wayland compositor did not advertise a seat")
+            self._seat = self._bind('wl_seat', 1)
+            self._device = self._new_id(self._prefix + 'device_v1')
+            self._request(self._manager, 1, _uint(self._device) + _uint(self._seat))
+            self._roundtrip()
+        except ClipboardException as e:
+            self._sock.close()
+            if isinstance(e, ClipboardSetupException):
+                raise
+            raise ClipboardSetupException(str(e)) from e
+
+    def _new_id(self, interface: str) -> int:
+        with self._cond:
+            if self._free_ids:
+                object_id = self._free_ids.pop()
+            else:
+                object_id = self._next_id
+                self._next_id += 1
+            self._objects[object_id] = interface
+        return object_id
+
+    def _request(self, object_id: int, opcode: int, args: bytes = b'', fds=()) -> None:
+        message = struct.pack('=II', object_id, ((8 + len(args)) << 16) | opcode) + args
+        with self._send_lock:
+            if fds:
+                self._sock.sendmsg([message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+            else:
+                self._sock.sendall(message)
+
+    def _bind(self, interface: str, version: int) -> int:
+        name, advertised = self._globals[interface]
+        object_id = self._new_id(interface)
+        args = _uint(name) + _string(interface) + _uint(min(version, advertised)) + _uint(object_id)
+        self._request(self._registry, 0, args)
+        return object_id
+
+    def _wait(self, predicate, timeout: float = _TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not predicate():
+                if self._error:
+                    raise ClipboardException(f"Wayland protocol error: {self._error}")
+                if self._closed:
+                    raise ClipboardException("The Wayland compositor closed the connection")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ClipboardException("Timed out waiting for the Wayland compositor")
+                self._cond.wait(remaining)
+
+    def _roundtrip(self) -> None:
+        """
+        Block until the compositor has processed every request sent so far
+        """
+        callback = self._new_id('wl_callback')
+        with self._cond:
+            self._callbacks.add(callback)
+        self._request(_DISPLAY_ID, 0, _uint(callback))
+        self._wait(lambda: callback not in self._callbacks)
+
+    def _event_loop(self):
+        buffer = b''
+        fds: List[int] = []
+        try:
+            while True:
+                data, ancdata, _flags, _addr = self._sock.recvmsg(65536, socket.CMSG_SPACE(_MAX_FDS * 4))
+                if not data:
+                    break
+                for level, kind, fd_data in ancdata:
+                    if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                        received = array.array('i')
+                        received.frombytes(fd_data[: len(fd_data) - (len(fd_data) % received.itemsize)])
+                        fds.extend(received)
+                buffer += data
+                while len(buffer) >= 8:
+                    object_id, size_opcode = struct.unpack_from('=II', buffer)
+                    size = size_opcode >> 16
+                    if len(buffer) < size:
+                        break
+                    payload, buffer = buffer[8:size], buffer[size:]
+                    with self._cond:
+                        self._dispatch(object_id, size_opcode & 0xFFFF, _ArgReader(payload, fds))
+                        self._cond.notify_all()
+        except OSError:
+            pass
+        finally:
+            # whatever ended the loop, waiters must not block until their timeout
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+    def _dispatch(self, object_id: int, opcode: int, args: _ArgReader) -> None:
+        interface = self._objects.get(object_id)
+        if interface == 'wl_display':
+            if opcode == 0:
+                args.uint()
+                code = args.uint()
+                self._error = f"{args.string()} (code {code})"
+            elif opcode == 1:
+                deleted = args.uint()
+                self._objects.pop(deleted, None)
+                self._free_ids.append(deleted)
+        elif interface == 'wl_registry' and opcode == 0:
+            name = args.uint()
+            global_interface = args.string()
+            self._globals[global_interface] = (name, args.uint())
+        elif interface == 'wl_callback':
+            self._callbacks.discard(object_id)
+        elif interface == self._prefix_or_none('device_v1'):
+            self._dispatch_device(opcode, args)
+        elif interface == self._prefix_or_none('offer_v1') and opcode == 0:
+            offer = self._offers.get(object_id)
+            if offer is not None:  # otherwise already destroyed or replaced
+                offer.mime_types.append(args.string())
+        elif interface == self._prefix_or_none('source_v1'):
+            self._dispatch_source(object_id, opcode, args)
+
+    def _prefix_or_none(self, suffix: str) -> Optional[str]:
+        prefix = getattr(self, '_prefix', None)
+        return prefix + suffix if prefix else None
+
+    def _dispatch_device(self, opcode: int, args: _ArgReader) -> None:
+        if opcode == 0:  # data_offer
+            offer = args.uint()
+            self._objects[offer] = self._prefix + 'offer_v1'
+            self._offers[offer] = _Offer()
+        elif opcode in (1, 3):  # selection, primary_selection
+            offer = args.uint() or None
+            if opcode == 3:
+                # we only track the regular selection
+                self._destroy_offer(offer)
+                return
+            if self._selection != offer:
+                self._destroy_offer(self._selection)
+            self._selection = offer
+            self._selection_serial += 1
+        elif opcode == 2:  # finished
+            self._error = "the data-control device is no longer valid"
+
+    def _destroy_offer(self, offer: Optional[int]) -> None:
+        if offer is not None and self._offers.pop(offer, None) is not None:
+            self._request(offer, 1)
+
+    def _dispatch_source(self, source: int, opcode: int, args: _ArgReader) -> None:
+        if opcode == 0:  # send
+            mime_type = args.string()
+            fd = args.fd()
+            data = self._contents.get(mime_type, b'') if source == self._source else b''
+            threading.Thread(target=self._write_offer, args=(fd, data), daemon=True).start()
+        elif opcode == 1:  # cancelled
+            if source == self._source:
+                self._source = None
+                self._contents = {}
+            self._request(source, 1)
+
+    @staticmethod
+    def _write_offer(fd: int, data: bytes) -> None:
+        try:
+            with open(fd, 'wb', closefd=True) as f:
+                f.write(data)
+        except OSError:
+            pass  # the receiving client went away
+
+    def _own(self, contents: Dict[str, bytes]) -> None:
+        source = self._new_id(self._prefix + 'source_v1')
+        self._request(self._manager, 0, _uint(source))
+        for mime_type in contents:
+            self._request(source, 0, _string(mime_type))
+        with self._cond:
+            # the previous source (if any) is destroyed once the compositor cancels it
+            self._source = source
+            self._contents = contents
+        self._request(self._device, 0, _uint(source))
+        self._roundtrip()
+
+    def _change_token(self) -> Optional[int]:
+        self._roundtrip()  # process a pending cancellation of our source
+        with self._cond:
+            return self._source
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str = None) -> None:
+        """
+        Copy data into the clipboard
+
+        :param data: the data to be copied to the clipboard. Can be str or bytes, or a dict mapping MIME types
+            to str or bytes, which are all offered at once. Plain text (``text/plain``) is also offered
+            under the other common text types.
+        :param encoding: encoding used to encode ``str`` data. Defaults to utf-8.
+        :return: None
+        """
+        if isinstance(data, dict):
+            contents = _encode_formats(data, encoding)
+            text = next((contents[t] for t in _TEXT_MIME_TYPES[:2] if t in contents), None)
+            if text is not None:
+                for mime_type in _TEXT_MIME_TYPES:
+                    contents.setdefault(mime_type, text)
+            self._own(contents)
+            return
+        if isinstance(data, str):
+            data = data.encode(encoding or 'utf-8')
+        else:
+            if not isinstance(data, bytes):
+                # served until the next copy, so later changes by the caller must not show
+                data = _byte_view(data).tobytes()
+            if encoding is not None:
+                warnings.warn(
+                    "encoding specified with a bytes argument. "
+                    "Encoding option will be ignored. "
+                    "To remove this warning, omit the encoding parameter or specify it as None",
+                    stacklevel=2,
+                )
+        self._own({mime_type: data for mime_type in _TEXT_MIME_TYPES})
+
+    def list_targets(self) -> List[str]:
+        """
+        List the MIME types offered for the current selection
+
+        :return: list of MIME types
+        """
+        self._roundtrip()
+        with self._cond:
+            if self._source is not None:
+                return list(self._contents)
+            offer = self._offers.get(self._selection)
+            return list(offer.mime_types) if offer is not None else []
+
+    def _paste_mime(self) -> Optional[str]:
+        # the choice _open_paste_stream makes, for selections of our own and of other clients alike
+        targets = self.list_targets()
+        return next((t for t in _TEXT_MIME_TYPES if t in targets), targets[0] if targets else None)
+
+    @contextlib.contextmanager
+    def _open_paste_stream(self, mime: str = None) -> Iterator[BinaryIO]:
+        """
+        Provide a binary file object from which the selection contents can be read. For selections owned by
+        other clients, this is the read end of the pipe handed to the selection owner.
+        """
+        self._roundtrip()
+        with self._cond:
+            owned = self._contents if self._source is not None else None
+            offer = self._selection
+            mime_types = self._offers[offer].mime_types if offer in self._offers else []
+        if owned is not None:
+            if mime is None:
+                mime = next((t for t in _TEXT_MIME_TYPES if t in owned), next(iter(owned)))
+            yield io.BytesIO(owned.get(mime, b''))
+            return
+        if mime is None:
+            mime = next((t for t in _TEXT_MIME_TYPES if t in mime_types), mime_types[0] if mime_types else None)
+        if offer is None or mime is None:
+            yield io.BytesIO()
+            return
+        read_fd, write_fd = os.pipe()
+        try:
+            self._request(offer, 0, _string(mime), fds=(write_fd,))
+        finally:
+            os.close(write_fd)
+        with open(read_fd, 'rb', buffering=0) as f:
+            yield f
+
+    def paste(self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None) -> Union[str, bytes]:
+        """
+        Retrieve data from the clipboard
+
+        :param encoding: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param text: if True, the contents are decoded and returned as str
+        :param errors: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param mime: the MIME type to retrieve. Defaults to a text type when one is offered, else the first offered.
+        :return: the clipboard contents. return type is binary by default.
+            If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
+        """
+        with self._open_paste_stream(mime) as f:
+            data = f.read()
+        if encoding or text or errors:
+            return _decode(data, encoding, errors)
+        return data
+
+    def clear(self):
+        """
+        Clear the clipboard contents
+
+        :return:
+        """
+        self.copy('')
+
+    def _changes(self, stop: threading.Event, poll_interval: float) -> Iterator[Optional[bytes]]:
+        with self._cond:
+            serial = self._selection_serial
+
+        def changes():
+            nonlocal serial
+            while not stop.is_set():
+                with self._cond:
+                    self._cond.wait_for(lambda: self._selection_serial != serial or self._closed, timeout=poll_interval)
+                    if self._closed:
+                        raise ClipboardException("The Wayland compositor closed the connection")
+                    changed, serial = self._selection_serial != serial, self._selection_serial
+                if changed:
+                    yield None
+
+        return changes()
+
+    def _persist_at_exit(self):
+        """
+        Fork a child that keeps serving the selection after this process exits
+        """
+        with self._cond:
+            contents = dict(self._contents) if self._source is not None else None
+        if not self._persist or contents is None:
+            return
+        if os.fork() != 0:
+            return
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            self._connect()
+            self._own(contents)
+            with self._cond:
+                while self._source is not None and not self._closed:
+                    self._cond.wait()
+        finally:
+            os._exit(0)
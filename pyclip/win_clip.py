@@ -15,10 +15,13 @@
 Provides clipboard functionality for Windows via the ``pywin32`` package
 """
 
-from typing import Union, Dict, Tuple, Any
+from typing import Union, Dict, Tuple, Any, Iterator, BinaryIO, List, Optional
 import os
+import io
+import contextlib
 import ctypes
-from .base import ClipboardBase, ClipboardSetupException
+from . import instrumentation
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException, _byte_view, _encode_formats
 import warnings
 import time
 try:
@@ -29,25 +32,121 @@ except ImportError:
     _win32con = None
 
 _TIMEOUT = 0.05
+#: first and longest wait between attempts to open a clipboard held by another program
+_MIN_BACKOFF = 0.0005
+_MAX_BACKOFF = 0.01
+#: winerror of OpenClipboard while another window has the clipboard open
+_ERROR_ACCESS_DENIED = 5
+_CF_HDROP = 15
+_GMEM_MOVEABLE = 0x0002
 
 _CF_FORMATS = {
     value: name
     for name, value in ((n, getattr(_win32clipboard, n)) for n in dir(_win32clipboard) if n.startswith('CF_'))
 }
 
+_KERNEL32 = None
+
+
+def _kernel32():
+    global _KERNEL32
+    if _KERNEL32 is None:
+        kernel32 = ctypes.WinDLL('kernel32')  # our own instance, so the prototypes below do not leak
+        kernel32.GlobalAlloc.restype = ctypes.c_void_p
+        kernel32.GlobalAlloc.argtypes = [ctypes.c_uint, ctypes.c_size_t]
+        kernel32.GlobalLock.restype = ctypes.c_void_p
+        kernel32.GlobalLock.argtypes = [ctypes.c_void_p]
+        kernel32.GlobalUnlock.argtypes = [ctypes.c_void_p]
+        kernel32.GlobalFree.restype = ctypes.c_void_p
+        kernel32.GlobalFree.argtypes = [ctypes.c_void_p]
+        _KERNEL32 = kernel32
+    return _KERNEL32
+
+
+def _global_copy(view: memoryview) -> int:
+    """
+    Copy ``view`` (followed by a NUL, which ``paste`` strips again) into a new movable global memory object,
+    as ``SetClipboardData`` expects. Returns its handle; the caller must free it unless the clipboard takes it.
+    """
+    kernel32 = _kernel32()
+    size = len(view)
+    handle = kernel32.GlobalAlloc(_GMEM_MOVEABLE, size + 1)
+    if not handle:
+        raise ClipboardException(f"Copy failed. Could not allocate {size + 1} bytes of global memory")
+    try:
+        address = kernel32.GlobalLock(handle)
+        if not address:
+            raise ClipboardException("Copy failed. Could not lock the global memory")
+        try:
+            with memoryview((ctypes.c_char * (size + 1)).from_address(address)).cast('B') as target:
+                target[:size] = view
+                target[size] = 0
+        finally:
+            kernel32.GlobalUnlock(handle)
+    except BaseException:
+        kernel32.GlobalFree(handle)
+        raise
+    return handle
+
+
 class UnparsableClipboardFormatException(Exception):
     ...
 
+class PastedFile:
+    """
+    A file on the clipboard (``CF_HDROP``, e.g. copied in File Explorer), as returned by
+    :py:meth:`WindowsClipboard.paste_files`. Nothing is read until :py:meth:`open` or :py:meth:`mmap` is called.
+
+    :ivar path: the path of the file
+    """
+    __slots__ = ('path',)
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.path!r})'
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def is_dir(self) -> bool:
+        return os.path.isdir(self.path)
+
+    def open(self, buffering: int = -1) -> BinaryIO:
+        """
+        Open the file for reading in binary mode, to read it in chunks
+        """
+        return open(self.path, 'rb', buffering=buffering)
+
+    def mmap(self):
+        """
+        Map the file read-only into memory. The pages are loaded by the OS as they are accessed, so even a file
+        larger than the available memory can be sliced like ``bytes``. Empty files cannot be mapped (``ValueError``).
+        """
+        import mmap
+        with open(self.path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 class ClipboardNotTextFormatException(Exception):
     ...
 
 class _Win32Clipboard:
     """
     Class for handling lower level details of managing Windows Clipboard
+
+    Opening is counted: nested ``open``/``close`` pairs (e.g. operations inside a session) reuse the
+    clipboard that is already open, and only the outermost ``close`` closes it.
+
+    :param timeout: how long ``open`` keeps retrying while another program has the clipboard open, in seconds
     """
-    def __init__(self):
+    def __init__(self, timeout: float = _TIMEOUT):
         self._clip = _win32clipboard
         self._is_open = False
+        self._depth = 0
+        self.timeout = timeout
 
     def __enter__(self):
         return self.open()
@@ -55,29 +154,43 @@ class _Win32Clipboard:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
-    def open(self, *, _timeout=None):
+    def open(self, timeout: float = None):
+        """
+        Open the clipboard. While another program has it open, retry with exponential backoff
+        (from 0.5 ms, up to 10 ms between attempts) for up to ``timeout`` seconds.
+
+        :param timeout: overrides :py:attr:`timeout` for this call
+        :raises ClipboardException: if the clipboard is still held by another program after ``timeout``
+        """
         import pywintypes
         if self._is_open:
+            self._depth += 1
             return self
-        try:
-            self._clip.OpenClipboard()
-            self._is_open = True
-        except pywintypes.error as e:
-            if e.winerror == 5:
-                if _timeout:
-                    if time.time() < _timeout:
-                        time.sleep(0.001)
-                        return self.open(_timeout=_timeout)
-                    else:
-                        raise
-                else:
-                    t = time.time() + _TIMEOUT
-                    time.sleep(0.001)
-                    return self.open(_timeout=t)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        delay = _MIN_BACKOFF
+        while True:
+            try:
+                self._clip.OpenClipboard()
+                break
+            except pywintypes.error as e:
+                if e.winerror != _ERROR_ACCESS_DENIED:
+                    raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ClipboardException("Could not open the clipboard: another program is holding it") from e
+            instrumentation.current().retried()
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, _MAX_BACKOFF)
+        self._is_open = True
+        self._depth = 1
         return self
 
     def close(self):
         import pywintypes
+        if self._depth > 1:
+            self._depth -= 1
+            return
+        self._depth = 0
         try:
             self._clip.CloseClipboard()
             self._is_open = False
@@ -111,10 +224,21 @@ class _Win32Clipboard:
 
 
 class WindowsClipboard(ClipboardBase):
-    def __init__(self):
+    """
+    Windows clipboard, through ``pywin32``.
+
+    ``paste`` results are cached until the clipboard sequence number changes, so pasting unchanged contents
+    does not open the clipboard again.
+
+    :param timeout: how long to keep retrying while another program has the clipboard open, in seconds
+    """
+    #: ``(sequence number, {(text mode, encoding, errors): result})`` of the last paste
+    _paste_cache: Union[Tuple[int, Dict[Tuple[bool, Optional[str], Optional[str]], Union[str, bytes]]], None] = None
+
+    def __init__(self, timeout: float = _TIMEOUT):
         if _win32clipboard is None or _win32con is None:
             raise ClipboardSetupException("pywin32 must be installed to use this library on Windows platform.")
-        self._clipboard = _Win32Clipboard()
+        self._clipboard = _Win32Clipboard(timeout)
 
     @property
     def _string_formats(self):
@@ -127,17 +251,70 @@ class WindowsClipboard(ClipboardBase):
         implemented.extend(self._string_formats)
         return implemented
 
-    def copy(self, data: Union[str, bytes], encoding=None):
-        """Copy given string into system clipboard."""
-        with self._clipboard as clip:
-            clip.EmptyClipboard()  # we clear the clipboard to become the clipboard owner
-            if isinstance(data, str):
+    def _clipboard_format(self, name: str) -> Union[int, None]:
+        """
+        The clipboard format for a name passed to ``copy``. None means Unicode text.
+        """
+        if name.split(';')[0] == 'text/plain':
+            return None
+        if name.startswith('CF_') and hasattr(self._clipboard, name):
+            return getattr(self._clipboard, name)
+        return self._clipboard.RegisterClipboardFormat(name)
+
+    def _copy_formats(self, formats: Dict[str, Union[str, bytes]], encoding=None):
+        prepared = []
+        handles = set()  # global memory not yet handed to the clipboard
+        try:
+            # set while the clipboard is open, so bytes-like values need not be copied first
+            for name, value in _encode_formats(formats, encoding, views=True).items():
+                fmt = self._clipboard_format(name)
+                if fmt is None:
+                    value = str(value, encoding or 'utf-8')
+                elif fmt == 11:
+                    # NUL-terminated like the bytes that copy() places there, since paste strips the last byte
+                    value = _global_copy(value)
+                    handles.add(value)
+                prepared.append((fmt, value))
+            with self._clipboard as clip:
+                clip.EmptyClipboard()  # one owner for all formats
+                for fmt, value in prepared:
+                    if fmt is None:
+                        clip.SetClipboardText(value, 13)
+                    else:
+                        clip.SetClipboardData(fmt, value)
+                        if fmt == 11:
+                            handles.discard(value)  # the clipboard frees it from now on
+        finally:
+            for handle in handles:
+                _kernel32().GlobalFree(handle)
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding=None):
+        """
+        Copy given string into system clipboard.
+
+        Bytes, or any other bytes-like object (``bytearray``, ``memoryview``, ``mmap``...), are written straight
+        into the global memory handed to the clipboard.
+
+        ``data`` may also be a dict of formats to set at once: ``text/plain`` is stored as ``CF_UNICODETEXT``,
+        ``CF_*`` names are used as is and other names (like ``'HTML Format'``) are registered.
+        """
+        if isinstance(data, dict):
+            return self._copy_formats(data, encoding)
+        if isinstance(data, str):
+            with self._clipboard as clip:
+                clip.EmptyClipboard()  # we clear the clipboard to become the clipboard owner
                 clip.SetClipboardText(data, 13)
-            elif isinstance(data, bytes):
-                data = ctypes.create_string_buffer(data)
-                clip.SetClipboardData(11, data)
-            else:
-                raise TypeError(f"data must be str or bytes, not {type(data)}")
+            return
+        handle = _global_copy(memoryview(data) if isinstance(data, bytes) else _byte_view(data))
+        owned = False
+        try:
+            with self._clipboard as clip:
+                clip.EmptyClipboard()  # we clear the clipboard to become the clipboard owner
+                clip.SetClipboardData(11, handle)
+                owned = True  # the clipboard frees it from now on
+        finally:
+            if not owned:
+                _kernel32().GlobalFree(handle)
 
     def clear(self) -> None:
         """
@@ -149,6 +326,29 @@ class WindowsClipboard(ClipboardBase):
             clip.EmptyClipboard()
         return
 
+    @contextlib.contextmanager
+    def _session(self):
+        # one OpenClipboard for the whole session; the operations in it only add to the open count
+        with self._clipboard:
+            yield
+
+    def _change_token(self) -> int:
+        return self._clipboard.GetClipboardSequenceNumber()
+
+    def _changes(self, stop, poll_interval):
+        # The sequence number changes whenever the clipboard contents change; reading it does not open the clipboard
+        sequence = self._clipboard.GetClipboardSequenceNumber()
+
+        def changes():
+            nonlocal sequence
+            while not stop.wait(poll_interval):
+                current = self._clipboard.GetClipboardSequenceNumber()
+                if current != sequence:
+                    sequence = current
+                    yield None
+
+        return changes()
+
     def _handle_dibv5(self, data):
         return data[:-1]
 
@@ -160,19 +360,53 @@ class WindowsClipboard(ClipboardBase):
         else:
             raise ValueError(f"Unknown format: {fmt}")
 
-    def _handle_hdrop(self, data: Tuple[str, ]) -> bytes:
+    def _hdrop_file(self, data: Tuple[str, ]) -> PastedFile:
+        """
+        The single file of HDROP data that ``paste`` can return the contents of
+        """
         if not isinstance(data, tuple):
             raise TypeError(f"Unexpected type for HDROP. Data must be tuple, not {type(data)}")
         if len(data) > 1:
-            raise NotImplementedError("Currently HDROP paste is only supported for single files. It appears multiple files or directories were specified")
+            raise ClipboardException(f"{len(data)} files or directories were copied, but paste returns the contents "
+                                     f"of a single file. Use paste_files() to get all of them")
         if len(data) < 1:
             raise ValueError("Data unexpectedly empty")
-        fname = data[0]
-        if not os.path.isfile(fname):
+        if not os.path.isfile(data[0]):
             raise ValueError("Can only paste files. Did you copy a directory?")
-        with open(fname, 'rb') as f:
+        return PastedFile(data[0])
+
+    def _handle_hdrop(self, data: Tuple[str, ]) -> bytes:
+        with self._hdrop_file(data).open() as f:
             return f.read()
 
+    def paste_files(self) -> List[PastedFile]:
+        """
+        The files (and directories) on the clipboard, e.g. after copying them in File Explorer. Their contents are
+        not read: use :py:meth:`PastedFile.open` to stream a file or :py:meth:`PastedFile.mmap` to map it.
+
+        :return: a :py:class:`PastedFile` per path, in clipboard order. Empty if the clipboard holds no files.
+        """
+        with self._clipboard as clip:
+            if not clip.IsClipboardFormatAvailable(_CF_HDROP):
+                return []
+            paths = clip.GetClipboardData(_CF_HDROP)
+        return [PastedFile(path) for path in paths]
+
+    @contextlib.contextmanager
+    def _open_paste_stream(self, mime: str = None) -> Iterator[BinaryIO]:
+        # A copied file is read from disk as the stream is consumed (by iter_paste, paste_into or paste_to_file)
+        # rather than loaded whole
+        if mime is not None:
+            raise TypeError("WindowsClipboard does not support choosing a MIME type to paste")
+        with self._clipboard as clip:
+            format = self._paste_format(clip, text=False)
+            files = clip.GetClipboardData(format) if format == _CF_HDROP else None
+        if files is None:
+            yield io.BytesIO(self.paste())
+            return
+        with self._hdrop_file(files).open() as f:
+            yield f
+
     def _get_all_formats(self) -> Dict[Tuple[int, str], Any]:  # pragma: no cover
         """
         Unused. Useful for debugging.
@@ -203,33 +437,57 @@ class WindowsClipboard(ClipboardBase):
         :param errors: same meaning as in ``bytes.encode``. Implies ``text=True``.
         :return: clipboard contents. Return value is bytes by default
             or str if any of ``encoding``, ``text``, or ``errors`` is provided.
+        :raises ClipboardException: if several files were copied; :py:meth:`paste_files` returns all of them
+        """
+        key = (bool(text or encoding or errors), encoding, errors)
+        # 0 means the sequence number is not available (e.g. no access to the window station)
+        sequence = self._clipboard.GetClipboardSequenceNumber()
+        cache = self._paste_cache
+        if sequence and cache is not None and cache[0] == sequence and key in cache[1]:
+            return cache[1][key]
+        result, format = self._paste(text, encoding, errors)
+        if sequence and format != _CF_HDROP:  # the files behind HDROP can change without the clipboard changing
+            results = cache[1] if cache is not None and cache[0] == sequence else {}
+            results[key] = result
+            self._paste_cache = (sequence, results)
+        return result
+
+    def _paste_format(self, clip, text) -> int:
+        """
+        The format ``paste`` reads, 0 if the clipboard is empty. Clipboard must already be open to use this!
+        """
+        format = clip.EnumClipboardFormats()
+        if format == 0 or format in _CF_FORMATS:
+            return format
+        all_formats = self._clipboard._enumerate_clipboard_formats()
+        acceptable_formats = [f for f in all_formats if f in self._implemented_formats]
+        if not acceptable_formats:
+            raise UnparsableClipboardFormatException("Clipboard contents have no standard formats available. "
+                                            "The contents can only be understood by a private program")
+        if text and format not in self._string_formats:
+            raise ClipboardNotTextFormatException("Clipboard has no text formats available, but text options "
+                                                  "were specified.")
+        return max(acceptable_formats)
+
+    def _paste(self, text, encoding, errors) -> Tuple[Union[str, bytes], int]:
+        """
+        Read the clipboard. Returns the contents and the format they were read from.
         """
         with self._clipboard as clip:
-            format = clip.EnumClipboardFormats()
+            format = self._paste_format(clip, text or encoding or errors)
             if format == 0:
                 if text or encoding or errors:
-                    return ''
+                    return '', format
                 else:
-                    return b''
-            if format not in _CF_FORMATS:
-                all_formats = self._clipboard._enumerate_clipboard_formats()
-                acceptable_formats = [f for f in all_formats if f in self._implemented_formats]
-                if not acceptable_formats:
-                    raise UnparsableClipboardFormatException("Clipboard contents have no standard formats available. "
-                                                    "The contents can only be understood by a private program")
-                if (text or encoding or errors) and format not in self._string_formats:
-                    raise ClipboardNotTextFormatException("Clipboard has no text formats available, but text options "
-                                                          "were specified.")
-                format = max(acceptable_formats)
-
+                    return b'', format
             d = clip.GetClipboardData(format)
             if format not in self._string_formats and format in self._implemented_formats:
-                return self._handle_format(format, d)
+                return self._handle_format(format, d), format
 
         if isinstance(d, str):
             if format in self._string_formats:
                 d = d.rstrip('\x00')  # string formats are null-terminated
             if not (text or encoding or errors):
-                return d.encode()  # even though the windows API returned a string
-                                   # We convert back to bytes for API consistency here
-        return d
\ No newline at end of file
+                return d.encode(), format  # even though the windows API returned a string
+                                           # We convert back to bytes for API consistency here
+        return d, format
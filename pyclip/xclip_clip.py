@@ -14,36 +14,229 @@
 """
 Provides the clipboard functionality for Linux via ``xclip``
 """
+import ctypes
+import ctypes.util
+import select
 import shutil
 import subprocess
+import threading
 import warnings
-from typing import Union
+from typing import Dict, Iterator, List, Optional, Union
 
-from .base import ClipboardBase, ClipboardException, ClipboardSetupException
+from . import instrumentation, spawn
+from .base import ClipboardException, ClipboardSetupException, SubprocessClipboardBase, _byte_view
 
 
-class XclipClipboard(ClipboardBase):
+class _SelectionChangeProbe:
+    """
+    Detects changes of selection ownership over a lightweight ``libX11`` connection (via ctypes) using
+    XFixes selection events. Used to know when cached ``TARGETS`` are stale without spawning ``xclip``.
+
+    Every call on the connection is made with ``_lock`` held, so a probe can be shared between threads without
+    ``XInitThreads``. If the connection to the X server is lost, Xlib's default of exiting the process is
+    replaced by marking the probe dead: it then reports every call to :py:meth:`changed` as a change, no owner,
+    and :py:meth:`wait` raises :py:class:`ClipboardException`.
+    """
+
+    _SET_SELECTION_OWNER_NOTIFY_MASK = 1 << 0
+    _SELECTION_WINDOW_DESTROY_NOTIFY_MASK = 1 << 1
+    _SELECTION_CLIENT_CLOSE_NOTIFY_MASK = 1 << 2
+
+    def __init__(self, selection: str = 'CLIPBOARD'):
+        x11_name = ctypes.util.find_library('X11')
+        xfixes_name = ctypes.util.find_library('Xfixes')
+        if not x11_name or not xfixes_name:
+            raise OSError("libX11 and libXfixes are required to track selection changes")
+        self._x11 = x11 = ctypes.CDLL(x11_name)
+        self._xfixes = xfixes = ctypes.CDLL(xfixes_name)
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XInternAtom.restype = ctypes.c_ulong
+        x11.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        x11.XGetSelectionOwner.restype = ctypes.c_ulong
+        x11.XGetSelectionOwner.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XPending.argtypes = [ctypes.c_void_p]
+        x11.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        x11.XConnectionNumber.argtypes = [ctypes.c_void_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        if not hasattr(x11, 'XSetIOErrorExitHandler'):
+            # older versions exit the process when the connection is lost
+            raise OSError("libX11 1.7 or later is required to track selection changes")
+        x11.XSetIOErrorExitHandler.argtypes = [ctypes.c_void_p, self._IOErrorExitHandler, ctypes.c_void_p]
+        xfixes.XFixesQueryExtension.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        xfixes.XFixesSelectSelectionInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+
+        self._lock = threading.Lock()
+        self._dead = False
+        self._dpy = x11.XOpenDisplay(None)
+        if not self._dpy:
+            raise OSError("Could not open X display")
+        try:
+            # called by Xlib, with _lock held, instead of exiting when the connection is lost
+            self._exit_handler = self._IOErrorExitHandler(self._connection_lost)
+            x11.XSetIOErrorExitHandler(self._dpy, self._exit_handler, None)
+            event_base, error_base = ctypes.c_int(), ctypes.c_int()
+            if not xfixes.XFixesQueryExtension(self._dpy, ctypes.byref(event_base), ctypes.byref(error_base)):
+                raise OSError("X server does not support the XFixes extension")
+            self._atom = atom = x11.XInternAtom(self._dpy, selection.encode(), 0)
+            mask = (
+                self._SET_SELECTION_OWNER_NOTIFY_MASK
+                | self._SELECTION_WINDOW_DESTROY_NOTIFY_MASK
+                | self._SELECTION_CLIENT_CLOSE_NOTIFY_MASK
+            )
+            xfixes.XFixesSelectSelectionInput(self._dpy, x11.XDefaultRootWindow(self._dpy), atom, mask)
+            self._event = ctypes.create_string_buffer(192)  # sizeof(XEvent)
+            self.changed()  # flush the selection input request
+            if self._dead:
+                raise OSError("Lost the connection to the X server")
+        except BaseException:
+            self.close()
+            raise
+
+    _IOErrorExitHandler = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)
+
+    def _connection_lost(self, dpy, user_data) -> None:
+        self._dead = True
+
+    def changed(self) -> bool:
+        """
+        Return True if the selection owner changed since the last call
+        """
+        changed = False
+        with self._lock:
+            if self._dead or not self._dpy:
+                return True
+            # XSync is a round trip on the existing connection, so every event generated so far is queued
+            self._x11.XSync(self._dpy, 0)
+            while not self._dead and self._x11.XPending(self._dpy):
+                self._x11.XNextEvent(self._dpy, self._event)
+                changed = True
+        return changed or self._dead
+
+    def owner(self) -> int:
+        """
+        The window owning the selection (0 if there is none). Each ``xclip -i`` serves from a window of its own.
+        """
+        with self._lock:
+            if self._dead or not self._dpy:
+                return 0
+            owner = self._x11.XGetSelectionOwner(self._dpy, self._atom)
+            return 0 if self._dead else owner
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block for up to ``timeout`` seconds until the selection owner changes. Returns True if it did.
+        """
+        with self._lock:
+            if self._dead or not self._dpy:
+                raise ClipboardException("Lost the connection to the X server")
+            fd = self._x11.XConnectionNumber(self._dpy)
+        select.select([fd], [], [], timeout)
+        changed = self.changed()
+        if self._dead:
+            raise ClipboardException("Lost the connection to the X server")
+        return changed
+
+    def close(self) -> None:
+        with self._lock:
+            if self._dpy:
+                self._x11.XCloseDisplay(self._dpy)
+                self._dpy = None
+
+    def __del__(self):
+        # Xlib must not keep a pointer to the exit handler once it is freed
+        if getattr(self, '_dpy', None):
+            self.close()
+
+
+class XclipClipboard(SubprocessClipboardBase):
+    _copy_helper_name = 'xclip'
+    _paste_helper_name = 'xclip'
+
     def __init__(self):
         self.xclip = shutil.which('xclip')
         if not self.xclip:
             raise ClipboardSetupException(
                 "xclip must be installed. " "Please install xclip using your system package manager"
             )
+        try:
+            self._change_probe = _SelectionChangeProbe()
+        except OSError:
+            self._change_probe = None
+        self._targets_cache = None
 
-    def copy(self, data: Union[str, bytes], encoding: str = None) -> None:
+    def release(self) -> None:
+        """
+        Close the connection used to track selection changes
+        """
+        if self._change_probe is not None:
+            self._change_probe.close()
+            self._change_probe = None
+
+    def _copy_args(self, mime: str = None) -> List[str]:
+        self._targets_cache = None  # copying makes xclip the new selection owner
+        target = ['-t', mime] if mime is not None else []
+        return [self.xclip, '-selection', 'clipboard'] + target
+
+    def _targets_args(self) -> List[str]:
+        return [self.xclip, '-o', '-selection', 'clipboard', '-t', 'TARGETS']
+
+    def _change_token(self) -> Optional[int]:
+        if self._change_probe is None:
+            return None
+        return self._change_probe.owner() or None
+
+    def _cached_targets(self) -> Optional[List[str]]:
+        if self._change_probe is None or self._change_probe.changed():
+            self._targets_cache = None
+        return self._targets_cache
+
+    def _remember_targets(self, output: str) -> List[str]:
+        self._targets_cache = output.splitlines()
+        return self._targets_cache
+
+    def _select_target(self, targets: List[str]) -> Optional[str]:
+        """
+        Select the first mime type available or plain text
+        """
+        available_targets = [t for t in targets if t.islower()]
+        if "text/plain" in available_targets:
+            return "text/plain"
+        elif available_targets:
+            return available_targets[0]
+        return None
+
+    def _negotiate_mime(self) -> Optional[str]:
+        return self._select_target(self.list_targets())
+
+    def _paste_args(self, mime: str = None) -> List[str]:
+        target = ['-t', mime] if mime is not None else []
+        return [self.xclip, '-o', '-selection', 'clipboard'] + target
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str = None) -> None:
         """
         Copy data into the clipboard
 
-        :param data: the data to be copied to the clipboard. Can be str or bytes.
+        :param data: the data to be copied to the clipboard. Can be str, bytes or another bytes-like object
+            (e.g. ``bytearray`` or ``mmap``), or a dict with a single ``{mime: data}`` item to set the target.
+            xclip cannot offer several targets at once.
         :param encoding: same meaning as in ``subprocess.Popen``.
         :return: None
         """
-        args = [
-            self.xclip,
-            '-selection',
-            'clipboard',
-        ]
-        if isinstance(data, bytes):
+        if isinstance(data, dict):
+            mime, data = self._single_format(data, encoding)
+            encoding = None
+            args = self._copy_args(mime)
+        else:
+            args = self._copy_args()
+        if isinstance(data, str):
+            text = True
+        else:
+            if not isinstance(data, bytes):
+                data = _byte_view(data)  # piped to the helper as is
             if encoding is not None:
                 warnings.warn(
                     "encoding specified with a bytes argument. "
@@ -51,21 +244,18 @@ class XclipClipboard(ClipboardBase):
                     "To remove this warning, omit the encoding parameter or specify it as None",
                     stacklevel=2,
                 )
-            proc = subprocess.Popen(
+            text = None
+        recorder = instrumentation.current()
+        with recorder.phase('spawn'):
+            proc = spawn.Popen(
                 args,
                 stdin=subprocess.PIPE,
+                text=text,
                 encoding=encoding,
             )
-        elif isinstance(data, str):
-            proc = subprocess.Popen(
-                args,
-                stdin=subprocess.PIPE,
-                text=True,
-                encoding=encoding,
-            )
-        else:
-            raise TypeError(f"data argument must be of type str or bytes, not {type(data)}")
-        stdout, stderr = proc.communicate(data)
+        recorder.spawned()
+        with recorder.phase('transfer'):
+            stdout, stderr = proc.communicate(data)
         if proc.returncode != 0:
             raise ClipboardException(
                 f"Copy failed. xclip returned code: {proc.returncode!r} "
@@ -73,40 +263,53 @@ class XclipClipboard(ClipboardBase):
                 f"Stdout: {stdout!r}"
             )
 
-    def paste(self, encoding: str = None, text: bool = None, errors: str = None):
+    def list_targets(self) -> List[str]:
+        """
+        List the targets (mostly MIME types) offered by the current selection owner.
+
+        The result is cached until the selection owner changes, when that can be detected
+        (requires ``libX11`` and ``libXfixes``). Otherwise, ``xclip`` is asked every time.
+
+        :return: list of target names
+        """
+        targets = self._cached_targets()
+        if targets is None:
+            recorder = instrumentation.current()
+            recorder.spawned()
+            try:
+                with recorder.phase('negotiate'):
+                    output = spawn.check_output(self._targets_args(), text=True, stderr=subprocess.DEVNULL)
+            except subprocess.CalledProcessError:
+                output = ''  # no selection owner
+            targets = self._remember_targets(output)
+        return list(targets)
+
+    def paste(self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None):
         """
         Retrieve data from the clipboard
 
         :param encoding: same meaning as in ``subprocess.run``
         :param text: same meaning as in ``subprocess.run``
         :param errors: same meaning as in ``subprocess.run``
+        :param mime: the target (MIME type) to retrieve. When given, target negotiation is skipped entirely.
         :return: the clipboard contents. return type is binary by default.
             If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
         """
         args = [self.xclip, '-o', '-selection', 'clipboard']
-        if encoding or text or errors:
-            completed_proc = subprocess.run(
-                args,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=text,
-                encoding=encoding,
-            )
+        recorder = instrumentation.current()
+        if mime is not None:
+            kwargs = dict(text=text, encoding=encoding, errors=errors)
+            args += ['-t', mime]
+        elif encoding or text or errors:
+            kwargs = dict(text=text, encoding=encoding)
         else:
-            # retrieve the available targets and selects the first mime type available or plain text. 
-            available_targets = [
-                t for t in subprocess.check_output(args + ['-t', 'TARGETS'], text=True).splitlines() if t.islower()
-            ]
-            if "text/plain" in available_targets:
-                target = ["-t", "text/plain"]
-            elif available_targets:
-                target = ["-t", available_targets[0]]
-            else:
-                target = []
-
-            completed_proc = subprocess.run(
-                args + target, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            kwargs = {}
+            with recorder.phase('negotiate'):
+                args = self._paste_args(self._negotiate_mime())
+        recorder.spawned()
+        with recorder.phase('transfer'):
+            completed_proc = spawn.run(
+                args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
             )
 
         if completed_proc.returncode != 0:
@@ -124,3 +327,19 @@ class XclipClipboard(ClipboardBase):
         :return:
         """
         self.copy('')
+
+    def _changes(self, stop: threading.Event, poll_interval: float) -> Iterator[Optional[bytes]]:
+        try:
+            probe = _SelectionChangeProbe()
+        except OSError:
+            return super()._changes(stop, poll_interval)
+
+        def changes():
+            try:
+                while not stop.is_set():
+                    if probe.wait(poll_interval):
+                        yield None
+            finally:
+                probe.close()
+
+        return changes()
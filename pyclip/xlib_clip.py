@@ -0,0 +1,587 @@
+#  Copyright 2021 Spencer Phillip Young
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+Provides the clipboard functionality for Linux on X11 by speaking the selection protocol directly
+over a single, long-lived display connection (via the ``python-xlib`` package)
+
+Contents larger than one X request are transferred with the ICCCM ``INCR`` protocol, in both directions: the
+data moves in chunks, and the next chunk is only sent once the previous one was consumed, so neither side has to
+hold more than a chunk in flight.
+"""
+import atexit
+import contextlib
+import io
+import os
+import threading
+import time
+import warnings
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from .base import ClipboardBase, ClipboardException, ClipboardSetupException, _byte_view, _decode, _encode_formats
+
+try:
+    import Xlib.threaded  # noqa: F401 -- makes the display connection safe to share with the event thread
+    from Xlib import X as _X
+    from Xlib import Xatom as _Xatom
+    from Xlib import error as _xerror
+    from Xlib.display import Display as _Display
+    from Xlib.ext import xfixes as _xfixes
+    from Xlib.protocol import event as _xevent
+except ImportError:
+    _X = None
+    _Xatom = None
+    _xerror = None
+    _Display = None
+    _xfixes = None
+    _xevent = None
+
+_TIMEOUT = 5.0
+#: upper bound for the size of one INCR chunk; the maximum X request size may lower it
+_INCR_CHUNK_SIZE = 1024 * 1024
+
+
+class _IncrSend:
+    """
+    State of one INCR transfer this process serves to a requestor
+    """
+
+    __slots__ = ('requestor', 'property', 'target', 'data', 'offset', 'deadline')
+
+    def __init__(self, requestor, prop: int, target: int, data: bytes):
+        self.requestor = requestor
+        self.property = prop
+        self.target = target
+        self.data = data
+        self.offset = 0
+        self.deadline = time.monotonic() + _TIMEOUT
+
+
+class _IncrReader(io.RawIOBase):
+    """
+    Binary stream over an INCR transfer from another selection owner. Deleting the property after each chunk is
+    read tells the owner to send the next one.
+    """
+
+    def __init__(self, clipboard: 'XlibClipboard', size: int):
+        super().__init__()
+        self._clipboard = clipboard
+        #: the size the owner advertised. ICCCM only makes it a lower bound.
+        self.size = size
+        self._chunk = memoryview(b'')
+        self._received = 0
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_chunk(self) -> bytes:
+        clipboard = self._clipboard
+        clipboard._wait_for(
+            lambda e: e.type == _X.PropertyNotify
+            and e.atom == clipboard._property
+            and e.state == _X.PropertyNewValue
+            and e.window.id == clipboard._window.id
+        )
+        prop = clipboard._window.get_full_property(
+            clipboard._property, _X.AnyPropertyType, sizehint=clipboard._max_property_size // 4
+        )
+        clipboard._window.delete_property(clipboard._property)
+        clipboard._display.flush()
+        if prop is None:
+            return b''
+        if prop.format != 8:
+            raise ClipboardException(f"Paste failed. Unexpected property format: {prop.format}")
+        return prop.value
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            if self._eof:
+                return 0
+            chunk = self._next_chunk()
+            if not chunk:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(chunk)
+            self._received += len(chunk)
+            self._clipboard._report_progress('paste', self._received, self.size)
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+
+class XlibClipboard(ClipboardBase):
+    """
+    X11 clipboard backend that owns and converts selections itself rather than spawning ``xclip``.
+
+    One connection to the X server (and one hidden window) is opened when the clipboard is created.
+    A daemon thread services ``SelectionRequest`` events for as long as this process owns the selection.
+    When the interpreter exits while still owning the selection, a small child process is forked to keep
+    serving it (the same thing ``xclip`` does), unless ``persist`` is ``False``.
+
+    :param display: the X display to connect to. Defaults to ``$DISPLAY``.
+    :param selection: the selection to use
+    :param persist: keep serving the selection after the interpreter exits
+    :param progress: called as ``progress(direction, transferred, total)`` after every chunk of an INCR transfer,
+        where ``direction`` is ``'paste'`` (this process receiving, called from the pasting thread) or ``'copy'``
+        (this process serving another client, called from the event thread). ``total`` is the advertised size.
+    """
+
+    def __init__(
+        self,
+        display: str = None,
+        selection: str = 'CLIPBOARD',
+        persist: bool = True,
+        progress: Callable[[str, int, int], Any] = None,
+    ):
+        if _Display is None:
+            raise ClipboardSetupException(
+                "python-xlib must be installed to use the Xlib backend. " "Please install it with `pip install python-xlib`"
+            )
+        self._display_name = display
+        try:
+            self._display = _Display(display)
+        except _xerror.DisplayError as e:
+            raise ClipboardSetupException(f"Could not connect to X display: {e}") from e
+        self._window = self._create_window()
+        self._selection = self._display.intern_atom(selection)
+        self._property = self._display.intern_atom('PYCLIP_SELECTION')
+        self._targets_atom = self._display.intern_atom('TARGETS')
+        self._timestamp_atom = self._display.intern_atom('TIMESTAMP')
+        self._utf8_atom = self._display.intern_atom('UTF8_STRING')
+        self._incr_atom = self._display.intern_atom('INCR')
+        self._atom_names: Dict[int, str] = {}
+        self._contents: Dict[int, bytes] = {}
+        self._owner_time = _X.CurrentTime
+        self._persist = persist
+        self._progress = progress
+        self._incr_sends: Dict[Tuple[int, int], _IncrSend] = {}
+
+        self._cond = threading.Condition()
+        self._events = []
+        self._selection_serial = 0
+        self._paste_lock = threading.Lock()
+        self._xfixes = self._display.has_extension('XFIXES')
+        if self._xfixes:
+            self._display.xfixes_query_version()
+            mask = (
+                _xfixes.XFixesSetSelectionOwnerNotifyMask
+                | _xfixes.XFixesSelectionWindowDestroyNotifyMask
+                | _xfixes.XFixesSelectionClientCloseNotifyMask
+            )
+            self._display.xfixes_select_selection_input(self._display.screen().root, self._selection, mask)
+        self._thread = threading.Thread(target=self._event_loop, name='pyclip-xlib-events', daemon=True)
+        self._thread.start()
+        atexit.register(self._persist_at_exit)
+
+    def release(self) -> None:
+        """
+        Close the display connection, which ends the event thread. The selection is not kept alive at exit.
+        """
+        atexit.unregister(self._persist_at_exit)
+        self._display.close()
+
+    def _create_window(self):
+        screen = self._display.screen()
+        return screen.root.create_window(
+            -10, -10, 1, 1, 0, screen.root_depth, event_mask=_X.PropertyChangeMask
+        )
+
+    @property
+    def _max_property_size(self) -> int:
+        # ChangeProperty carries a 24 byte header; the length limit is expressed in 4-byte units
+        return self._display.display.info.max_request_length * 4 - 24
+
+    @property
+    def _incr_chunk_size(self) -> int:
+        return min(_INCR_CHUNK_SIZE, self._max_property_size)
+
+    def _report_progress(self, direction: str, transferred: int, total: int) -> None:
+        if self._progress is not None:
+            self._progress(direction, transferred, total)
+
+    def _atom(self, name: str) -> int:
+        return self._display.intern_atom(name)
+
+    def _atom_name(self, atom: int) -> str:
+        try:
+            return self._atom_names[atom]
+        except KeyError:
+            name = self._display.get_atom_name(atom)
+            self._atom_names[atom] = name
+            return name
+
+    def _event_loop(self):
+        while True:
+            try:
+                ev = self._display.next_event()
+            except (_xerror.ConnectionClosedError, OSError):
+                return
+            self._handle_event(ev)
+
+    def _handle_event(self, ev):
+        if ev.type == _X.SelectionRequest:
+            self._handle_selection_request(ev)
+        elif ev.type == _X.SelectionClear:
+            if ev.atom == self._selection:
+                with self._cond:
+                    self._contents = {}
+                    self._cond.notify_all()
+        elif isinstance(ev, _xfixes.SelectionNotify):
+            if ev.selection == self._selection:
+                with self._cond:
+                    self._selection_serial += 1
+                    self._cond.notify_all()
+        elif (
+            ev.type == _X.PropertyNotify
+            and ev.state == _X.PropertyDelete
+            and (ev.window.id, ev.atom) in self._incr_sends
+        ):
+            self._continue_incr(self._incr_sends[ev.window.id, ev.atom])
+        elif ev.type in (_X.SelectionNotify, _X.PropertyNotify):
+            with self._cond:
+                self._events.append(ev)
+                self._cond.notify_all()
+
+    def _discard_events(self, predicate) -> None:
+        """
+        Drop queued events matching ``predicate``, such as notifications left over from an earlier request
+        """
+        with self._cond:
+            self._events[:] = [ev for ev in self._events if not predicate(ev)]
+
+    def _is_property_notify(self, ev) -> bool:
+        return ev.type == _X.PropertyNotify and ev.atom == self._property and ev.window.id == self._window.id
+
+    def _wait_for(self, predicate, timeout: float = _TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for i, ev in enumerate(self._events):
+                    if predicate(ev):
+                        # leave the other events queued for their own waiters
+                        del self._events[i]
+                        return ev
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ClipboardException("Timed out waiting for the X selection owner to respond")
+                self._cond.wait(remaining)
+
+    def _handle_selection_request(self, ev):
+        requestor = ev.requestor
+        prop = ev.property if ev.property != _X.NONE else ev.target
+        contents = self._contents
+        try:
+            if not contents:
+                prop = _X.NONE
+            elif ev.target == self._targets_atom:
+                targets = [self._targets_atom, self._timestamp_atom, *contents]
+                requestor.change_property(prop, _Xatom.ATOM, 32, targets)
+            elif ev.target == self._timestamp_atom:
+                requestor.change_property(prop, _Xatom.INTEGER, 32, [self._owner_time])
+            elif ev.target in contents:
+                data = contents[ev.target]
+                if len(data) > self._incr_chunk_size:
+                    self._start_incr(requestor, prop, ev.target, data)
+                else:
+                    requestor.change_property(prop, ev.target, 8, data)
+            else:
+                prop = _X.NONE
+            notify = _xevent.SelectionNotify(
+                time=ev.time,
+                requestor=requestor.id,
+                selection=ev.selection,
+                target=ev.target,
+                property=prop,
+            )
+            requestor.send_event(notify, event_mask=0)
+            self._display.flush()
+        except _xerror.XError:
+            # The requestor went away before we could answer; nothing to do.
+            pass
+
+    def _start_incr(self, requestor, prop: int, target: int, data: bytes) -> None:
+        """
+        Answer a request with an INCR property. The data follows in chunks, one each time the requestor
+        deletes the property (see :py:meth:`_continue_incr`).
+        """
+        now = time.monotonic()
+        for key, send in list(self._incr_sends.items()):
+            if send.deadline < now:
+                del self._incr_sends[key]  # the requestor gave up
+        # property deletions on the requestor's window drive the transfer, so watch them before answering
+        requestor.change_attributes(event_mask=_X.PropertyChangeMask)
+        requestor.change_property(prop, self._incr_atom, 32, [len(data)])
+        self._incr_sends[requestor.id, prop] = _IncrSend(requestor, prop, target, data)
+
+    def _continue_incr(self, send: _IncrSend) -> None:
+        offset = send.offset
+        chunk = send.data[offset : offset + self._incr_chunk_size]
+        try:
+            # an empty chunk tells the requestor the transfer is complete
+            send.requestor.change_property(send.property, send.target, 8, chunk)
+            if not chunk:
+                del self._incr_sends[send.requestor.id, send.property]
+                if not any(other.requestor.id == send.requestor.id for other in self._incr_sends.values()):
+                    send.requestor.change_attributes(event_mask=_X.NoEventMask)
+            self._display.flush()
+        except _xerror.XError:
+            self._incr_sends.pop((send.requestor.id, send.property), None)
+            return
+        send.offset += len(chunk)
+        send.deadline = time.monotonic() + _TIMEOUT
+        if chunk:
+            self._report_progress('copy', send.offset, len(send.data))
+
+    def _server_time(self) -> int:
+        """
+        Obtain a current server timestamp by touching a property on our own window
+        """
+        # earlier notifications (such as the deletion at the end of a paste) carry old timestamps
+        self._discard_events(self._is_property_notify)
+        self._window.change_property(self._property, _Xatom.INTEGER, 32, [], mode=_X.PropModeAppend)
+        self._display.flush()
+        ev = self._wait_for(lambda e: self._is_property_notify(e) and e.state == _X.PropertyNewValue)
+        return ev.time
+
+    def _own(self, contents: Dict[int, bytes]) -> None:
+        self._contents = contents
+        self._owner_time = self._server_time()
+        self._window.set_selection_owner(self._selection, self._owner_time)
+        self._display.flush()
+        if self._selection_owner() != self._window.id:
+            self._contents = {}
+            raise ClipboardException("Copy failed. Could not acquire ownership of the X selection")
+
+    def _selection_owner(self) -> int:
+        owner = self._display.get_selection_owner(self._selection)
+        return getattr(owner, 'id', owner)
+
+    def _owns_selection(self) -> bool:
+        return bool(self._contents) and self._selection_owner() == self._window.id
+
+    def _change_token(self) -> Optional[int]:
+        # the server time at which we took the selection identifies our ownership
+        return self._owner_time if self._owns_selection() else None
+
+    def copy(self, data: Union[str, bytes, Dict[str, Union[str, bytes]]], encoding: str = None) -> None:
+        """
+        Copy data into the clipboard
+
+        :param data: the data to be copied to the clipboard. Can be str or bytes, or a dict mapping targets
+            (MIME types) to str or bytes, which are all offered by a single selection owner. Plain text
+            (``text/plain``) is also offered as ``UTF8_STRING`` and ``TEXT``.
+        :param encoding: encoding used to encode ``str`` data. Defaults to utf-8.
+        :return: None
+        """
+        if isinstance(data, dict):
+            formats = _encode_formats(data, encoding)
+            contents = {self._atom(mime): value for mime, value in formats.items()}
+            text = next((value for mime, value in formats.items() if mime.split(';')[0] == 'text/plain'), None)
+            if text is not None:
+                contents.setdefault(self._utf8_atom, text)
+                contents.setdefault(self._atom('TEXT'), text)
+            self._own(contents)
+            return
+        if isinstance(data, str):
+            data = data.encode(encoding or 'utf-8')
+        else:
+            if not isinstance(data, bytes):
+                # served until the next copy, so later changes by the caller must not show
+                data = _byte_view(data).tobytes()
+            if encoding is not None:
+                warnings.warn(
+                    "encoding specified with a bytes argument. "
+                    "Encoding option will be ignored. "
+                    "To remove this warning, omit the encoding parameter or specify it as None",
+                    stacklevel=2,
+                )
+        self._own({self._utf8_atom: data, self._atom('TEXT'): data})
+
+    def _convert(self, target: int):
+        """
+        Ask the selection owner to convert the selection to ``target`` and read back the result.
+        The caller holds ``_paste_lock``.
+
+        :return: the property, None if the owner refused, or an :py:class:`_IncrReader` for INCR transfers,
+            from which the data must be read before the next conversion
+        """
+        self._discard_events(self._is_property_notify)
+        self._window.convert_selection(self._selection, target, self._property, _X.CurrentTime)
+        self._display.flush()
+        ev = self._wait_for(
+            lambda e: e.type == _X.SelectionNotify and e.selection == self._selection and e.target == target
+        )
+        if ev.property == _X.NONE:
+            return None
+        prop = self._window.get_full_property(self._property, _X.AnyPropertyType, sizehint=self._max_property_size // 4)
+        # the owner writing the property queued a PropertyNotify ahead of the SelectionNotify. Drop it before the
+        # deletion, which also starts an INCR transfer, so that _IncrReader only sees notifications of its chunks.
+        self._discard_events(self._is_property_notify)
+        self._window.delete_property(self._property)
+        self._display.flush()
+        if prop is not None and prop.property_type == self._incr_atom:
+            return _IncrReader(self, prop.value[0] if len(prop.value) else 0)
+        return prop
+
+    def list_targets(self) -> List[str]:
+        """
+        List the targets (mostly MIME types) the current selection owner offers
+
+        :return: list of target names
+        """
+        if self._owns_selection():
+            atoms = [self._targets_atom, self._timestamp_atom, *self._contents]
+        elif self._selection_owner() == _X.NONE:
+            return []
+        else:
+            with self._paste_lock:
+                prop = self._convert(self._targets_atom)
+                if isinstance(prop, _IncrReader):
+                    prop.read()  # drain the transfer; nobody offers that many targets
+                    return []
+            if prop is None or prop.format != 32:
+                return []
+            atoms = list(prop.value)
+        return [self._atom_name(atom) for atom in atoms]
+
+    @contextlib.contextmanager
+    def _open_target(self, target: int) -> Iterator[BinaryIO]:
+        """
+        Context manager providing a binary file object with the contents of ``target``. INCR transfers are read
+        as the file object is consumed.
+        """
+        if self._owns_selection():
+            yield io.BytesIO(self._contents.get(target, b''))
+            return
+        if self._selection_owner() == _X.NONE:
+            yield io.BytesIO(b'')
+            return
+        with self._paste_lock:
+            prop = self._convert(target)
+            if isinstance(prop, _IncrReader):
+                with prop:
+                    yield prop
+                return
+        if prop is None:
+            yield io.BytesIO(b'')
+            return
+        if prop.format != 8:
+            raise ClipboardException(f"Paste failed. Unexpected property format: {prop.format}")
+        yield io.BytesIO(prop.value)
+
+    def _read_target(self, target: int) -> bytes:
+        with self._open_target(target) as f:
+            if not isinstance(f, _IncrReader):
+                return f.getvalue()
+            # collected in a BytesIO, whose getvalue hands over its buffer instead of copying the whole payload again
+            out = io.BytesIO()
+            scratch = memoryview(bytearray(self._incr_chunk_size))
+            while True:
+                n = f.readinto(scratch)
+                if not n:
+                    return out.getvalue()
+                out.write(scratch[:n])
+
+    def _paste_target(self, mime: str = None) -> int:
+        if mime is not None:
+            return self._atom(mime)
+        # mirror xclip's target selection: prefer text/plain, then the first mime type, then UTF8_STRING
+        available_targets = [t for t in self.list_targets() if t.islower()]
+        if 'text/plain' in available_targets:
+            return self._atom('text/plain')
+        elif available_targets:
+            return self._atom(available_targets[0])
+        return self._utf8_atom
+
+    def _paste_mime(self) -> str:
+        return self._atom_name(self._paste_target())
+
+    def _open_paste_stream(self, mime: str = None) -> Iterator[BinaryIO]:
+        """
+        Context manager providing a binary file object with the clipboard contents. Large selections are
+        streamed chunk by chunk as they are read, so ``iter_paste``, ``paste_into`` and ``paste_to_file``
+        never hold more than one chunk.
+        """
+        return self._open_target(self._paste_target(mime))
+
+    def paste(self, encoding: str = None, text: bool = None, errors: str = None, mime: str = None) -> Union[str, bytes]:
+        """
+        Retrieve data from the clipboard
+
+        :param encoding: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param text: if True, the contents are decoded and returned as str
+        :param errors: same meaning as in ``bytes.decode``. Implies ``text=True``
+        :param mime: the target (MIME type) to retrieve. When given, target negotiation is skipped entirely.
+        :return: the clipboard contents. return type is binary by default.
+            If any of ``encoding``, ``errors``, or ``text`` are specified, the result type is str
+        """
+        if mime is None and (encoding or text or errors):
+            return _decode(self._read_target(self._utf8_atom), encoding, errors)
+        data = self._read_target(self._paste_target(mime))
+        if encoding or text or errors:
+            return _decode(data, encoding, errors)
+        return data
+
+    def clear(self):
+        """
+        Clear the clipboard contents
+
+        :return:
+        """
+        self.copy('')
+
+    def _changes(self, stop: threading.Event, poll_interval: float) -> Iterator[Optional[bytes]]:
+        if not self._xfixes:
+            return super()._changes(stop, poll_interval)
+        with self._cond:
+            serial = self._selection_serial
+
+        def changes():
+            nonlocal serial
+            while not stop.is_set():
+                with self._cond:
+                    self._cond.wait_for(lambda: self._selection_serial != serial, timeout=poll_interval)
+                    changed, serial = self._selection_serial != serial, self._selection_serial
+                if changed:
+                    yield None
+
+        return changes()
+
+    def _persist_at_exit(self):
+        """
+        Fork a child that keeps serving the selection after this process exits
+        """
+        if not self._persist or not self._owns_selection():
+            return
+        if os.fork() != 0:
+            return
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            self._display = _Display(self._display_name)
+            self._window = self._create_window()
+            self._cond = threading.Condition()
+            self._events = []
+            self._incr_sends = {}
+            self._thread = threading.Thread(target=self._event_loop, name='pyclip-xlib-events', daemon=True)
+            self._thread.start()
+            self._own(dict(self._contents))
+            with self._cond:
+                while self._contents:
+                    self._cond.wait()
+        finally:
+            os._exit(0)
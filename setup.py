@@ -2,7 +2,7 @@ from setuptools import setup
 from io import open
 import sys
 test_requirements = ['pytest']
-extras = {'test': test_requirements}
+extras = {'test': test_requirements, 'xlib': ['python-xlib'], 'benchmark': ['pytest-benchmark']}
 
 with open('docs/README.md', encoding='utf-8') as f:
     long_description = f.read()
@@ -0,0 +1,184 @@
+"""
+A tiny stand-in Wayland compositor implementing only the subset of the protocol used by
+:py:class:`pyclip.wayland_datacontrol_clip.WaylandDataControlClipboard`: the registry, ``wl_display.sync``,
+a ``wl_seat`` global and ``zwlr_data_control_manager_v1``.
+"""
+import array
+import os
+import socket
+import struct
+import threading
+
+SERVER_ID_START = 0xFF000000
+
+
+def _pack_string(value):
+    encoded = value.encode() + b'\x00'
+    return struct.pack('=I', len(encoded)) + encoded + b'\x00' * (-len(encoded) % 4)
+
+
+class _Client:
+    def __init__(self, compositor, sock):
+        self.compositor = compositor
+        self.sock = sock
+        self.objects = {1: 'wl_display'}
+        self.send_lock = threading.Lock()
+        self.next_server_id = SERVER_ID_START
+        self.devices = []
+
+    def send(self, object_id, opcode, args=b'', fds=()):
+        message = struct.pack('=II', object_id, ((8 + len(args)) << 16) | opcode) + args
+        with self.send_lock:
+            if fds:
+                self.sock.sendmsg([message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+            else:
+                self.sock.sendall(message)
+
+    def new_server_id(self, interface):
+        object_id = self.next_server_id
+        self.next_server_id += 1
+        self.objects[object_id] = interface
+        return object_id
+
+    def serve(self):
+        buffer = b''
+        fds = []
+        while True:
+            try:
+                data, ancdata, _, _ = self.sock.recvmsg(65536, socket.CMSG_SPACE(28 * 4))
+            except OSError:
+                break
+            if not data:
+                break
+            for _level, _kind, fd_data in ancdata:
+                received = array.array('i')
+                received.frombytes(fd_data)
+                fds.extend(received)
+            buffer += data
+            while len(buffer) >= 8:
+                object_id, size_opcode = struct.unpack_from('=II', buffer)
+                size = size_opcode >> 16
+                if len(buffer) < size:
+                    break
+                payload, buffer = buffer[8:size], buffer[size:]
+                with self.compositor.lock:
+                    self.handle(object_id, size_opcode & 0xFFFF, payload, fds)
+        with self.compositor.lock:
+            self.compositor.disconnect(self)
+
+    def handle(self, object_id, opcode, payload, fds):
+        interface = self.objects.get(object_id)
+        uints = lambda n: struct.unpack_from('=' + 'I' * n, payload)  # noqa: E731
+        if interface == 'wl_display':
+            (new_id,) = uints(1)
+            if opcode == 0:  # sync
+                self.send(new_id, 0, struct.pack('=I', 0))
+                self.send(1, 1, struct.pack('=I', new_id))
+            elif opcode == 1:  # get_registry
+                self.objects[new_id] = 'wl_registry'
+                for name, (global_interface, version) in enumerate(self.compositor.globals, 1):
+                    self.send(new_id, 0, struct.pack('=I', name) + _pack_string(global_interface) + struct.pack('=I', version))
+        elif interface == 'wl_registry':  # bind
+            (name, length) = uints(2)
+            bound_interface = payload[8 : 8 + length - 1].decode()
+            offset = 8 + length + (-length % 4)
+            _version, new_id = struct.unpack_from('=II', payload, offset)
+            self.objects[new_id] = bound_interface
+        elif interface == 'zwlr_data_control_manager_v1':
+            if opcode == 0:  # create_data_source
+                (new_id,) = uints(1)
+                self.objects[new_id] = 'zwlr_data_control_source_v1'
+                self.compositor.sources[(self, new_id)] = []
+            elif opcode == 1:  # get_data_device
+                (new_id, _seat) = uints(2)
+                self.objects[new_id] = 'zwlr_data_control_device_v1'
+                self.devices.append(new_id)
+                self.compositor.announce(self, new_id)
+        elif interface == 'zwlr_data_control_source_v1':
+            if opcode == 0:  # offer
+                (length,) = uints(1)
+                self.compositor.sources[(self, object_id)].append(payload[4 : 4 + length - 1].decode())
+            elif opcode == 1:  # destroy
+                self.compositor.sources.pop((self, object_id), None)
+                self.objects.pop(object_id)
+                self.send(1, 1, struct.pack('=I', object_id))
+        elif interface == 'zwlr_data_control_device_v1' and opcode == 0:  # set_selection
+            (source,) = uints(1)
+            self.compositor.set_selection((self, source) if source else None)
+        elif interface == 'zwlr_data_control_offer_v1':
+            if opcode == 0:  # receive
+                (length,) = uints(1)
+                mime_type = payload[4 : 4 + length - 1].decode()
+                fd = fds.pop(0)
+                self.compositor.forward(mime_type, fd)
+            elif opcode == 1:  # destroy
+                self.objects.pop(object_id)
+                self.send(1, 1, struct.pack('=I', object_id))
+
+
+class FakeCompositor:
+    """
+    Listens on ``path`` and relays data-control selections between connected clients
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.globals = [('wl_seat', 7), ('zwlr_data_control_manager_v1', 2)]
+        self.clients = []
+        self.sources = {}
+        self.selection = None
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            client = _Client(self, sock)
+            with self.lock:
+                self.clients.append(client)
+            threading.Thread(target=client.serve, daemon=True).start()
+
+    def announce(self, client, device):
+        if self.selection is None:
+            client.send(device, 1, struct.pack('=I', 0))
+            return
+        offer = client.new_server_id('zwlr_data_control_offer_v1')
+        client.send(device, 0, struct.pack('=I', offer))
+        for mime_type in self.sources[self.selection]:
+            client.send(offer, 0, _pack_string(mime_type))
+        client.send(device, 1, struct.pack('=I', offer))
+
+    def set_selection(self, source):
+        previous, self.selection = self.selection, source
+        if previous is not None and previous != source and previous in self.sources:
+            owner, source_id = previous
+            owner.send(source_id, 1)  # cancelled
+        for client in self.clients:
+            for device in client.devices:
+                self.announce(client, device)
+
+    def forward(self, mime_type, fd):
+        try:
+            if self.selection is not None:
+                owner, source_id = self.selection
+                owner.send(source_id, 0, _pack_string(mime_type), fds=(fd,))
+        finally:
+            os.close(fd)
+
+    def disconnect(self, client):
+        self.clients.remove(client)
+        if self.selection is not None and self.selection[0] is client:
+            self.selection = None
+        for key in [key for key in self.sources if key[0] is client]:
+            del self.sources[key]
+
+    def close(self):
+        self._server.close()
+        for client in list(self.clients):
+            client.sock.close()
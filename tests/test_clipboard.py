@@ -1,7 +1,10 @@
+import contextlib
+import ctypes
 import os
 import secrets
 import subprocess
 import sys
+import time
 from unittest import mock
 
 import pytest
@@ -49,6 +52,170 @@ def test_copy_paste_null_terminated_bytes():
     assert clip.paste() == data_body
 
 
+def test_copy_stream():
+    import io
+    data = secrets.token_bytes(256 * 1024)
+    clip.copy_stream(io.BytesIO(data), chunk_size=4096)
+    assert clip.paste() == data
+
+
+@pytest.mark.xfail(sys.platform == 'darwin', reason="MacOS doesn't yet support arbitrary data")
+def test_iter_paste():
+    data = secrets.token_bytes(256 * 1024)
+    clip.copy(data)
+    chunks = list(clip.iter_paste(chunk_size=4096))
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert b''.join(chunks) == data
+
+
+@pytest.mark.xfail(sys.platform == 'darwin', reason="MacOS doesn't yet support arbitrary data")
+def test_paste_into():
+    data = secrets.token_bytes(100 * 1024)
+    clip.copy(data)
+    buffer = bytearray(len(data) + 10)
+    assert clip.paste_into(buffer) == len(data)
+    assert buffer[: len(data)] == data
+    small = bytearray(10)
+    assert clip.paste_into(memoryview(small)) == len(data)
+    assert small == data[:10]
+    grown = bytearray(10)
+    n = clip.paste_into(grown, grow=True)
+    assert n == len(data)
+    assert grown[:n] == data
+
+
+@pytest.mark.xfail(sys.platform == 'darwin', reason="MacOS doesn't yet support arbitrary data")
+def test_paste_to_file(tmp_path):
+    data = secrets.token_bytes(300 * 1024)
+    clip.copy(data)
+    path = tmp_path / 'contents.bin'
+    assert clip.paste_to_file(path) == len(data)
+    assert path.read_bytes() == data
+
+
+@pytest.mark.parametrize('use_pipe', [True, False])
+def test_copy_to_file_with_and_without_splice(tmp_path, use_pipe):
+    import io
+    import threading
+    from pyclip.base import _copy_to_file
+    data = secrets.token_bytes(3 * 1024 * 1024 + 7)
+    if use_pipe:
+        read_fd, write_fd = os.pipe()
+        writer = threading.Thread(target=lambda: (os.write(write_fd, data), os.close(write_fd)))
+        writer.start()
+        stream = open(read_fd, 'rb', buffering=0)
+    else:
+        stream = io.BytesIO(data)
+    with stream, open(tmp_path / 'out', 'wb') as f:
+        assert _copy_to_file(stream, f) == len(data)
+    if use_pipe:
+        writer.join()
+    assert (tmp_path / 'out').read_bytes() == data
+
+
+def test_aio_copypaste():
+    import asyncio
+    import pyclip.aio
+
+    async def roundtrip():
+        await pyclip.aio.copy('foo')
+        assert await pyclip.aio.paste() == b'foo'
+        assert await pyclip.aio.paste(text=True) == 'foo'
+        await pyclip.aio.clear()
+        return await pyclip.aio.paste()
+
+    assert not asyncio.run(roundtrip())
+
+
+def test_aio_offloads_non_subprocess_backends_to_threads():
+    import asyncio
+    import threading
+    from pyclip.aio import AsyncClipboard
+    from pyclip.base import ClipboardBase
+
+    class RecordingClipboard(ClipboardBase):
+        def __init__(self):
+            self.data = b''
+            self.threads = set()
+
+        def copy(self, data, encoding=None):
+            self.threads.add(threading.current_thread())
+            self.data = data
+
+        def paste(self, encoding=None, text=None, errors=None):
+            self.threads.add(threading.current_thread())
+            return self.data
+
+        def clear(self):
+            self.copy(b'')
+
+    backend = RecordingClipboard()
+    aclip = AsyncClipboard(backend)
+
+    async def roundtrip():
+        await aclip.copy(b'bar')
+        return await aclip.paste()
+
+    assert asyncio.run(roundtrip()) == b'bar'
+    assert threading.main_thread() not in backend.threads
+
+
+def test_watch_polls_and_debounces():
+    import threading
+    from pyclip.base import ClipboardBase
+
+    class MemoryClipboard(ClipboardBase):
+        def __init__(self):
+            self.data = b''
+
+        def copy(self, data, encoding=None):
+            self.data = data
+
+        def paste(self, encoding=None, text=None, errors=None):
+            return self.data
+
+        def clear(self):
+            self.copy(b'')
+
+    clip = MemoryClipboard()
+    changes = clip.watch(debounce=0.3, poll_interval=0.01)
+
+    def copier():
+        for data in (b'a', b'ab', b'abc'):
+            time.sleep(0.05)
+            clip.copy(data)
+
+    threading.Thread(target=copier).start()
+    assert next(changes) == b'abc'
+    changes.close()
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='This test is for Linux only')
+def test_wayland_datacontrol_watch(fake_compositor):
+    from pyclip.wayland_datacontrol_clip import WaylandDataControlClipboard
+    watcher = WaylandDataControlClipboard(persist=False)
+    other = WaylandDataControlClipboard(persist=False)
+    changes = watcher.watch()
+    other.copy('first')
+    assert next(changes) == b'first'
+    other.copy('second')
+    assert next(changes) == b'second'
+    changes.close()
+
+
+def test_import_does_not_detect_clipboard():
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import pyclip, pyclip.cli'],
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    imported = {line.rsplit('|', 1)[-1].strip() for line in proc.stderr.splitlines()}
+    assert 'pyclip.cli' in imported
+    assert 'pyclip.util' not in imported
+    assert not {name for name in imported if name.endswith('_clip')}
+
+
 def test_clear():
     clip.copy('foo')
     assert clip.paste(), 'test setup failed; clipboard contents unexpectedly empty'
@@ -136,6 +303,67 @@ def test_pasteboard_default():
     c = MacOSClip()
     assert isinstance(c.backend, _PasteboardBackend)
 
+def test_pasteboard_typed_copy_and_cached_paste():
+    import importlib
+    import types
+    pasteboard = types.ModuleType('pasteboard')
+    for name in ('String', 'HTML', 'RTF', 'PNG', 'TIFF', 'PDF'):
+        setattr(pasteboard, name, name)
+    pasteboard.Pasteboard = mock.Mock()
+    pb = pasteboard.Pasteboard.return_value
+    with mock.patch.dict(sys.modules, {'pasteboard': pasteboard}):
+        # not the pyclip attribute: other tests re-import pyclip
+        macos_clip = importlib.import_module('pyclip.macos_clip')
+        backend = macos_clip._PasteboardBackend()
+    data = mock.MagicMock(spec=bytes)  # a decode attempt would fail the test
+    data.decode.side_effect = AssertionError('typed copies must not be decoded')
+    backend.copy({'application/pdf': data})
+    pb.set_contents.assert_called_once_with(data, 'PDF')
+
+    with mock.patch.object(macos_clip, '_change_count', return_value=1) as change_count:
+        pb.get_contents.side_effect = lambda type='String': {'PDF': None, 'String': 'hello'}[type]
+        assert backend.paste() == b'hello'
+        assert backend.paste() == b'hello'
+        assert backend.paste(text=True) == 'hello'
+        assert pb.get_contents.call_count == 4  # PDF, then text, for each of bytes and str
+        pb.get_contents.reset_mock()
+        assert backend.paste(mime='text/plain') == b'hello'
+        pb.get_contents.assert_called_once_with('String')
+        change_count.return_value = 2
+        pb.get_contents.side_effect = lambda type='String': {'PDF': b'%PDF', 'String': None}[type]
+        assert backend.paste() == b'%PDF'
+
+
+def test_macos_facade_skips_redundant_copies_once():
+    from pyclip import base
+    from pyclip.macos_clip import MacOSClip
+
+    class Backend(base.ClipboardBase):
+        copies = 0
+
+        def copy(self, data, encoding=None):
+            self.copies += 1
+
+        def paste(self, encoding=None, text=None, errors=None):
+            return b''
+
+        def clear(self):
+            pass
+
+        def _change_token(self):
+            return 1
+
+    backend = Backend()
+    clip = MacOSClip(_backend=backend)
+    clip.skip_redundant_copies = True
+    assert backend.skip_redundant_copies
+    with mock.patch.object(base, '_copy_digest', wraps=base._copy_digest) as digest:
+        clip.copy(b'same')
+        clip.copy(b'same')
+    assert backend.copies == 1
+    assert digest.call_count == 2  # once per copy, by the backend only
+
+
 @pytest.mark.skipif(sys.platform != 'win32', reason='This test is for Windows only')
 def test_nopywin32_raises_exception():
     with mock.patch.dict('sys.modules', {'win32clipboard': None, 'win32con': None}) as mock_modules:
@@ -169,22 +397,963 @@ def test_xclip_missing_raises_error():
     (["text/html", "TARGETS", "TIMESTAMP", "text/plain"], ["-t", "text/plain"]),
 ])
 def test_xclip_with_target(targets, expected):
+    from pyclip.xclip_clip import XclipClipboard
+    xclip = XclipClipboard()
     with mock.patch.object(subprocess, 'check_output', return_value="\n".join(targets)):
         with mock.patch.object(subprocess, 'run', wraps=subprocess.run) as wrapped_run:
             data = secrets.token_bytes(10)
-            clip.copy(data)
-            assert clip.paste() == data
+            xclip.copy(data)
+            assert xclip.paste() == data
             
     # the expected target was selected
     args = wrapped_run.call_args[0][0]
     assert args[1:] == ['-o', '-selection', 'clipboard'] + expected
 
+def _mock_xclip():
+    from pyclip.xclip_clip import XclipClipboard
+    with mock.patch('shutil.which', return_value='/usr/bin/xclip'):
+        with mock.patch('pyclip.xclip_clip._SelectionChangeProbe', side_effect=OSError):
+            xclip = XclipClipboard()
+    return xclip
+
+
+def test_xclip_paste_with_mime_skips_targets():
+    xclip = _mock_xclip()
+    completed = subprocess.CompletedProcess([], 0, stdout=b'<b>hi</b>', stderr=b'')
+    with mock.patch.object(subprocess, 'check_output') as mock_check_output:
+        with mock.patch.object(subprocess, 'run', return_value=completed) as mock_run:
+            assert xclip.paste(mime='text/html') == b'<b>hi</b>'
+    mock_check_output.assert_not_called()
+    assert mock_run.call_count == 1
+    assert mock_run.call_args[0][0][1:] == ['-o', '-selection', 'clipboard', '-t', 'text/html']
+
+
+def test_xclip_copies_bytes_like_objects_without_copying():
+    import mmap
+    xclip = _mock_xclip()
+    proc = mock.Mock(returncode=0)
+    proc.communicate.return_value = (None, None)
+    buffer = bytearray(b'from a bytearray')
+    mapped = mmap.mmap(-1, 4)
+    mapped.write(b'mmap')
+    with mock.patch.object(subprocess, 'Popen', return_value=proc):
+        xclip.copy(buffer)
+        view = proc.communicate.call_args[0][0]
+        assert view.obj is buffer and bytes(view) == b'from a bytearray'
+        del view
+        xclip.copy(mapped)
+        assert bytes(proc.communicate.call_args[0][0]) == b'mmap'
+        xclip.copy({'image/png': memoryview(b'\x89PNG')})
+        assert bytes(proc.communicate.call_args[0][0]) == b'\x89PNG'
+        with pytest.raises(TypeError):
+            xclip.copy(42)
+    proc.reset_mock()  # drop the recorded views, which keep the mmap from closing
+    mapped.close()
+
+
+def test_xclip_copy_stream_writes_chunks():
+    import io
+    from pyclip.base import ClipboardException
+    xclip = _mock_xclip()
+    proc = mock.Mock()
+    proc.wait.return_value = 0
+    with mock.patch.object(subprocess, 'Popen', return_value=proc) as mock_popen:
+        xclip.copy_stream(io.BytesIO(b'a' * 10), chunk_size=4)
+    assert mock_popen.call_args[0][0][1:] == ['-selection', 'clipboard']
+    assert [c[0][0] for c in proc.stdin.write.call_args_list] == [b'aaaa', b'aaaa', b'aa']
+    proc.stdin.close.assert_called_once()
+    proc.wait.return_value = 1
+    with mock.patch.object(subprocess, 'Popen', return_value=proc):
+        with pytest.raises(ClipboardException):
+            xclip.copy_stream(io.BytesIO(b'a'))
+
+
+def test_xclip_copy_single_format():
+    from pyclip.base import ClipboardException
+    xclip = _mock_xclip()
+    proc = mock.Mock(returncode=0)
+    proc.communicate.return_value = (None, None)
+    with mock.patch.object(subprocess, 'Popen', return_value=proc) as mock_popen:
+        xclip.copy({'text/html': '<b>hi</b>'})
+    assert mock_popen.call_args[0][0][1:] == ['-selection', 'clipboard', '-t', 'text/html']
+    proc.communicate.assert_called_once_with(b'<b>hi</b>')
+    with pytest.raises(ClipboardException):
+        xclip.copy({'text/html': '<b>hi</b>', 'text/plain': 'hi'})
+
+
+def test_xclip_skips_redundant_copies():
+    xclip = _mock_xclip()
+    xclip._change_probe = mock.Mock()
+    xclip._change_probe.owner.return_value = 0x400001
+    xclip.skip_redundant_copies = True
+    proc = mock.Mock(returncode=0)
+    proc.communicate.return_value = (None, None)
+    with mock.patch.object(subprocess, 'Popen', return_value=proc) as mock_popen:
+        xclip.copy('foo')
+        xclip.copy('foo')
+        xclip.copy(b'foo')  # same bytes, different type: copied again
+        xclip.copy(b'foo')
+        assert mock_popen.call_count == 2
+        xclip._change_probe.owner.return_value = 0x600001  # someone else copied
+        xclip.copy(b'foo')
+        assert mock_popen.call_count == 3
+        xclip.skip_redundant_copies = False
+        xclip.copy(b'foo')
+        assert mock_popen.call_count == 4
+
+
+def test_instrumentation_events_and_stats(caplog):
+    import logging
+    from pyclip import instrumentation
+    xclip = _mock_xclip()
+    events = []
+    completed = subprocess.CompletedProcess([], 0, stdout=b'hello', stderr=b'')
+    proc = mock.Mock(returncode=0)
+    proc.communicate.return_value = (None, None)
+    hook = instrumentation.LoggingHook()
+    instrumentation.add_hook(events.append)
+    instrumentation.add_hook(hook)
+    instrumentation.enable_stats()
+    try:
+        with mock.patch.object(subprocess, 'check_output', return_value='TARGETS\ntext/plain\n'):
+            with mock.patch.object(subprocess, 'run', return_value=completed):
+                with caplog.at_level(logging.DEBUG, logger='pyclip'):
+                    assert xclip.paste() == b'hello'
+        with mock.patch.object(subprocess, 'Popen', return_value=proc):
+            xclip.clear()
+        totals = instrumentation.stats()['XclipClipboard']
+    finally:
+        instrumentation.remove_hook(events.append)
+        instrumentation.remove_hook(hook)
+        instrumentation.disable_stats()
+    paste, clear = events
+    assert (paste.backend, paste.operation, paste.bytes, paste.subprocesses) == ('XclipClipboard', 'paste', 5, 2)
+    assert {'negotiate', 'transfer'} <= set(paste.phases)
+    assert paste.error is None
+    assert (clear.operation, clear.subprocesses) == ('clear', 1)  # the copy done by clear is part of its event
+    assert totals['paste']['count'] == 1 and totals['paste']['bytes'] == 5
+    assert caplog.records[0].clipboard_event is paste
+    assert instrumentation.stats() == {}
+
+
+def test_windows_copy_formats_in_one_session():
+    from pyclip.win_clip import WindowsClipboard
+    clip = WindowsClipboard.__new__(WindowsClipboard)
+    clip._clipboard = win32 = mock.MagicMock()
+    win32.__enter__.return_value = win32
+    win32.RegisterClipboardFormat.return_value = 0xC123
+    clip.copy({'text/plain': 'hi', 'HTML Format': b'<b>hi</b>'})
+    win32.__enter__.assert_called_once()
+    win32.__exit__.assert_called_once()
+    assert [c[0] for c in win32.method_calls if c[0] != 'RegisterClipboardFormat'] == [
+        'EmptyClipboard', 'SetClipboardText', 'SetClipboardData'
+    ]
+    win32.SetClipboardText.assert_called_once_with('hi', 13)
+    win32.SetClipboardData.assert_called_once_with(0xC123, b'<b>hi</b>')
+
+
+def test_windows_session_opens_clipboard_once():
+    from pyclip.win_clip import WindowsClipboard, _Win32Clipboard
+    clip = WindowsClipboard.__new__(WindowsClipboard)
+    clip._clipboard = _Win32Clipboard()
+    clip._clipboard._clip = win32 = mock.Mock()
+    global_copy = mock.patch.object(sys.modules['pyclip.win_clip'], '_global_copy', return_value=1)
+    with mock.patch.dict(sys.modules, {'pywintypes': mock.Mock()}), global_copy:
+        with clip.session() as cb:
+            cb.copy('one')
+            cb.clear()
+            cb.copy(b'two')
+            win32.CloseClipboard.assert_not_called()
+    win32.OpenClipboard.assert_called_once_with()
+    win32.CloseClipboard.assert_called_once_with()
+    assert not clip._clipboard._is_open
+
+
+@pytest.fixture
+def fake_win32():
+    """
+    pyclip.win_clip reloaded against stand-in pywin32 modules. Yields the module, the fake win32clipboard,
+    and the pywintypes.error class.
+    """
+    import importlib
+    import types
+    import pyclip.win_clip
+
+    class error(Exception):
+        def __init__(self, winerror, funcname='', strerror=''):
+            super().__init__(winerror, funcname, strerror)
+            self.winerror = winerror
+
+    win32clipboard = types.ModuleType('win32clipboard')
+    for name, value in {'CF_TEXT': 1, 'CF_OEMTEXT': 7, 'CF_DIB': 8, 'CF_UNICODETEXT': 13, 'CF_HDROP': 15}.items():
+        setattr(win32clipboard, name, value)
+    for name in ('OpenClipboard', 'CloseClipboard', 'EmptyClipboard', 'EnumClipboardFormats', 'GetClipboardData',
+                 'SetClipboardData', 'SetClipboardText', 'GetClipboardSequenceNumber', 'RegisterClipboardFormat',
+                 'IsClipboardFormatAvailable'):
+        setattr(win32clipboard, name, mock.Mock(name=name))
+    pywintypes = types.ModuleType('pywintypes')
+    pywintypes.error = error
+    fakes = {'win32clipboard': win32clipboard, 'win32con': types.ModuleType('win32con'), 'pywintypes': pywintypes}
+    with mock.patch.dict(sys.modules, fakes):
+        yield importlib.reload(pyclip.win_clip), win32clipboard, error
+    importlib.reload(pyclip.win_clip)
+
+
+def test_windows_open_retries_with_bounded_backoff(fake_win32):
+    win_clip, win32clipboard, error = fake_win32
+    from pyclip.base import ClipboardException
+    clipboard = win_clip._Win32Clipboard(timeout=1.0)
+    win32clipboard.OpenClipboard.side_effect = [error(5), error(5), error(5), None]
+    with mock.patch('time.sleep') as sleep:
+        with clipboard:
+            assert clipboard._is_open
+    delays = [c[0][0] for c in sleep.call_args_list]
+    assert delays == sorted(delays) and len(delays) == 3 and delays[-1] <= win_clip._MAX_BACKOFF
+    win32clipboard.CloseClipboard.assert_called_once_with()
+
+    win32clipboard.OpenClipboard.side_effect = error(5)
+    start = time.monotonic()
+    with pytest.raises(ClipboardException):
+        clipboard.open(timeout=0.05)
+    assert time.monotonic() - start < 1.0
+    win32clipboard.OpenClipboard.side_effect = error(1400)  # not "held by another program": no retries
+    with mock.patch('time.sleep') as sleep:
+        with pytest.raises(error):
+            clipboard.open()
+    sleep.assert_not_called()
+
+
+def test_windows_paste_cached_by_sequence_number(fake_win32):
+    win_clip, win32clipboard, error = fake_win32
+    clipboard = win_clip.WindowsClipboard()
+    win32clipboard.GetClipboardSequenceNumber.return_value = 7
+    win32clipboard.EnumClipboardFormats.return_value = 13
+    win32clipboard.GetClipboardData.return_value = 'hello\x00'
+    assert clipboard.paste() == b'hello'
+    assert clipboard.paste() == b'hello'
+    assert clipboard.paste(text=True) == 'hello'
+    assert clipboard.paste(text=True) == 'hello'
+    assert win32clipboard.GetClipboardData.call_count == 2  # once per result type
+    assert win32clipboard.OpenClipboard.call_count == 2
+    win32clipboard.GetClipboardSequenceNumber.return_value = 8
+    win32clipboard.GetClipboardData.return_value = 'changed\x00'
+    assert clipboard.paste() == b'changed'
+    assert win32clipboard.GetClipboardData.call_count == 3
+
+
+def test_windows_paste_cache_keyed_on_encoding_and_errors(fake_win32):
+    win_clip, win32clipboard, error = fake_win32
+    clipboard = win_clip.WindowsClipboard()
+    win32clipboard.GetClipboardSequenceNumber.return_value = 7
+    win32clipboard.EnumClipboardFormats.return_value = 13
+    win32clipboard.GetClipboardData.return_value = 'hello\x00'
+    assert clipboard.paste(text=True) == 'hello'
+    clipboard.paste(encoding='utf-16')
+    clipboard.paste(errors='replace')
+    assert win32clipboard.GetClipboardData.call_count == 3
+    clipboard.paste(encoding='utf-16')
+    assert win32clipboard.GetClipboardData.call_count == 3
+
+
+def test_windows_copies_bytes_into_global_memory(fake_win32):
+    import array
+    win_clip, win32clipboard, error = fake_win32
+    allocations = {}
+
+    def global_alloc(flags, size):
+        buffer = ctypes.create_string_buffer(size)
+        allocations[ctypes.addressof(buffer)] = buffer
+        return ctypes.addressof(buffer)
+
+    kernel32 = mock.Mock()
+    kernel32.GlobalAlloc.side_effect = global_alloc
+    kernel32.GlobalLock.side_effect = lambda handle: handle
+    clipboard = win_clip.WindowsClipboard()
+    with mock.patch.object(win_clip, '_kernel32', return_value=kernel32):
+        clipboard.copy(array.array('H', [0x6968, 0x2121]))
+        fmt, handle = win32clipboard.SetClipboardData.call_args[0]
+        assert fmt == 11 and allocations[handle].raw == b'hi!!\0'  # NUL-terminated, as paste expects
+        kernel32.GlobalUnlock.assert_called_once_with(handle)
+        kernel32.GlobalFree.assert_not_called()
+
+        win32clipboard.SetClipboardData.side_effect = error(1418)
+        with pytest.raises(error):
+            clipboard.copy(b'lost')
+        kernel32.GlobalFree.assert_called_once()  # not handed to the clipboard, so freed
+
+
+def test_windows_copy_formats_round_trip_nul_terminated_format(fake_win32):
+    win_clip, win32clipboard, error = fake_win32
+    allocations = {}
+
+    def global_alloc(flags, size):
+        buffer = ctypes.create_string_buffer(size)
+        allocations[ctypes.addressof(buffer)] = buffer
+        return ctypes.addressof(buffer)
+
+    kernel32 = mock.Mock()
+    kernel32.GlobalAlloc.side_effect = global_alloc
+    kernel32.GlobalLock.side_effect = lambda handle: handle
+    win32clipboard.CF_RIFF = 11
+    win32clipboard.RegisterClipboardFormat.return_value = 0xC000
+    clipboard = win_clip.WindowsClipboard()
+    with mock.patch.object(win_clip, '_kernel32', return_value=kernel32):
+        clipboard.copy({'CF_RIFF': b'RIFF\x01', 'text/html': b'<b>hi</b>', 'text/plain': 'hi'})
+    stored = {c[0][0]: c[0][1] for c in win32clipboard.SetClipboardData.call_args_list}
+    assert bytes(stored[0xC000]) == b'<b>hi</b>'
+    kernel32.GlobalFree.assert_not_called()
+    win32clipboard.GetClipboardSequenceNumber.return_value = 1
+    win32clipboard.EnumClipboardFormats.side_effect = lambda previous=0: 0 if previous else 11
+    win32clipboard.GetClipboardData.return_value = allocations[stored[11]].raw
+    assert clipboard.paste() == b'RIFF\x01'  # the last byte survives the round trip
+
+
+def test_windows_paste_files_streams_from_disk(fake_win32, tmp_path):
+    win_clip, win32clipboard, error = fake_win32
+    clipboard = win_clip.WindowsClipboard()
+    first, second = tmp_path / 'first.bin', tmp_path / 'second.bin'
+    first.write_bytes(b'a' * 200_000)
+    second.write_bytes(b'second file')
+    win32clipboard.GetClipboardSequenceNumber.return_value = 3
+    win32clipboard.EnumClipboardFormats.return_value = 15
+    win32clipboard.IsClipboardFormatAvailable.return_value = True
+    win32clipboard.GetClipboardData.return_value = (str(first), str(second), str(tmp_path))
+    files = clipboard.paste_files()
+    assert [f.path for f in files] == [str(first), str(second), str(tmp_path)]
+    assert files[0].size == 200_000 and files[2].is_dir()
+    with files[1].open() as f:
+        assert f.read() == b'second file'
+    with contextlib.closing(files[0].mmap()) as m:
+        assert m[:3] == b'aaa' and len(m) == 200_000
+    with pytest.raises(win_clip.ClipboardException, match='paste_files'):
+        clipboard.paste()
+
+    win32clipboard.GetClipboardData.return_value = (str(first),)
+    with mock.patch.object(win_clip.PastedFile, 'open', side_effect=win_clip.PastedFile.open, autospec=True) as open_:
+        chunks = list(clipboard.iter_paste(chunk_size=65536))
+    open_.assert_called_once()
+    assert [len(c) for c in chunks] == [65536, 65536, 65536, 200_000 - 3 * 65536]
+    assert clipboard.paste_to_file(tmp_path / 'out.bin') == 200_000
+    assert clipboard.paste() == first.read_bytes()
+
+    win32clipboard.IsClipboardFormatAvailable.return_value = False
+    assert clipboard.paste_files() == []
+
+
+def test_xclip_targets_cached_until_owner_changes():
+    xclip = _mock_xclip()
+    xclip._change_probe = mock.Mock()
+    xclip._change_probe.changed.return_value = False
+    targets = "TARGETS\nTIMESTAMP\ntext/plain"
+    with mock.patch.object(subprocess, 'check_output', return_value=targets) as mock_check_output:
+        assert xclip.list_targets() == ['TARGETS', 'TIMESTAMP', 'text/plain']
+        assert xclip.list_targets() == ['TARGETS', 'TIMESTAMP', 'text/plain']
+        assert mock_check_output.call_count == 1
+        xclip._change_probe.changed.return_value = True
+        xclip.list_targets()
+        assert mock_check_output.call_count == 2
+
+
+def _xlib_available():
+    try:
+        import Xlib
+    except ImportError:
+        return False
+    return bool(os.environ.get("DISPLAY"))
+
+
+@pytest.mark.skipif(sys.platform != 'linux' or not _xlib_available(), reason='This test requires python-xlib and an X display')
+def test_xlib_copypaste():
+    from pyclip.xlib_clip import XlibClipboard
+    xlib = XlibClipboard(persist=False)
+    data = secrets.token_bytes(1024)
+    xlib.copy(data)
+    assert xlib.paste() == data
+    xlib.copy('foo')
+    assert 'UTF8_STRING' in xlib.list_targets()
+    assert xlib.paste(text=True) == 'foo'
+    xlib.clear()
+    assert not xlib.paste()
+
+
+@pytest.mark.skipif(sys.platform != 'linux' or not _xlib_available(), reason='This test requires python-xlib and an X display')
+def test_xlib_paste_from_other_owner():
+    from pyclip.xlib_clip import XlibClipboard
+    owner = XlibClipboard(persist=False)
+    reader = XlibClipboard(persist=False)
+    owner.copy('hello from another client')
+    assert reader.paste() == b'hello from another client'
+    assert 'TARGETS' in reader.list_targets()
+
+
+def test_xclip_selection_probe_survives_losing_the_x_server():
+    from pyclip.base import ClipboardException
+    from pyclip.xclip_clip import _SelectionChangeProbe
+    x11, xfixes = mock.Mock(), mock.Mock()
+    x11.XOpenDisplay.return_value = 1234
+    x11.XPending.return_value = 0
+    xfixes.XFixesQueryExtension.return_value = 0
+    with mock.patch('ctypes.util.find_library', return_value='libfake.so'), \
+            mock.patch('ctypes.CDLL', side_effect=[x11, xfixes]):
+        with pytest.raises(OSError):
+            _SelectionChangeProbe()
+    x11.XCloseDisplay.assert_called_once_with(1234)  # not leaked when XFixes is missing
+
+    x11.reset_mock()
+    xfixes.XFixesQueryExtension.return_value = 1
+    x11.XGetSelectionOwner.return_value = 99
+    with mock.patch('ctypes.util.find_library', return_value='libfake.so'), \
+            mock.patch('ctypes.CDLL', side_effect=[x11, xfixes]):
+        probe = _SelectionChangeProbe()
+    assert not probe.changed() and probe.owner() == 99
+    exit_handler = x11.XSetIOErrorExitHandler.call_args[0][1]
+    x11.XSync.side_effect = lambda dpy, discard: exit_handler(dpy, None)  # what Xlib does instead of exit()
+    assert probe.changed()
+    assert probe.owner() == 0
+    with pytest.raises(ClipboardException):
+        probe.wait(0)
+    probe.close()
+    x11.XCloseDisplay.assert_called_once_with(1234)
+
+
+def test_xlib_server_time_ignores_stale_notifications():
+    import threading
+    from types import SimpleNamespace
+    X = pytest.importorskip('Xlib.X')
+    from pyclip.xlib_clip import XlibClipboard
+    xlib = XlibClipboard.__new__(XlibClipboard)
+    xlib._property = 42
+    xlib._window = mock.Mock(id=7)
+    xlib._display = mock.Mock()
+    xlib._cond = threading.Condition()
+
+    def notify(state, time, atom=42):
+        return SimpleNamespace(type=X.PropertyNotify, atom=atom, state=state, time=time, window=xlib._window)
+
+    other = notify(X.PropertyNewValue, 5, atom=43)
+    # left behind by the deletion at the end of an earlier paste
+    xlib._events = [notify(X.PropertyDelete, 10), other]
+    xlib._window.change_property.side_effect = lambda *args, **kwargs: xlib._events.append(
+        notify(X.PropertyNewValue, 20)
+    )
+    assert xlib._server_time() == 20
+    assert xlib._events == [other]  # still there for whoever waits for it
+
+
+@pytest.mark.skipif(sys.platform != 'linux' or not _xlib_available(), reason='This test requires python-xlib and an X display')
+def test_xlib_incr_transfer():
+    from pyclip.xlib_clip import XlibClipboard
+    progress = []
+    owner = XlibClipboard(persist=False)
+    reader = XlibClipboard(persist=False, progress=lambda *args: progress.append(args))
+    data = secrets.token_bytes(5 * 1024 * 1024 + 1)
+    owner.copy({'application/octet-stream': data})
+    assert reader.paste(mime='application/octet-stream') == data
+    assert progress[-1] == ('paste', len(data), len(data))
+    assert b''.join(reader.iter_paste(mime='application/octet-stream')) == data
+
+
+def _xlib_incr_stub(max_request_length=1024):
+    from pyclip.xlib_clip import XlibClipboard
+    xlib = XlibClipboard.__new__(XlibClipboard)
+    xlib._display = mock.Mock()
+    xlib._display.display.info.max_request_length = max_request_length
+    xlib._window = mock.Mock(id=1)
+    xlib._property, xlib._incr_atom, xlib._targets_atom, xlib._timestamp_atom = 10, 11, 12, 13
+    xlib._incr_sends = {}
+    xlib._progress = None
+    return xlib
+
+
+def test_xlib_serves_large_contents_incrementally():
+    pytest.importorskip('Xlib')
+    from Xlib import X
+    xlib = _xlib_incr_stub()
+    chunk_size = 1024 * 4 - 24
+    data = secrets.token_bytes(chunk_size * 2 + 5)
+    xlib._contents = {20: data}
+    requestor = mock.Mock(id=7)
+    xlib._handle_selection_request(mock.Mock(requestor=requestor, property=30, target=20, selection=40, time=0))
+    requestor.change_property.assert_called_once_with(30, 11, 32, [len(data)])
+    requestor.send_event.assert_called_once()
+    deleted = mock.Mock(type=X.PropertyNotify, state=X.PropertyDelete, window=requestor, atom=30)
+    for _ in range(4):
+        xlib._handle_event(deleted)
+    chunks = [c[0][3] for c in requestor.change_property.call_args_list[1:]]
+    assert [len(c) for c in chunks] == [chunk_size, chunk_size, 5, 0]
+    assert b''.join(chunks) == data
+    assert not xlib._incr_sends
+    requestor.change_attributes.assert_called_with(event_mask=X.NoEventMask)
+
+
+def test_xlib_pastes_incr_transfer():
+    pytest.importorskip('Xlib')
+    from pyclip.xlib_clip import _IncrReader
+    xlib = _xlib_incr_stub()
+    progress = []
+    xlib._progress = lambda *args: progress.append(args)
+    xlib._wait_for = mock.Mock()
+    chunks = [b'a' * 3000, b'b' * 3000, b'c', b'']
+    xlib._window.get_full_property.side_effect = [mock.Mock(format=8, value=c) for c in chunks]
+    with _IncrReader(xlib, 6000) as reader:
+        assert reader.read() == b''.join(chunks)
+    assert xlib._window.delete_property.call_count == 4
+    assert progress == [('paste', 3000, 6000), ('paste', 6000, 6000), ('paste', 6001, 6000)]
+
+
+def test_xlib_incr_paste_with_server_event_order():
+    pytest.importorskip('Xlib')
+    import threading
+    from types import SimpleNamespace
+    from Xlib import X
+    xlib = _xlib_incr_stub()
+    xlib._selection, xlib._contents = 40, {}
+    xlib._cond, xlib._events, xlib._paste_lock = threading.Condition(), [], threading.Lock()
+    chunks = [b'a' * 3000, b'b' * 3000, b'c', b'']
+    window = xlib._window
+    properties = {}
+
+    def queue(**event):
+        with xlib._cond:
+            xlib._events.append(SimpleNamespace(window=window, **event))
+            xlib._cond.notify_all()
+
+    def write(value, property_type=20):
+        properties[10] = mock.Mock(format=8 if property_type == 20 else 32, value=value, property_type=property_type)
+        queue(type=X.PropertyNotify, atom=10, state=X.PropertyNewValue)
+
+    def convert_selection(selection, target, prop, time):
+        write([6001], property_type=xlib._incr_atom)  # its notification precedes the SelectionNotify
+        queue(type=X.SelectionNotify, selection=selection, target=target, property=prop)
+
+    def delete_property(prop):
+        properties.pop(prop, None)
+        queue(type=X.PropertyNotify, atom=prop, state=X.PropertyDelete)
+        if chunks:  # the owner answers a little later, as a separate client would
+            threading.Timer(0.02, write, args=(chunks.pop(0),)).start()
+
+    window.convert_selection.side_effect = convert_selection
+    window.delete_property.side_effect = delete_property
+    window.get_full_property.side_effect = lambda prop, *args, **kwargs: properties.get(prop)
+    assert xlib._read_target(20) == b'a' * 3000 + b'b' * 3000 + b'c'
+
+
+def test_xlib_missing_raises_error():
+    with mock.patch('pyclip.xlib_clip._Display', new=None):
+        from pyclip.xlib_clip import XlibClipboard, ClipboardSetupException
+        with pytest.raises(ClipboardSetupException):
+            XlibClipboard()
+
+
+@pytest.fixture
+def fake_compositor(tmp_path, monkeypatch):
+    from fake_wayland_compositor import FakeCompositor
+    compositor = FakeCompositor(str(tmp_path / 'wayland-test'))
+    monkeypatch.setenv('WAYLAND_DISPLAY', compositor.path)
+    yield compositor
+    compositor.close()
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='This test is for Linux only')
+def test_wayland_datacontrol_copypaste(fake_compositor):
+    from pyclip.wayland_datacontrol_clip import WaylandDataControlClipboard
+    first = WaylandDataControlClipboard(persist=False)
+    second = WaylandDataControlClipboard(persist=False)
+    data = secrets.token_bytes(1024)
+    first.copy(data)
+    assert first.paste() == data
+    assert second.paste() == data
+    assert b''.join(second.iter_paste(chunk_size=100)) == data
+    assert 'text/plain;charset=utf-8' in second.list_targets()
+    second.copy('foo')
+    assert first.paste(text=True) == 'foo'
+    assert first.paste(mime='text/plain') == b'foo'
+    first.clear()
+    assert not second.paste()
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='This test is for Linux only')
+def test_wayland_datacontrol_copy_formats(fake_compositor):
+    from pyclip.wayland_datacontrol_clip import WaylandDataControlClipboard
+    first = WaylandDataControlClipboard(persist=False)
+    second = WaylandDataControlClipboard(persist=False)
+    first.copy({'text/html': '<b>hi</b>', 'text/plain': 'hi', 'image/png': b'\x89PNG'})
+    targets = second.list_targets()
+    assert {'text/html', 'text/plain', 'UTF8_STRING', 'image/png'} <= set(targets)
+    assert second.paste(mime='text/html') == b'<b>hi</b>'
+    assert second.paste(mime='image/png') == b'\x89PNG'
+    assert second.paste() == b'hi'
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='This test is for Linux only')
+def test_wayland_datacontrol_event_loop_survives_unknown_offers():
+    import socket
+    import struct
+    import threading
+    from fake_wayland_compositor import _pack_string
+    from pyclip.wayland_datacontrol_clip import WaylandDataControlClipboard, _ArgReader
+    clip = WaylandDataControlClipboard.__new__(WaylandDataControlClipboard)
+    clip._prefix = 'zwlr_data_control_'
+    clip._objects = {1: 'wl_display', 5: 'zwlr_data_control_offer_v1'}
+    clip._offers = {}
+    clip._dispatch(5, 0, _ArgReader(_pack_string('text/plain'), []))  # an offer already destroyed
+    clip._cond = threading.Condition()
+    clip._closed = False
+    clip._sock, compositor = socket.socketpair()
+    with clip._sock, compositor:
+        compositor.sendall(struct.pack('=II', 5, 8 << 16))
+        with mock.patch.object(clip, '_dispatch', side_effect=ValueError('malformed')):
+            with pytest.raises(ValueError):
+                clip._event_loop()
+    assert clip._closed
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='This test is for Linux only')
+def test_wayland_datacontrol_unsupported_compositor(fake_compositor):
+    from pyclip.wayland_datacontrol_clip import WaylandDataControlClipboard, ClipboardSetupException
+    fake_compositor.globals = [('wl_seat', 7)]
+    with pytest.raises(ClipboardSetupException):
+        WaylandDataControlClipboard(persist=False)
+
+
 def test_unknown_platform_raises_error():
-    from pyclip.util import detect_clipboard, ClipboardSetupException
+    from pyclip.base import ClipboardSetupException
+    from pyclip.util import detect_clipboard
     with mock.patch('sys.platform', new='unknown'):
         with pytest.raises(ClipboardSetupException):
             c = detect_clipboard()
 
+def test_registry_selects_fastest_backend_and_caches_choice(tmp_path, monkeypatch):
+    from pyclip import registry
+    from pyclip.base import ClipboardBase
+
+    created = []
+    released = []
+
+    def make_backend(name, delay):
+        class SleepyClipboard(ClipboardBase):
+            def __init__(self):
+                created.append(name)
+
+            def release(self):
+                released.append(name)
+
+            def copy(self, data, encoding=None):
+                pass
+
+            def paste(self, encoding=None, text=None, errors=None):
+                time.sleep(delay)
+                return b''
+
+            def clear(self):
+                pass
+
+        return registry.Backend(name, SleepyClipboard, priority=len(created))
+
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.delenv('PYCLIP_BACKEND', raising=False)
+    with mock.patch.dict(registry._BACKENDS, clear=True), mock.patch.object(registry, '_ENTRY_POINTS_LOADED', True):
+        registry.register_backend(make_backend('slow', 0.05))
+        registry.register_backend(make_backend('fast', 0))
+        registry.register_backend(registry.Backend('elsewhere', 'no.such:module', platforms=['plan9']))
+        assert [b.name for b in registry.candidates()] == ['slow', 'fast']
+        registry.select_backend()
+        assert created == ['slow', 'fast']
+        assert released == ['slow']  # the instance that was not chosen does not keep its resources
+        assert (tmp_path / 'pyclip' / 'backend.json').exists()
+        created.clear()
+        registry.select_backend()
+        assert created == ['fast']  # not probed again
+        monkeypatch.setenv('PYCLIP_BACKEND', 'slow')
+        created.clear()
+        registry.select_backend()
+        assert created == ['slow']
+
+
+def test_registry_does_not_cache_unmeasured_choice(tmp_path, monkeypatch):
+    from pyclip import registry
+    from pyclip.base import ClipboardBase, ClipboardException
+
+    class EmptyClipboard(ClipboardBase):
+        def copy(self, data, encoding=None):
+            pass
+
+        def paste(self, encoding=None, text=None, errors=None):
+            raise ClipboardException('the clipboard is empty')
+
+        def clear(self):
+            pass
+
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.delenv('PYCLIP_BACKEND', raising=False)
+    with mock.patch.dict(registry._BACKENDS, clear=True), mock.patch.object(registry, '_ENTRY_POINTS_LOADED', True):
+        registry.register_backend(registry.Backend('first', EmptyClipboard, priority=1))
+        registry.register_backend(registry.Backend('second', EmptyClipboard, priority=0))
+        assert isinstance(registry.select_backend(), EmptyClipboard)
+    assert not (tmp_path / 'pyclip' / 'backend.json').exists()  # measured again next time
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='The daemon uses Unix domain sockets')
+def test_daemon_serves_clipboard(tmp_path):
+    import threading
+    from pyclip import daemon
+    from pyclip.base import ClipboardBase, ClipboardException
+
+    class MemoryClipboard(ClipboardBase):
+        def __init__(self):
+            self.data = {}
+
+        def copy(self, data, encoding=None):
+            self.data = data if isinstance(data, dict) else {'text/plain': data}
+
+        def paste(self, encoding=None, text=None, errors=None, mime='text/plain'):
+            if mime not in self.data:
+                raise ClipboardException(f'no {mime}')
+            return self.data[mime]
+
+        def clear(self):
+            self.data = {}
+
+    path = str(tmp_path / 'daemon.sock')
+    server = daemon._Server(path, MemoryClipboard())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert daemon.is_running(path)
+        client = daemon.DaemonClipboard(path)
+        client.copy('héllo')
+        assert client.paste() == 'héllo'.encode()
+        assert client.paste(text=True) == 'héllo'
+        client.copy({'text/html': '<b>hi</b>', 'text/plain': b'hi'})
+        assert client.paste(mime='text/html') == b'<b>hi</b>'
+        client.clear()
+        with pytest.raises(ClipboardException):
+            client.paste()
+        other = threading.Thread(target=daemon.DaemonClipboard(path).copy, args=(b'other',))
+        with client.session() as cb:
+            cb.copy(b'mine')
+            other.start()
+            other.join(0.2)
+            assert other.is_alive()  # waits for the session to end
+            assert cb.paste() == b'mine'
+        other.join(5)
+        assert client.paste() == b'other'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='The daemon uses Unix domain sockets')
+def test_daemon_client_falls_back_without_daemon(tmp_path):
+    import socket
+    import struct
+    import threading
+    from pyclip import daemon
+    fallback = mock.Mock()
+    fallback.paste.return_value = b'direct'
+    with mock.patch('pyclip.registry.select_backend', return_value=fallback):
+        client = daemon.DaemonClipboard(str(tmp_path / 'missing.sock'))
+        assert not daemon.is_running(client.path)
+        assert client.paste() == b'direct'
+        client.copy('foo')
+    fallback.copy.assert_called_once_with('foo', encoding=None)
+
+    served = mock.Mock()
+    served.paste.return_value = b'from the daemon'
+    server = daemon._Server(client.path, served)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert client.paste() == b'direct'  # not tried again until the back-off has passed
+        with mock.patch.object(daemon.time, 'monotonic', return_value=time.monotonic() + daemon._MIN_RETRY):
+            assert client.paste() == b'from the daemon'  # a daemon started later is picked up
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    a, b = socket.socketpair()
+    with a, b:
+        header = b'{"ok": true, "length": %d}' % (daemon._MAX_PAYLOAD + 1)
+        a.sendall(struct.pack('!I', len(header)) + header)
+        with pytest.raises(ConnectionError):
+            daemon._recv_message(b)
+
+
+def test_daemon_refuses_sockets_not_private_to_the_user(tmp_path):
+    import socket
+    from pyclip import daemon
+    from pyclip.base import ClipboardSetupException
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o755)
+    path = str(shared / 'daemon.sock')
+    with pytest.raises(ClipboardSetupException):
+        daemon.serve(path, clipboard=mock.Mock())
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    with listener:
+        assert not daemon.is_running(path)
+        with pytest.raises(ClipboardSetupException):
+            daemon.DaemonClipboard(path).paste()
+    a, b = socket.socketpair()
+    with a, b:
+        daemon._check_peer(a)
+        with mock.patch.object(daemon.os, 'getuid', return_value=os.getuid() + 1):
+            with pytest.raises(ClipboardSetupException):
+                daemon._check_peer(a)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='The spawn server requires a POSIX platform')
+def test_spawn_server_starts_helpers():
+    import io
+    import shutil
+    from pyclip import spawn
+    # _ServerPopen overrides private subprocess.Popen methods; this fails on an interpreter where they changed
+    assert spawn._proxy_supported(), f'spawn server not supported on Python {sys.version}'
+    spawn.start()
+    try:
+        assert spawn.is_running()
+        server_pid = spawn._SERVER._process.pid
+        code = 'import os, sys; print(os.getppid()); sys.stdout.write(sys.stdin.read().upper())'
+        result = spawn.run([sys.executable, '-c', code], input=b'hello', stdout=subprocess.PIPE)
+        assert result.stdout == f'{server_pid}\nHELLO'.encode()  # a child of the server, not of this process
+        assert spawn.check_output(['sh', '-c', 'echo $PYCLIP_TEST'], env={'PYCLIP_TEST': 'env'}, text=True) == 'env\n'
+        proc = spawn.Popen(['sleep', '10'])
+        assert proc.poll() is None
+        proc.kill()
+        assert proc.wait(timeout=5) == -9
+        with pytest.raises(subprocess.CalledProcessError):
+            spawn.check_output(['sh', '-c', 'exit 3'])
+        with pytest.raises(FileNotFoundError):
+            spawn.Popen(['/nonexistent/helper'])
+        with pytest.raises(subprocess.TimeoutExpired) as expired:
+            spawn.run(['sh', '-c', 'echo started; exec sleep 10'], stdout=subprocess.PIPE, timeout=0.5)
+        assert expired.value.stdout == b'started\n'
+        if shutil.which('xclip'):
+            from pyclip.xclip_clip import XclipClipboard
+            xclip = XclipClipboard()
+            with mock.patch.object(spawn._SERVER, 'spawn', wraps=spawn._SERVER.spawn) as server_spawn:
+                xclip.copy_stream(io.BytesIO(b'through the spawn server'))
+                assert xclip.paste() == b'through the spawn server'
+            assert server_spawn.call_count >= 2
+    finally:
+        spawn.stop()
+    assert not spawn.is_running()
+    with spawn.Popen(['true']) as proc:
+        assert type(proc) is subprocess.Popen
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='The spawn server requires a POSIX platform')
+def test_aio_helpers_use_spawn_server(tmp_path):
+    import asyncio
+    from pyclip import spawn
+    from pyclip.aio import AsyncClipboard
+    from pyclip.base import SubprocessClipboardBase
+    store = tmp_path / 'clipboard'
+
+    class HelperClipboard(SubprocessClipboardBase):
+        def _copy_args(self, mime=None):
+            code = 'import os, sys; open(sys.argv[1], "w").write(f"{os.getppid()}:{sys.stdin.read()}")'
+            return [sys.executable, '-c', code, str(store)]
+
+        def _paste_args(self, mime=None):
+            return [sys.executable, '-c', 'import sys; sys.stdout.write(open(sys.argv[1]).read())', str(store)]
+
+        def copy(self, data, encoding=None):
+            raise AssertionError('AsyncClipboard runs the helpers itself')
+
+        paste = clear = copy
+
+    aclip = AsyncClipboard(HelperClipboard())
+
+    async def roundtrip():
+        await aclip.copy(b'hello')
+        return await aclip.paste()
+
+    spawn.start()
+    try:
+        server_pid = spawn._SERVER._process.pid
+        assert asyncio.run(roundtrip()) == f'{server_pid}:hello'.encode()  # started by the server
+    finally:
+        spawn.stop()
+    assert asyncio.run(roundtrip()) == f'{os.getpid()}:hello'.encode()  # and directly without it
+
+
+def test_history_dedup_eviction_and_search(tmp_path):
+    from pyclip.history import History
+    with History(str(tmp_path / 'history.sqlite3'), max_entries=3) as history:
+        first = history.add('the quick brown fox')
+        history.add(b'\x00\x01binary')
+        assert history.add('the quick brown fox').id == first.id
+        assert len(history) == 2
+        assert history.get(first.id[:8]).uses == 2
+        history.add('lazy dog')
+        history.add('QUICK thinking')
+        assert len(history) == 3  # the least recently used (binary) entry was evicted
+        assert [e.text for e in history.search('quick')] == ['QUICK thinking', 'the quick brown fox']
+        assert [e.text for e in history.search('og')] == ['lazy dog']
+        clipboard = mock.Mock()
+        history.restore(first.id[:6], clipboard=clipboard)
+        clipboard.copy.assert_called_once_with(b'the quick brown fox')
+        assert history.entries(limit=1)[0].id == first.id
+        with pytest.raises(KeyError):
+            history.get('zz')
+
+
+def test_history_record_stores_pasted_mime(tmp_path):
+    from pyclip.base import ClipboardException
+    from pyclip.history import History
+    clipboard = mock.Mock()
+    clipboard.paste.return_value = b'<b>first</b>'
+    clipboard.watch.return_value = iter([b'\x89PNG', b'unknown'])
+    clipboard._paste_mime.side_effect = ['text/html', 'image/png', ClipboardException('owner went away')]
+    with History(str(tmp_path / 'history.sqlite3')) as history:
+        history.record(clipboard)
+        assert {e.text or e.size: e.mime for e in history.entries()} == {
+            '<b>first</b>': 'text/html', 4: 'image/png', 'unknown': None
+        }
+
+
+def test_cli_history(tmp_path, capsys):
+    from pyclip.cli import main
+    from pyclip.history import History
+    db = str(tmp_path / 'history.sqlite3')
+    with History(db) as history:
+        entry = history.add('hello history')
+    with mock.patch('sys.exit', new=lambda x: x):
+        with mock.patch('sys.argv', new=['pyclip', 'history', '--db', db, 'search', 'hist']):
+            main()
+        assert capsys.readouterr().out.startswith(entry.id[:12])
+        with mock.patch('sys.argv', new=['pyclip', 'history', '--db', db, 'restore', entry.id[:12]]):
+            main()
+    assert clip.paste() == b'hello history'
+
+
+def test_cli_watch():
+    import io
+    import json
+    from pyclip.cli import main
+    from pyclip.history import content_hash
+    clipboard = mock.MagicMock()
+    clipboard.session.return_value.__enter__.return_value = clipboard
+    clipboard.watch.return_value = iter([b'outdated'] * 3)
+    clipboard.paste.side_effect = [b'hello', b'\xff' * 10, 'hhh\u00e9'.encode()]
+    clipboard.list_targets.side_effect = [['TARGETS', 'text/plain'], ['image/png'], ['text/plain']]
+    stdout = mock.Mock(buffer=io.BytesIO())
+    argv = ['pyclip', 'watch', '-0', '--content', '4']
+    with mock.patch('sys.exit', new=lambda x: x), mock.patch('sys.argv', new=argv), mock.patch('sys.stdout', new=stdout):
+        with mock.patch('pyclip._get_clipboard', return_value=clipboard):
+            main()
+    first, second, third, rest = stdout.buffer.getvalue().split(b'\0')
+    assert rest == b''
+    first, second, third = json.loads(first), json.loads(second), json.loads(third)
+    # targets and contents of the same snapshot, not the contents watch read earlier
+    assert first['mime_types'] == ['TARGETS', 'text/plain'] and first['size'] == 5
+    assert first['hash'] == content_hash(b'hello')  # the id of the contents in pyclip history
+    assert first['content'] == 'hell' and first['truncated']
+    assert second['content_base64'] == '/////w==' and second['size'] == 10
+    assert third['content'] == 'hhh' and third['truncated']  # cut inside a character: still text
+
+
 class MockProcess:
     def communicate(self, *args, **kwargs):
         self.returncode = 1
@@ -206,12 +1375,28 @@ class MockSubprocessRun:
 
 
 
+def test_wayland_paste_mime():
+    from pyclip import wayland_clip
+    with mock.patch.object(wayland_clip.shutil, 'which', side_effect=lambda name: f'/usr/bin/{name}'):
+        clip = wayland_clip.WaylandClipboard()
+    completed = subprocess.CompletedProcess([], 0, stdout=b'<b>hi</b>', stderr=b'')
+    with mock.patch.object(wayland_clip.spawn, 'run', return_value=completed) as run:
+        assert clip.paste(mime='text/html') == b'<b>hi</b>'
+    assert run.call_args[0][0] == ['/usr/bin/wl-paste', '--no-newline', '--type', 'text/html']
+
+
 @pytest.mark.skipif(sys.platform == 'win32', reason='Windows backend does not use subprocess')
 def test_subprocess_fails_raises_clipboardexception_copy():
     from pyclip.base import ClipboardException
     if sys.platform == 'darwin':
         from pyclip.macos_clip import _PBCopyPBPasteBackend
         clip = _PBCopyPBPasteBackend()
+    elif sys.platform == 'linux' and os.environ.get("WAYLAND_DISPLAY"):
+        from pyclip.wayland_clip import WaylandClipboard
+        clip = WaylandClipboard()
+    elif sys.platform == 'linux':
+        from pyclip.xclip_clip import XclipClipboard
+        clip = XclipClipboard()
     else:
         import pyclip as clip
     with mock.patch('subprocess.Popen', new=MockPopen()):
@@ -224,6 +1409,12 @@ def test_subprocess_fails_raises_clipboardexception_paste():
     if sys.platform == 'darwin':
         from pyclip.macos_clip import _PBCopyPBPasteBackend
         clip = _PBCopyPBPasteBackend()
+    elif sys.platform == 'linux' and os.environ.get("WAYLAND_DISPLAY"):
+        from pyclip.wayland_clip import WaylandClipboard
+        clip = WaylandClipboard()
+    elif sys.platform == 'linux':
+        from pyclip.xclip_clip import XclipClipboard
+        clip = XclipClipboard()
     else:
         import pyclip as clip
     with mock.patch('subprocess.run', new=MockSubprocessRun()):